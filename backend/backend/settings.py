@@ -137,6 +137,143 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'inference.renderers.FastJSONRenderer',
+        'inference.renderers.MessagePackRenderer',
     ],
 }
+
+# レスポンスのレンダリング設定（inference.renderers）
+# DEFAULT_RENDERER_CLASSES は DRF 標準の JSONRenderer（と BrowsableAPIRenderer）を置き換える。
+# JSON は orjson（未インストール時は標準の json）、Accept: application/msgpack で MessagePack を返す。
+# orjson の出力は JSONRenderer と同じだが、指数表記の float は 1e-5 の形式になり（値は同じ）、
+# NaN / Infinity は JSONRenderer のようにエラーにならず null になる。
+# float は FLOAT_PRECISION 桁（小数点以下）に丸める。リクエストごとに Accept の precision パラメータで上書き可能
+INFERENCE_RENDERING = {
+    'FLOAT_PRECISION': None,         # None の場合は丸めない
+    'MSGPACK_SINGLE_FLOAT': False,   # MessagePack の float を単精度で出力（Accept の float=32 でも指定可能）
+}
+
+# CPU推論ワーカー設定（None の項目はワーカー数・コア数から自動算出）
+# ワーカー数は WORKERS、未設定時は INFERENCE_WORKERS / WEB_CONCURRENCY 環境変数を参照
+INFERENCE_CPU_CONFIG = {
+    'ENABLED': True,
+    'WORKERS': None,
+    'THREADS_PER_WORKER': None,
+    'INTEROP_THREADS': None,
+    'PIN_CORES': False,
+}
+
+# 起動時のモデル事前読み込み・ウォームアップ設定
+# アプリケーションサーバー（runserver/gunicorn等）起動時のみ実行し、完了するまで /readyz は 503 を返す
+# 環境変数 INFERENCE_WARMUP=1/0 で強制的に有効/無効化できる
+INFERENCE_WARMUP = {
+    'ENABLED': True,
+    'BATCH_SIZES': [1, 4],
+    'ITERATIONS': 2,
+    'REQUIRE_ALL_APPS': True,   # 読み込み・ウォームアップに失敗したアプリがあれば /readyz は 503 のまま
+}
+
+# バッチサイズ自動調整設定
+# p99レイテンシが目標以下となる最大のバッチサイズを選択（アプリごとに
+# model_optimization['p99_latency_target'] で上書き可能）
+INFERENCE_AUTOTUNE = {
+    'P99_LATENCY_TARGET': 0.2,
+    'CANDIDATE_BATCH_SIZES': [1, 2, 4, 8, 16, 32, 64],
+    'ITERATIONS': 20,
+    'ON_WARMUP': False,
+}
+
+# アップロード画像のデコード設定
+# ヘッダーで上限を確認してから、JPEGはDCTスケーリング、その他はreduceで推論サイズ付近まで縮小する
+INFERENCE_IMAGE_DECODE = {
+    'TARGET_SIZE': (224, 224),
+    'MAX_UPLOAD_BYTES': 20 * 1024 * 1024,       # アップロード1件あたりのバイト数上限
+    'MAX_TENSOR_BYTES': 8 * 1024 * 1024,        # predict_tensor のボディのバイト数上限（前処理済み配列）
+    'MAX_PIXELS': 100_000_000,                  # ヘッダー上のピクセル数上限（展開爆弾対策）
+    'MAX_DECODE_BYTES': 256 * 1024 * 1024,      # 1件のデコードに必要なメモリの上限
+    'MEMORY_BUDGET_BYTES': 512 * 1024 * 1024,   # プロセス全体で同時にデコードに使うメモリの上限
+    'MEMORY_WAIT_TIMEOUT': 10,                  # 予算待ちのタイムアウト（秒）
+    'STREAMING_DECODE': True,                   # 受信中にデコードする（JPEG 等の増分デコードできる形式のみ）
+}
+
+# 前処理済みテンソルキャッシュ（再推論・ベンチマーク用）
+# リサイズ済みの uint8 配列を前処理設定ごとに1つの配列ファイル＋インデックスで保存する
+INFERENCE_TENSOR_CACHE = {
+    'ENABLED': False,
+    'DIRECTORY': BASE_DIR / 'tensor_cache',
+}
+
+# 保存済みアップロード画像の埋め込みストア（embeddings API の upload_ids）
+# 分類層直前の特徴量を float16 でバックボーンごとに1つの配列ファイル＋インデックスで保存する
+# manage.py build_embeddings / retrain_head は ENABLED に関わらず使用する
+INFERENCE_EMBEDDING_STORE = {
+    'ENABLED': False,
+    'DIRECTORY': BASE_DIR / 'embedding_store',
+}
+
+# 候補モデルのシャドー推論（A/B評価）
+# アプリごとに model_optimization['shadow'] = {'model_file_path': ..., 'sample_rate': 0.1} で有効化し、
+# サンプリングしたリクエストを本番レスポンスの後にバックグラウンドで候補モデルに推論させる
+INFERENCE_SHADOW = {
+    'ENABLED': True,
+    'DEFAULT_SAMPLE_RATE': 0.1,
+    'MAX_WORKERS': 1,
+    'MAX_PENDING': 32,   # 未処理がこの件数を超えた分は破棄（本番を待たせない）
+}
+
+# モデルのホットリロード
+# MLApp の保存やモデルファイルの更新を検知すると、新しいモデルをバックグラウンドで読み込み・
+# ウォームアップしてから切り替える（切り替えまでは旧モデルで応答）
+INFERENCE_MODEL_RELOAD = {
+    'WARMUP_BATCH_SIZES': [1],
+    'WARMUP_ITERATIONS': 2,
+}
+
+# 同一リクエストの推論結果の共有（シングルフライト）
+# 画像内容のハッシュとモデルが一致する同時リクエストは、最初の1件のデコード・推論の結果を共有する
+INFERENCE_COALESCING = {
+    'ENABLED': True,
+    'WAIT_TIMEOUT': 30,   # 先行リクエストの完了を待つ最大秒数（超えた場合は自分で実行）
+}
+
+# 近似重複画像の推論結果の再利用（知覚ハッシュ）
+# model_optimization['near_duplicate'] = {'max_distance': 4} のアプリは、dHash のハミング距離が
+# 閾値以内の過去の推論結果を返して順伝播を省略する（インデックスはプロセス内のみ）
+INFERENCE_NEAR_DUPLICATE = {
+    'ENABLED': True,
+    'MAX_DISTANCE': 4,    # アプリで max_distance を省略した場合の閾値
+    'CAPACITY': 10000,    # アプリ・モデルごとの保持件数（超えた分は古い順に削除）
+}
+
+# テキスト分類・感情分析（CPU, 全結合層は int8 の動的量子化）
+# トークナイズ結果は LRU でメモ化し、バッチは長さ順にまとめてバッチ内の最大長までのみパディングする
+INFERENCE_TEXT = {
+    'QUANTIZE': True,
+    'MAX_LENGTH': 256,               # 1件あたりの最大トークン数（超えた分は切り詰め）
+    'MAX_BATCH_TOKENS': 8192,        # 1バッチの（件数 × 最大長）の上限
+    'TOKENIZER_CACHE_SIZE': 10000,   # トークナイズ結果のメモ化件数
+}
+
+# 推論エンドポイントの同時実行数制御・負荷制限
+# 上限を超えたリクエストは優先度順（predict > predict_batch > benchmark 等）に待機し、
+# 待ち行列が満杯、またはクライアントのタイムアウト（X-Request-Timeout ヘッダー、秒）までに
+# 終わらない見込みの場合は 503 + Retry-After で早期に拒否する
+INFERENCE_ADMISSION = {
+    'ENABLED': True,
+    'MAX_CONCURRENCY': 4,          # プロセス全体の同時実行数
+    'PER_APP_CONCURRENCY': 4,      # アプリごとの同時実行数
+    'APP_LIMITS': {},              # アプリID -> 同時実行数（個別に制限する場合）
+    'MAX_QUEUE': 32,               # 待ち行列の上限
+    'TIMEOUT_HEADER': 'HTTP_X_REQUEST_TIMEOUT',
+    'DEFAULT_TIMEOUT': 30,         # ヘッダー未指定時のタイムアウト（WSGIサーバーのタイムアウトに合わせる）
+}
+
+# 共有バックボーン・マルチヘッド推論
+# model_optimization['shared_backbone'] = true のアプリは特徴抽出部を共有し、アプリごとの線形ヘッドのみを読み込む。
+# 異なるアプリへのリクエストも MAX_DELAY_MS の間まとめてバックボーンで一括推論する
+INFERENCE_MULTIHEAD = {
+    'BACKBONE_PATH': None,    # 共有バックボーンのチェックポイント（None の場合はデフォルトモデル）
+    'MAX_BATCH_SIZE': 32,
+    'MAX_DELAY_MS': 2,
+    'RESULT_TIMEOUT': 30,     # ワーカーの応答を待つ最大秒数（超えると推論エラー）
+}
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+CPU推論ワーカーのスレッド数・アフィニティ設定ベンチマーク
+
+ワーカー数ごとに複数プロセスを同時に起動し、以下の設定で合計スループットを比較する。
+  - unmanaged: PyTorchの既定（各プロセスがコア数分のスレッドを生成）
+  - threads:   ワーカー数に応じてスレッド数を分割
+  - pinned:    スレッド数を分割し、さらにコアを固定
+
+使い方:
+  python benchmark_cpu_threads.py [--workers 1 2 4] [--iterations 20] [--batch-size 8]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing as mp
+
+# Django設定
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+
+MODES = ['unmanaged', 'threads', 'pinned']
+
+def run_worker(mode, num_workers, worker_index, iterations, batch_size, barrier, queue):
+    """1ワーカー分の推論ループ"""
+    import django
+    django.setup()
+    import numpy as np
+    from PIL import Image
+    from inference.cpu_config import compute_cpu_config, ensure_cpu_config
+    from inference.cuda_inference import CUDAImageClassifier
+
+    if mode == 'unmanaged':
+        config = ensure_cpu_config({'managed': False})
+    else:
+        config = ensure_cpu_config(compute_cpu_config(
+            num_workers=num_workers,
+            worker_index=worker_index,
+            pin_cores=(mode == 'pinned')
+        ))
+
+    classifier = CUDAImageClassifier(device_type='cpu')
+    images = [
+        Image.fromarray(np.random.randint(0, 255, (224, 224, 3), dtype=np.uint8), 'RGB')
+        for _ in range(batch_size)
+    ]
+    # ウォームアップ
+    classifier.predict_batch(images, batch_size=batch_size)
+
+    barrier.wait()
+    start_time = time.time()
+    for _ in range(iterations):
+        classifier.predict_batch(images, batch_size=batch_size)
+    elapsed = time.time() - start_time
+
+    queue.put({
+        'worker_index': worker_index,
+        'elapsed': elapsed,
+        'images': iterations * batch_size,
+        'num_threads': config['num_threads'],
+        'affinity': config.get('affinity'),
+    })
+
+def run_setting(mode, num_workers, iterations, batch_size):
+    """指定設定で全ワーカーを同時実行して集計"""
+    ctx = mp.get_context('spawn')
+    barrier = ctx.Barrier(num_workers)
+    queue = ctx.Queue()
+    processes = [
+        ctx.Process(target=run_worker, args=(mode, num_workers, i, iterations, batch_size, barrier, queue))
+        for i in range(num_workers)
+    ]
+    for p in processes:
+        p.start()
+    results = [queue.get() for _ in processes]
+    for p in processes:
+        p.join()
+
+    wall_time = max(r['elapsed'] for r in results)
+    total_images = sum(r['images'] for r in results)
+    return {
+        'mode': mode,
+        'num_workers': num_workers,
+        'threads_per_worker': results[0]['num_threads'],
+        'throughput_fps': total_images / wall_time,
+        'average_latency_per_batch': sum(r['elapsed'] for r in results) / (len(results) * iterations),
+    }
+
+def main():
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    parser = argparse.ArgumentParser(description='CPU thread/affinity benchmark')
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, max(1, cores // 2), cores}))
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--output', help='結果を書き出すJSONファイル')
+    args = parser.parse_args()
+
+    print(f"🧵 CPUスレッド設定ベンチマーク（{cores}コア）")
+    print("=" * 60)
+
+    results = []
+    for num_workers in args.workers:
+        for mode in args.modes:
+            result = run_setting(mode, num_workers, args.iterations, args.batch_size)
+            results.append(result)
+            print(f"  workers={num_workers:<3} mode={mode:<10} threads={result['threads_per_worker']:<3} "
+                  f"throughput={result['throughput_fps']:.2f} FPS "
+                  f"latency/batch={result['average_latency_per_batch']:.4f}s")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 結果を保存しました: {args.output}")
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        print(f"❌ ベンチマークエラー: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import MLApp, PredictionLog
+from .models import MLApp, PredictionLog, BatchSizeProfile, VersionedPrediction, ShadowPrediction
 
 @admin.register(MLApp)
 class MLAppAdmin(admin.ModelAdmin):
@@ -10,7 +10,27 @@ class MLAppAdmin(admin.ModelAdmin):
 
 @admin.register(PredictionLog)
 class PredictionLogAdmin(admin.ModelAdmin):
-    list_display = ('ml_app', 'processing_time', 'created_at')
+    list_display = ('ml_app', 'predicted_class', 'processing_time', 'perceptual_hash', 'created_at')
     list_filter = ('ml_app', 'created_at')
     readonly_fields = ('created_at',)
     list_per_page = 20
+
+@admin.register(BatchSizeProfile)
+class BatchSizeProfileAdmin(admin.ModelAdmin):
+    list_display = ('ml_app', 'batch_size', 'p99_latency_target', 'device_fingerprint', 'updated_at')
+    list_filter = ('ml_app',)
+    readonly_fields = ('created_at', 'updated_at')
+
+@admin.register(VersionedPrediction)
+class VersionedPredictionAdmin(admin.ModelAdmin):
+    list_display = ('ml_app', 'model_version', 'image_upload', 'predicted_class', 'confidence_score', 'created_at')
+    list_filter = ('ml_app', 'model_version')
+    readonly_fields = ('created_at',)
+    list_per_page = 20
+
+@admin.register(ShadowPrediction)
+class ShadowPredictionAdmin(admin.ModelAdmin):
+    list_display = ('ml_app', 'candidate_version', 'primary_class', 'shadow_class', 'agreed', 'created_at')
+    list_filter = ('ml_app', 'candidate_version', 'agreed')
+    readonly_fields = ('created_at',)
+    list_per_page = 20
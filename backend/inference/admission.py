@@ -0,0 +1,281 @@
+"""
+推論エンドポイントの同時実行数制御と負荷制限（ロードシェディング）
+
+プロセス全体とアプリごとの同時実行数の上限を超えたリクエストは、上限付きの
+待ち行列で優先度順に待機する。単一画像の推論（interactive）は predict_batch
+（batch）、ベンチマーク等（background）より先に実行される。
+
+クライアントのタイムアウト（X-Request-Timeout ヘッダー、秒）までに処理を
+終えられないと見込まれるリクエストは、待たせずに 503 と Retry-After で
+早期に拒否する。過負荷時も受け付けたリクエストは期限内に処理し、全クライアントが
+同時にタイムアウトする状態を避ける。
+リクエストボディの受信・解析は枠の取得前に行い、遅いアップロードが枠を占有しないようにする。
+"""
+import math
+import time
+import heapq
+import logging
+import itertools
+import functools
+import threading
+from collections import defaultdict
+from typing import Dict, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# 優先度（小さいほど先に実行）
+PRIORITIES = {
+    'interactive': 0,
+    'batch': 1,
+    'background': 2,
+}
+
+
+class AdmissionRejected(Exception):
+    """過負荷のためリクエストを受け付けない（503）"""
+    status_code = 503
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+class _Waiter:
+    def __init__(self, app_id, priority: int, seq: int):
+        self.app_id = app_id
+        self.priority = priority
+        self.seq = seq
+        self.evicted = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionTicket:
+    """実行枠（with ブロックを抜けると返却）"""
+
+    def __init__(self, controller, app_id, priority_name: str):
+        self._controller = controller
+        self.app_id = app_id
+        self.priority_name = priority_name
+        self.started_at = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._controller.release(self)
+        return False
+
+
+class AdmissionController:
+    """優先度付き待ち行列による同時実行数制御"""
+
+    def __init__(self, max_concurrency: int, per_app_concurrency: int, max_queue: int,
+                 app_limits: Optional[Dict] = None):
+        self.max_concurrency = max_concurrency
+        self.per_app_concurrency = per_app_concurrency
+        self.max_queue = max_queue
+        self.app_limits = {str(k): v for k, v in (app_limits or {}).items()}
+        self._condition = threading.Condition()
+        self._active = 0
+        self._active_by_app = defaultdict(int)
+        self._waiters = []
+        self._seq = itertools.count()
+        # 優先度ごとの処理時間の指数移動平均（秒）
+        self._service_time = {}
+        self._stats = defaultdict(lambda: defaultdict(int))
+
+    def acquire(self, app_id, priority_name: str = 'interactive',
+                timeout: Optional[float] = None) -> AdmissionTicket:
+        """実行枠を取得（取得できない・期限内に終わらない場合は AdmissionRejected）"""
+        app_id = str(app_id)
+        priority = PRIORITIES[priority_name]
+        start_time = time.monotonic()
+        stats = self._stats[priority_name]
+
+        with self._condition:
+            if not self._waiters and self._has_capacity(app_id):
+                return self._admit(app_id, priority_name, stats)
+
+            service_time = self._service_time.get(priority_name, 0.0)
+            expected_wait = self._expected_wait(priority)
+            if timeout is not None and expected_wait + service_time > timeout:
+                # 待っても期限内に終わらないため即座に拒否
+                stats['shed_deadline'] += 1
+                raise AdmissionRejected('Request cannot complete before its deadline',
+                                        expected_wait + service_time)
+
+            waiter = _Waiter(app_id, priority, next(self._seq))
+            if len(self._waiters) >= self.max_queue and not self._evict_lower_than(waiter):
+                stats['shed_queue_full'] += 1
+                raise AdmissionRejected('Inference queue is full', expected_wait + service_time)
+            heapq.heappush(self._waiters, waiter)
+
+            try:
+                while True:
+                    if waiter.evicted:
+                        stats['shed_evicted'] += 1
+                        raise AdmissionRejected('Preempted by higher priority requests',
+                                                self._expected_wait(priority) + service_time)
+                    if self._is_next(waiter) and self._has_capacity(app_id):
+                        self._waiters.remove(waiter)
+                        heapq.heapify(self._waiters)
+                        stats['queued'] += 1
+                        return self._admit(app_id, priority_name, stats)
+
+                    remaining = None
+                    if timeout is not None:
+                        # 処理時間を差し引いた残り時間を過ぎたら実行しても間に合わない
+                        remaining = timeout - service_time - (time.monotonic() - start_time)
+                        if remaining <= 0:
+                            stats['shed_timeout'] += 1
+                            raise AdmissionRejected('Request timed out waiting in queue',
+                                                    self._expected_wait(priority) + service_time)
+                    self._condition.wait(remaining)
+            except AdmissionRejected:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    heapq.heapify(self._waiters)
+                self._condition.notify_all()
+                raise
+
+    def release(self, ticket: AdmissionTicket):
+        duration = time.monotonic() - ticket.started_at
+        with self._condition:
+            self._active -= 1
+            self._active_by_app[ticket.app_id] -= 1
+            previous = self._service_time.get(ticket.priority_name)
+            self._service_time[ticket.priority_name] = (
+                duration if previous is None else 0.8 * previous + 0.2 * duration
+            )
+            self._condition.notify_all()
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                'active': self._active,
+                'queued': len(self._waiters),
+                'max_concurrency': self.max_concurrency,
+                'per_app_concurrency': self.per_app_concurrency,
+                'max_queue': self.max_queue,
+                'service_time': dict(self._service_time),
+                'priorities': {name: dict(counts) for name, counts in self._stats.items()},
+            }
+
+    def _admit(self, app_id, priority_name, stats) -> AdmissionTicket:
+        self._active += 1
+        self._active_by_app[app_id] += 1
+        stats['admitted'] += 1
+        return AdmissionTicket(self, app_id, priority_name)
+
+    def _app_limit(self, app_id) -> int:
+        return self.app_limits.get(app_id, self.per_app_concurrency)
+
+    def _has_capacity(self, app_id) -> bool:
+        return (self._active < self.max_concurrency
+                and self._active_by_app[app_id] < self._app_limit(app_id))
+
+    def _is_next(self, waiter: _Waiter) -> bool:
+        """実行可能な待機中リクエストのうち最も優先されるか（上限に達したアプリは飛ばす）"""
+        for other in sorted(self._waiters):
+            if other is waiter:
+                return True
+            if self._active_by_app[other.app_id] < self._app_limit(other.app_id):
+                return False
+        return False
+
+    def _evict_lower_than(self, waiter: _Waiter) -> bool:
+        """待ち行列が満杯の場合、より優先度の低い最後尾のリクエストを拒否して枠を空ける"""
+        if not self._waiters:
+            return False
+        lowest = max(self._waiters)
+        if lowest.priority <= waiter.priority:
+            return False
+        lowest.evicted = True
+        self._waiters.remove(lowest)
+        heapq.heapify(self._waiters)
+        self._condition.notify_all()
+        return True
+
+    def _expected_wait(self, priority: int) -> float:
+        """先行する待機中リクエストの処理時間から待ち時間を見積もり"""
+        ahead = [w for w in self._waiters if w.priority <= priority]
+        if not ahead and self._active < self.max_concurrency:
+            return 0.0
+        names = {v: k for k, v in PRIORITIES.items()}
+        work = sum(self._service_time.get(names[w.priority], 0.0) for w in ahead)
+        # 実行中のリクエストが枠を空けるまでの時間（平均処理時間の半分と仮定）
+        running = max(self._service_time.values(), default=0.0) / 2
+        return running + work / self.max_concurrency
+
+
+def get_request_timeout(request) -> Optional[float]:
+    """クライアントのタイムアウト（秒）をヘッダーから取得（未指定時は設定値）"""
+    value = request.META.get(_get_setting('TIMEOUT_HEADER', 'HTTP_X_REQUEST_TIMEOUT'))
+    if value:
+        try:
+            timeout = float(value)
+            if timeout > 0:
+                return timeout
+        except ValueError:
+            pass
+    return _get_setting('DEFAULT_TIMEOUT', None)
+
+
+def admission_controlled(priority_name: str):
+    """ビューアクションを同時実行数制御下で実行するデコレーター（拒否時は 503 + Retry-After）"""
+    def decorator(view_func):
+        @functools.wraps(view_func)
+        def wrapper(viewset, request, *args, **kwargs):
+            if not _get_setting('ENABLED', True):
+                return view_func(viewset, request, *args, **kwargs)
+
+            from rest_framework.response import Response
+            # ボディの受信・解析（受信中のデコードを含む）は枠の取得前に済ませる
+            # （遅いアップロードが実行枠を占有せず、処理時間の移動平均にも含まれないように）
+            parse_started = time.monotonic()
+            if hasattr(request, 'data'):
+                request.FILES
+            timeout = get_request_timeout(request)
+            if timeout is not None:
+                # 受信にかかった時間はクライアントの期限から差し引く
+                timeout -= time.monotonic() - parse_started
+            try:
+                ticket = get_admission_controller().acquire(kwargs.get('pk'), priority_name, timeout=timeout)
+            except AdmissionRejected as e:
+                logger.warning(f"Shed {priority_name} request: {e.reason}")
+                return Response({
+                    'error': f'Server is overloaded: {e.reason}',
+                    'retry_after': e.retry_after
+                }, status=e.status_code, headers={'Retry-After': str(e.retry_after)})
+            with ticket:
+                return view_func(viewset, request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_admission_controller() -> AdmissionController:
+    """プロセス全体の同時実行数制御"""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AdmissionController(
+                max_concurrency=_get_setting('MAX_CONCURRENCY', 4),
+                per_app_concurrency=_get_setting('PER_APP_CONCURRENCY', 4),
+                max_queue=_get_setting('MAX_QUEUE', 32),
+                app_limits=_get_setting('APP_LIMITS', {}),
+            )
+        return _controller
+
+
+def _get_setting(name: str, default=None):
+    """settings.INFERENCE_ADMISSION から設定値を取得"""
+    return getattr(settings, 'INFERENCE_ADMISSION', {}).get(name, default)
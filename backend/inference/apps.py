@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class InferenceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'inference'
+
+    def ready(self):
+        # MLApp の保存時は使用中のモデルをバックグラウンドで切り替え
+        from django.db.models.signals import post_delete, post_save
+        from .model_registry import on_mlapp_saved
+        post_save.connect(on_mlapp_saved, sender=self.get_model('MLApp'), dispatch_uid='inference-model-reload')
+        
+        # シャドー推論の設定が変更・削除された場合は候補モデルを解放
+        from .shadow import on_mlapp_changed
+        post_save.connect(on_mlapp_changed, sender=self.get_model('MLApp'), dispatch_uid='inference-shadow-release')
+        post_delete.connect(on_mlapp_changed, sender=self.get_model('MLApp'), dispatch_uid='inference-shadow-release')
+        
+        # サーバープロセスではモデルを事前に読み込んでウォームアップ
+        from .warmup import should_warmup, start_warmup
+        if should_warmup():
+            start_warmup()
@@ -0,0 +1,201 @@
+"""
+アプリ・デバイスごとのバッチサイズ自動調整
+
+候補バッチサイズごとにスループットとレイテンシを計測し、p99レイテンシが
+目標値以下となる最大のバッチサイズを選択する。結果は (アプリ, デバイス識別子)
+ごとに BatchSizeProfile へ保存し、MLApp.get_optimal_batch_size から参照する。
+"""
+import json
+import math
+import time
+import hashlib
+import logging
+import platform
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# (アプリID, デバイス識別子) -> (バッチサイズ, 有効期限)
+_tuned_cache = {}
+_cache_lock = threading.Lock()
+
+# (推論設定, デバイス情報の取得時刻) -> (デバイス識別子, デバイス情報)
+_fingerprints = {}
+
+
+def get_device_fingerprint(options: Dict) -> Tuple[str, Dict]:
+    """推論設定とハードウェアからデバイス識別子を作成
+
+    リクエストごとに参照されるため、デバイス情報（devices.py）を再取得するまで
+    プロセス内でキャッシュする。
+    """
+    from .devices import get_device_capabilities
+
+    capabilities = get_device_capabilities()
+    key = (options['device_type'], options['precision'], bool(options['channels_last']),
+           capabilities['probed_at'])
+    cached = _fingerprints.get(key)
+    if cached is None:
+        cached = _fingerprints[key] = _compute_device_fingerprint(options, capabilities)
+    fingerprint, description = cached
+    return fingerprint, dict(description)
+
+
+def _compute_device_fingerprint(options: Dict, capabilities: Dict) -> Tuple[str, Dict]:
+    """デバイス識別子を作成（torch の import・/proc/cpuinfo の読み込みを伴う）"""
+    import torch
+    from .cpu_config import ensure_cpu_config
+    from .devices import resolve_device_type, resolve_precision
+
+    device = resolve_device_type(options['device_type'])
+    description = {
+        'device': device,
+        'precision': resolve_precision(device, options['precision']),
+        'channels_last': bool(options['channels_last']),
+        'torch': torch.__version__,
+    }
+    if device == 'cuda':
+        gpu = capabilities['cuda']['devices'][0]
+        description.update({
+            'name': gpu['name'],
+            'total_memory': gpu['total_memory'],
+            'compute_capability': gpu['compute_capability'],
+        })
+    else:
+        description.update({
+            'name': _cpu_model_name(),
+            'num_cores': capabilities['cpu']['num_cores'],
+            'num_threads': ensure_cpu_config()['num_threads'],
+        })
+
+    fingerprint = hashlib.sha1(json.dumps(description, sort_keys=True).encode()).hexdigest()[:16]
+    return fingerprint, description
+
+
+def get_tuned_batch_size(ml_app) -> Optional[int]:
+    """保存済みの自動調整バッチサイズを取得（未調整の場合は None）"""
+    from .models import BatchSizeProfile
+
+    fingerprint, _ = get_device_fingerprint(ml_app.get_inference_options())
+    key = (ml_app.pk, fingerprint)
+    now = time.time()
+    with _cache_lock:
+        cached = _tuned_cache.get(key)
+        if cached and cached[1] > now:
+            return cached[0]
+
+    batch_size = BatchSizeProfile.objects.filter(
+        ml_app=ml_app, device_fingerprint=fingerprint
+    ).values_list('batch_size', flat=True).first()
+
+    with _cache_lock:
+        _tuned_cache[key] = (batch_size, now + _get_setting('CACHE_TTL', 300))
+    return batch_size
+
+
+def tune_batch_size(ml_app, latency_target: Optional[float] = None,
+                    candidates: Optional[List[int]] = None,
+                    iterations: Optional[int] = None, save: bool = True) -> Dict:
+    """候補バッチサイズを計測して最適値を選択"""
+    import numpy as np
+    from PIL import Image
+    from .model_registry import get_model_registry
+    from .models import BatchSizeProfile
+
+    options = ml_app.get_inference_options()
+    if latency_target is None:
+        latency_target = ml_app.get_optimization_settings().get(
+            'p99_latency_target', _get_setting('P99_LATENCY_TARGET', 0.2)
+        )
+    candidates = sorted(set(candidates or _get_setting('CANDIDATE_BATCH_SIZES', [1, 2, 4, 8, 16, 32])))
+    iterations = iterations or _get_setting('ITERATIONS', 20)
+
+    classifier = get_model_registry().get_classifier(ml_app)
+    images = [
+        Image.fromarray(np.random.randint(0, 255, (224, 224, 3), dtype=np.uint8), 'RGB')
+        for _ in range(max(candidates))
+    ]
+
+    measurements = []
+    best_batch_size = candidates[0]
+    for batch_size in candidates:
+        batch = images[:batch_size]
+        # ウォームアップ（失敗時はメモリ不足等とみなして打ち切り）
+        if any('error' in r for r in classifier.predict_batch(batch, batch_size=batch_size)):
+            logger.warning(f"Batch size {batch_size} failed on {classifier.device}, stopping")
+            break
+
+        latencies = []
+        for _ in range(iterations):
+            start_time = time.perf_counter()
+            classifier.predict_batch(batch, batch_size=batch_size)
+            classifier._synchronize()
+            latencies.append(time.perf_counter() - start_time)
+
+        mean_latency = sum(latencies) / len(latencies)
+        measurement = {
+            'batch_size': batch_size,
+            'mean_latency': mean_latency,
+            'p50_latency': _percentile(latencies, 50),
+            'p99_latency': _percentile(latencies, 99),
+            'throughput_fps': batch_size / mean_latency,
+        }
+        measurements.append(measurement)
+        logger.info(f"Batch size {batch_size}: p99={measurement['p99_latency']:.4f}s "
+                    f"throughput={measurement['throughput_fps']:.1f} FPS")
+
+        if measurement['p99_latency'] > latency_target:
+            # レイテンシはバッチサイズに対して単調増加するため以降は計測しない
+            break
+        best_batch_size = batch_size
+
+    fingerprint, description = get_device_fingerprint(options)
+    if save:
+        BatchSizeProfile.objects.update_or_create(
+            ml_app=ml_app,
+            device_fingerprint=fingerprint,
+            defaults={
+                'device_description': description,
+                'batch_size': best_batch_size,
+                'p99_latency_target': latency_target,
+                'measurements': measurements,
+            }
+        )
+        with _cache_lock:
+            _tuned_cache.pop((ml_app.pk, fingerprint), None)
+
+    return {
+        'ml_app': ml_app.name,
+        'batch_size': best_batch_size,
+        'p99_latency_target': latency_target,
+        'device_fingerprint': fingerprint,
+        'device_description': description,
+        'measurements': measurements,
+    }
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """最近傍順位法によるパーセンタイル"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _cpu_model_name() -> str:
+    """CPUのモデル名"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def _get_setting(name: str, default=None):
+    """settings.INFERENCE_AUTOTUNE から設定値を取得"""
+    return getattr(settings, 'INFERENCE_AUTOTUNE', {}).get(name, default)
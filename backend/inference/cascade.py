@@ -0,0 +1,177 @@
+"""
+信頼度に基づくモデルカスケード
+
+小さく高速なモデル（幅を縮小した・低解像度の MobileNet 等）で先に推論し、
+信頼度が閾値未満の入力のみをまとめて通常のモデルで再推論する。大半の
+簡単な画像は高速モデルの結果をそのまま返すため、平均レイテンシが下がる。
+
+model_optimization['cascade'] = {
+    'model_file_path': 高速モデルのチェックポイント,
+    'threshold': 0.8,        # これ未満の信頼度は通常モデルへ
+    'input_size': 160,       # 高速モデルの入力解像度（省略時は通常モデルと同じ）
+}
+
+閾値は manage.py tune_cascade で推論ログから選択できる。
+"""
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from .cuda_inference import ArrayClassifierMixin
+
+logger = logging.getLogger(__name__)
+
+
+class CascadeClassifier(ArrayClassifierMixin):
+    """高速モデル → 通常モデルの2段カスケード
+
+    前処理・デバイス情報等は通常モデルの分類器に委譲する。
+    """
+
+    loaded = True
+
+    def __init__(self, fast, full, threshold: float = 0.8, fast_input_size: Optional[int] = None):
+        if list(fast.classes) != list(full.classes):
+            raise ValueError(f"Cascade models have different classes: {fast.classes} / {full.classes}")
+        self.fast = fast
+        self.full = full
+        self.threshold = threshold
+        self.fast_input_size = fast_input_size
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'fast_only': 0, 'escalated': 0, 'fast_time': 0.0, 'full_time': 0.0}
+
+    def __getattr__(self, name):
+        return getattr(self.full, name)
+
+    def predict_arrays(self, arrays: np.ndarray, top_k: Optional[int] = None,
+                       min_confidence: Optional[float] = None) -> List[Dict]:
+        """高速モデルで推論し、信頼度が閾値未満の入力のみ通常モデルで再推論"""
+        start_time = time.time()
+        arrays = np.asarray(arrays)
+        fast_logits = self.fast._forward(self._fast_input(self.fast.tensor_from_arrays(arrays)))
+        results = self.fast._summarize_outputs(fast_logits, top_k, min_confidence)
+        fast_time = time.time() - start_time
+
+        escalate = [i for i, result in enumerate(results) if result['confidence'] < self.threshold]
+        full_time = 0.0
+        if escalate:
+            # 閾値未満の入力のみをまとめて通常モデルで推論（共有バックボーンのヘッドにも対応）
+            full_start = time.time()
+            for i, result in zip(escalate, self.full.predict_arrays(arrays[escalate], top_k, min_confidence)):
+                result['fast_confidence'] = results[i]['confidence']
+                results[i] = result
+            full_time = time.time() - full_start
+
+        processing_time = (time.time() - start_time) / max(len(results), 1)
+        escalated = set(escalate)
+        for i, result in enumerate(results):
+            result.update({
+                'processing_time': processing_time,
+                'device': str(self.full.device),
+                'cascade_stage': 'full' if i in escalated else 'fast',
+            })
+
+        with self._lock:
+            self._stats['requests'] += len(results)
+            self._stats['escalated'] += len(escalate)
+            self._stats['fast_only'] += len(results) - len(escalate)
+            self._stats['fast_time'] += fast_time
+            self._stats['full_time'] += full_time
+        return results
+
+    def evaluate_arrays(self, arrays: np.ndarray) -> Dict:
+        """閾値選択用に両方のモデルで推論（高速モデルの信頼度・予測と通常モデルの予測）"""
+        arrays = np.asarray(arrays)
+
+        start_time = time.time()
+        fast_logits = self.fast._forward(self._fast_input(self.fast.tensor_from_arrays(arrays)))
+        fast_confidence, fast_predicted = torch.softmax(fast_logits.float(), dim=1).max(dim=1)
+        fast_confidence, fast_predicted = fast_confidence.cpu().numpy(), fast_predicted.cpu().numpy()
+        fast_time = time.time() - start_time
+
+        start_time = time.time()
+        full_results = self.full.predict_arrays(arrays)
+        full_time = time.time() - start_time
+
+        classes = list(self.full.classes)
+        return {
+            'fast_confidence': fast_confidence,
+            'fast_predicted': fast_predicted,
+            'full_predicted': np.array([classes.index(r['predicted_class']) for r in full_results]),
+            'fast_time': fast_time,
+            'full_time': full_time,
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+        requests = stats['requests']
+        stats.update({
+            'threshold': self.threshold,
+            'fast_input_size': self.fast_input_size,
+            'escalation_rate': stats['escalated'] / requests if requests else 0.0,
+            'average_fast_time': stats['fast_time'] / requests if requests else 0.0,
+            'average_full_time': stats['full_time'] / stats['escalated'] if stats['escalated'] else 0.0,
+        })
+        return stats
+
+    def warmup(self, batch_sizes: List[int] = (1,), iterations: int = 2) -> Dict:
+        result = self.full.warmup(batch_sizes=batch_sizes, iterations=iterations)
+        self.fast.warmup(batch_sizes=batch_sizes, iterations=iterations)
+        result['cascade'] = True
+        return result
+
+    def get_device_info(self) -> Dict:
+        info = self.full.get_device_info()
+        info['cascade'] = self.stats()
+        return info
+
+    def _fast_input(self, input_tensor: torch.Tensor) -> torch.Tensor:
+        if not self.fast_input_size or self.fast_input_size == input_tensor.shape[-1]:
+            return input_tensor
+        # 低解像度モデル用にデバイス上で縮小
+        size = (self.fast_input_size, self.fast_input_size)
+        return F.interpolate(input_tensor, size=size, mode='bilinear', align_corners=False)
+
+
+def choose_threshold(fast_confidence: np.ndarray, fast_predicted: np.ndarray,
+                     full_predicted: np.ndarray, reference: np.ndarray,
+                     fast_time: float, full_time: float,
+                     max_accuracy_drop: float = 0.01,
+                     thresholds: Optional[List[float]] = None) -> Dict:
+    """精度低下の許容範囲内で平均レイテンシが最小となる閾値を選択
+
+    reference は正解ラベル（ユーザーフィードバックで正解とされた予測、なければ通常モデルの予測）。
+    fast_time / full_time は1枚あたりの推論時間（秒）。
+    """
+    if thresholds is None:
+        thresholds = [round(t, 2) for t in np.arange(0.5, 1.0001, 0.01)]
+
+    full_accuracy = float(np.mean(full_predicted == reference))
+    candidates = []
+    for threshold in thresholds:
+        escalate = fast_confidence < threshold
+        predicted = np.where(escalate, full_predicted, fast_predicted)
+        escalation_rate = float(np.mean(escalate))
+        candidates.append({
+            'threshold': threshold,
+            'accuracy': float(np.mean(predicted == reference)),
+            'escalation_rate': escalation_rate,
+            'average_latency': fast_time + escalation_rate * full_time,
+        })
+
+    # 閾値を上げるほど精度・レイテンシとも通常モデルに近づくため、条件を満たす最小の閾値を選ぶ
+    acceptable = [c for c in candidates if c['accuracy'] >= full_accuracy - max_accuracy_drop]
+    best = min(acceptable, key=lambda c: (c['average_latency'], c['threshold'])) if acceptable else None
+    return {
+        'full_accuracy': full_accuracy,
+        'full_latency': full_time,
+        'max_accuracy_drop': max_accuracy_drop,
+        'best': best,
+        'candidates': candidates,
+    }
@@ -0,0 +1,131 @@
+"""
+同一リクエストの推論結果の共有（シングルフライト）
+
+同じ画像が同時に多数アップロードされた場合に、画像内容のハッシュとモデルの
+キーが一致するリクエストは最初の1件のデコード・推論の完了を待ち、その結果を
+共有する。処理中の同一リクエストがなければ通常どおり実行するため、
+重複のない通常時のコストは画像のハッシュ計算のみ。
+"""
+import time
+import logging
+import threading
+from typing import Callable, Dict, Tuple
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """処理中の計算（完了を待つリクエストに結果を渡す）"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.duration = 0.0
+        self.followers = 0
+
+
+class SingleFlight:
+    """キーが同じ同時実行の計算を1回にまとめる"""
+
+    def __init__(self, wait_timeout: float = 30.0):
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {}
+
+    def do(self, key, fn: Callable, group=None) -> Tuple[object, bool]:
+        """fn() を実行して (結果, 他のリクエストの結果を共有したか) を返す"""
+        with self._lock:
+            stats = self._group_stats(group)
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                stats['in_flight'] += 1
+            else:
+                call.followers += 1
+
+        if not leader:
+            if call.event.wait(self.wait_timeout):
+                if call.error is not None:
+                    # 同じ入力のため先行リクエストと同じエラーを返す
+                    raise call.error
+                with self._lock:
+                    stats['coalesced'] += 1
+                    stats['saved_time'] += call.duration
+                return call.result, True
+            # 待機がタイムアウトした場合は自分で実行
+            with self._lock:
+                stats['fallbacks'] += 1
+            return self._execute(fn, stats), False
+
+        try:
+            start_time = time.time()
+            call.result = self._execute(fn, stats)
+            call.duration = time.time() - start_time
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                stats['in_flight'] -= 1
+                stats['max_followers'] = max(stats['max_followers'], call.followers)
+            call.event.set()
+
+    def stats(self, group=None) -> Dict:
+        """計算回数・共有（節約）回数"""
+        with self._lock:
+            stats = dict(self._group_stats(group))
+        total = stats['computations'] + stats['coalesced']
+        stats['coalesced_ratio'] = stats['coalesced'] / total if total else 0.0
+        return stats
+
+    def _execute(self, fn, stats):
+        with self._lock:
+            stats['computations'] += 1
+        try:
+            return fn()
+        except Exception:
+            with self._lock:
+                stats['errors'] += 1
+            raise
+
+    def _group_stats(self, group) -> Dict:
+        if group not in self._stats:
+            self._stats[group] = {
+                'computations': 0,     # 実際に実行した回数
+                'coalesced': 0,        # 他のリクエストの結果を共有した回数（節約できた計算）
+                'saved_time': 0.0,     # 共有により省略できた処理時間の合計（秒）
+                'fallbacks': 0,        # 待機タイムアウトで自分で実行した回数
+                'errors': 0,
+                'in_flight': 0,
+                'max_followers': 0,
+            }
+        return self._stats[group]
+
+
+_coalescer = None
+_coalescer_lock = threading.Lock()
+
+
+def get_request_coalescer() -> SingleFlight:
+    """プロセス全体の推論リクエストのシングルフライト"""
+    global _coalescer
+    with _coalescer_lock:
+        if _coalescer is None:
+            _coalescer = SingleFlight(wait_timeout=_get_setting('WAIT_TIMEOUT', 30))
+        return _coalescer
+
+
+def is_enabled() -> bool:
+    return _get_setting('ENABLED', True)
+
+
+def _get_setting(name: str, default=None):
+    """settings.INFERENCE_COALESCING から設定値を取得"""
+    return getattr(settings, 'INFERENCE_COALESCING', {}).get(name, default)
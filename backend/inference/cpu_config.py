@@ -0,0 +1,167 @@
+"""
+CPU推論ワーカーのスレッド数・CPUアフィニティ管理
+
+同一ホスト上で複数のDjangoワーカープロセスが動作する場合、各プロセスの
+PyTorchがコア数分のスレッドを生成するとCPUが過剰にサブスクライブされる。
+ワーカー数とコア数からプロセスごとのスレッド数を決め、必要に応じて
+コアを固定する。
+"""
+import os
+import logging
+import tempfile
+import threading
+from typing import Dict, List, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# ワーカースロットを確保するロックファイル（プロセス終了まで保持）
+_slot_lock_file = None
+_applied_config = None
+_config_lock = threading.Lock()
+
+
+def get_available_cores() -> List[int]:
+    """このプロセスが利用可能なCPUコア一覧"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def detect_worker_count() -> int:
+    """同一ホスト上の推論ワーカー数を推定"""
+    configured = _get_setting('WORKERS')
+    if configured:
+        return int(configured)
+    # gunicorn / uvicorn 等の慣例的な環境変数
+    for name in ('INFERENCE_WORKERS', 'WEB_CONCURRENCY', 'GUNICORN_WORKERS'):
+        value = os.environ.get(name)
+        if value and value.isdigit() and int(value) > 0:
+            return int(value)
+    return 1
+
+
+def claim_worker_index(num_workers: int) -> int:
+    """ワーカー番号を確保（ロックファイルで同一ホスト内の重複を防ぐ）"""
+    global _slot_lock_file
+    value = os.environ.get('INFERENCE_WORKER_INDEX')
+    if value and value.isdigit():
+        return int(value) % num_workers
+
+    try:
+        import fcntl
+    except ImportError:
+        return os.getpid() % num_workers
+
+    lock_dir = _get_setting('LOCK_DIR') or tempfile.gettempdir()
+    for index in range(num_workers):
+        path = os.path.join(lock_dir, f'inference-cpu-worker-{index}.lock')
+        lock_file = open(path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        _slot_lock_file = lock_file
+        return index
+
+    # 全スロット使用中（ワーカー数の設定ミス等）
+    return os.getpid() % num_workers
+
+
+def compute_cpu_config(num_workers: Optional[int] = None,
+                       worker_index: Optional[int] = None,
+                       cores: Optional[List[int]] = None,
+                       pin_cores: Optional[bool] = None) -> Dict:
+    """ワーカー数とコア数からCPU実行設定を算出"""
+    cores = cores if cores is not None else get_available_cores()
+    num_workers = max(1, num_workers or detect_worker_count())
+    if pin_cores is None:
+        pin_cores = bool(_get_setting('PIN_CORES'))
+
+    # 利用可能なコア数を超えるスレッドは同じコアを奪い合うだけのため上限とする
+    threads = int(_get_setting('THREADS_PER_WORKER') or len(cores) // num_workers)
+    threads = max(1, min(threads, len(cores)))
+    # 単一モデルの推論ではop間並列はほぼ効かないため既定は1
+    interop_threads = _get_setting('INTEROP_THREADS') or 1
+
+    config = {
+        'num_cores': len(cores),
+        'num_workers': num_workers,
+        'worker_index': worker_index,
+        'num_threads': threads,
+        'num_interop_threads': interop_threads,
+        'pin_cores': pin_cores,
+        'affinity': None,
+        'managed': True,
+    }
+
+    if pin_cores:
+        if worker_index is None:
+            worker_index = claim_worker_index(num_workers)
+            config['worker_index'] = worker_index
+        start = (worker_index * threads) % len(cores)
+        config['affinity'] = sorted({cores[(start + i) % len(cores)] for i in range(threads)})
+
+    return config
+
+
+def apply_cpu_config(config: Dict) -> Dict:
+    """CPU実行設定をこのプロセスに適用"""
+    import torch
+
+    if config.get('affinity') and hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, config['affinity'])
+        except OSError as e:
+            logger.warning(f"Failed to set CPU affinity: {e}")
+            config['affinity'] = None
+
+    torch.set_num_threads(config['num_threads'])
+    try:
+        # op間スレッド数は並列処理の開始前に一度だけ設定可能
+        torch.set_num_interop_threads(config['num_interop_threads'])
+    except RuntimeError:
+        config['num_interop_threads'] = torch.get_num_interop_threads()
+
+    logger.info(
+        f"CPU execution config: {config['num_threads']} threads, "
+        f"{config['num_interop_threads']} inter-op threads, affinity={config['affinity']}"
+    )
+    return config
+
+
+def ensure_cpu_config(config: Optional[Dict] = None) -> Dict:
+    """プロセス全体のCPU実行設定を一度だけ適用して取得
+
+    config を省略した場合は settings.INFERENCE_CPU_CONFIG から算出する。
+    managed=False の設定を渡すとPyTorchの既定値のまま記録だけ行う。
+    """
+    global _applied_config
+    with _config_lock:
+        if _applied_config is None:
+            if config is None:
+                config = compute_cpu_config() if _get_setting('ENABLED', True) else {'managed': False}
+            if config.get('managed', True):
+                _applied_config = apply_cpu_config(config)
+            else:
+                _applied_config = _unmanaged_config()
+        return dict(_applied_config)
+
+
+def _unmanaged_config() -> Dict:
+    """PyTorchの既定スレッド設定"""
+    import torch
+    return {
+        'num_cores': len(get_available_cores()),
+        'num_threads': torch.get_num_threads(),
+        'num_interop_threads': torch.get_num_interop_threads(),
+        'affinity': None,
+        'managed': False,
+    }
+
+
+def _get_setting(name: str, default=None):
+    """settings.INFERENCE_CPU_CONFIG から設定値を取得"""
+    return getattr(settings, 'INFERENCE_CPU_CONFIG', {}).get(name, default)
@@ -2,6 +2,9 @@
 CUDA対応画像分類推論サービス
 """
 import time
+import hashlib
+import threading
+import contextlib
 import torch
 import torch.nn as nn
 import torchvision.transforms as transforms
@@ -13,25 +16,107 @@ from typing import Dict, List, Tuple, Optional
 import logging
 from pathlib import Path
 
+from .cpu_config import ensure_cpu_config
+from .devices import get_device_capabilities, get_supported_precisions, resolve_device_type, resolve_precision
+
 logger = logging.getLogger(__name__)
 
+# 推論精度の設定値と autocast で使用するデータ型
+PRECISION_DTYPES = {
+    'fp32': None,
+    'fp16': torch.float16,
+    'bf16': torch.bfloat16,
+}
+
+def summarize_logits(outputs: torch.Tensor, classes: List[str],
+                     top_k: Optional[int] = None,
+                     min_confidence: Optional[float] = None) -> List[Dict]:
+    """ロジット (N, C) から予測結果を作成（top_k / min_confidence はデバイス上で適用）"""
+    probabilities = torch.nn.functional.softmax(outputs.float(), dim=1)
+    num_classes = probabilities.shape[1]
+    
+    if top_k is None and min_confidence is None:
+        # 全クラスの確率（クラス順）
+        top_probs = probabilities
+        top_indices = None
+    else:
+        # 確率の高い順に必要な件数だけ取り出す
+        k = num_classes if top_k is None else max(1, min(int(top_k), num_classes))
+        top_probs, top_indices = torch.topk(probabilities, k, dim=1)
+        
+        if min_confidence is not None:
+            # 閾値を超える件数の最大値まで切り詰めてからホストへ転送
+            keep = int((top_probs >= min_confidence).sum(dim=1).max().item())
+            keep = max(keep, 1)
+            top_probs = top_probs[:, :keep]
+            top_indices = top_indices[:, :keep]
+    
+    confidences, predicted = torch.max(probabilities, 1)
+    
+    # 必要な値だけをまとめてCPUに移動
+    confidences = confidences.cpu().tolist()
+    predicted = predicted.cpu().tolist()
+    top_probs = top_probs.cpu().tolist()
+    if top_indices is not None:
+        top_indices = top_indices.cpu().tolist()
+    
+    results = []
+    for row, (confidence, predicted_class_idx) in enumerate(zip(confidences, predicted)):
+        if top_indices is None:
+            class_probs = {
+                classes[i]: float(prob)
+                for i, prob in enumerate(top_probs[row])
+            }
+        else:
+            class_probs = {
+                classes[i]: float(prob)
+                for i, prob in zip(top_indices[row], top_probs[row])
+                if min_confidence is None or prob >= min_confidence
+            }
+        results.append({
+            'predicted_class': classes[predicted_class_idx],
+            'confidence': confidence,
+            'class_probabilities': class_probs,
+        })
+    return results
+
+def compute_backbone_fingerprint(state_dict: Dict, width_mult: float = 1.0) -> str:
+    """state_dict の分類層（classifier.*）を除いた重みのハッシュ"""
+    digest = hashlib.sha1(f'width_mult={width_mult}'.encode())
+    for name, tensor in state_dict.items():
+        if name.startswith('classifier.'):
+            continue
+        digest.update(name.encode())
+        digest.update(tensor.detach().float().cpu().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
 class CUDAImageClassifier:
     """CUDA対応画像分類器"""
     
-    def __init__(self, model_path: Optional[str] = None, device_type: str = 'auto'):
+    def __init__(self, model_path: Optional[str] = None, device_type: str = 'auto',
+                 precision: str = 'fp32', channels_last: bool = True):
         self.device_type = device_type
+        # スレッド数・アフィニティはプロセス単位で一度だけ設定
+        self.cpu_config = ensure_cpu_config()
         self.device = self._get_device()
+        self.precision = self._resolve_precision(precision)
+        self.channels_last = channels_last
         self.model = None
         self.transform = None
         self.classes = []
+        self.width_mult = 1.0
         self.loaded = False
         
         # デフォルトの前処理設定
+        self.input_size = (224, 224)
+        self.mean = [0.485, 0.456, 0.406]
+        self.std = [0.229, 0.224, 0.225]
+        self.resize = transforms.Resize(self.input_size)
         self.transform = transforms.Compose([
-            transforms.Resize((224, 224)),
+            self.resize,
             transforms.ToTensor(),
-            transforms.Normalize(mean=[0.485, 0.456, 0.406], 
-                               std=[0.229, 0.224, 0.225])
+            transforms.Normalize(mean=self.mean, 
+                               std=self.std)
         ])
         
         if model_path:
@@ -42,14 +127,13 @@ class CUDAImageClassifier:
     def _get_device(self) -> torch.device:
         """最適なデバイスを選択"""
         if self.device_type == 'auto':
-            if torch.cuda.is_available():
-                device = torch.device('cuda')
-                logger.info(f"CUDA device selected: {torch.cuda.get_device_name(0)}")
-            elif hasattr(torch.backends, 'mps') and torch.backends.mps.is_available():
-                device = torch.device('mps')
+            # 起動時に取得したデバイス情報から選択
+            device = torch.device(resolve_device_type('auto'))
+            if device.type == 'cuda':
+                logger.info(f"CUDA device selected: {get_device_capabilities()['cuda']['devices'][0]['name']}")
+            elif device.type == 'mps':
                 logger.info("MPS device selected (Apple Silicon)")
             else:
-                device = torch.device('cpu')
                 logger.info("CPU device selected")
         else:
             device = torch.device(self.device_type)
@@ -57,12 +141,51 @@ class CUDAImageClassifier:
             
         return device
     
+    def supported_precisions(self) -> List[str]:
+        """現在のデバイスで利用可能な推論精度"""
+        return get_supported_precisions(self.device.type)
+    
+    def _resolve_precision(self, precision: str) -> str:
+        """要求された精度を実際に使用する精度に解決"""
+        return resolve_precision(self.device.type, precision)
+    
+    def _autocast(self, precision: Optional[str] = None):
+        """指定精度の autocast コンテキストを取得"""
+        dtype = PRECISION_DTYPES[precision or self.precision]
+        if dtype is None:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device.type, dtype=dtype)
+    
+    def _prepare_model(self):
+        """モデルをデバイスに配置して推論モードに設定"""
+        self.model.to(self.device)
+        if self.channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
+        self.model.eval()
+    
+    def _forward(self, input_tensor: torch.Tensor, precision: Optional[str] = None) -> torch.Tensor:
+        """設定された精度・メモリ形式で順伝播を実行"""
+        if self.channels_last:
+            input_tensor = input_tensor.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad(), self._autocast(precision):
+            return self.model(input_tensor)
+    
+    def _forward_features(self, input_tensor: torch.Tensor, precision: Optional[str] = None) -> torch.Tensor:
+        """分類層の直前の特徴量（グローバル平均プーリング後, (N, 1280)）を計算"""
+        if self.channels_last:
+            input_tensor = input_tensor.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad(), self._autocast(precision):
+            features = self.model.features(input_tensor)
+            features = nn.functional.adaptive_avg_pool2d(features, (1, 1))
+            return torch.flatten(features, 1)
+    
     def _create_default_model(self):
         """デフォルトの軽量モデルを作成（デモ用）"""
         logger.info("Creating default MobileNetV2 model for demo")
         
         # MobileNetV2ベースの軽量モデル
         self.model = mobilenet_v2(pretrained=True)
+        self.width_mult = 1.0
         
         # 2クラス分類用にカスタマイズ（猫 vs 犬）
         num_features = self.model.classifier[1].in_features
@@ -72,60 +195,51 @@ class CUDAImageClassifier:
         self.classes = ['cat', 'dog']
         
         # モデルをデバイスに移動
-        self.model.to(self.device)
-        self.model.eval()
-        
-        # 混合精度対応
-        if self.device.type == 'cuda':
-            self.model = self.model.half()  # FP16に変換
+        self._prepare_model()
             
         self.loaded = True
-        logger.info(f"Default model loaded on {self.device}")
+        logger.info(f"Default model loaded on {self.device} ({self.precision})")
     
     def load_model(self, model_path: str):
-        """学習済みモデルを読み込み"""
+        """学習済みモデルを読み込み
+
+        明示的に指定されたモデルを読み込めない場合は例外を送出する（デモ用モデルで
+        代用すると、壊れたモデルファイルへの切り替えが成功したように見えるため）。
+        """
+        model_path = Path(model_path)
+        if not model_path.exists():
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+        
+        # モデル情報を読み込み
+        model_info_path = model_path.parent / 'model_info.json'
+        if model_info_path.exists():
+            with open(model_info_path, 'r') as f:
+                model_info = json.load(f)
+                self.classes = model_info.get('classes', ['class_0', 'class_1'])
+        
         try:
-            model_path = Path(model_path)
-            if not model_path.exists():
-                logger.warning(f"Model file not found: {model_path}")
-                self._create_default_model()
-                return
-                
-            # モデル情報を読み込み
-            model_info_path = model_path.parent / 'model_info.json'
-            if model_info_path.exists():
-                with open(model_info_path, 'r') as f:
-                    model_info = json.load(f)
-                    self.classes = model_info.get('classes', ['class_0', 'class_1'])
-            
             # PyTorchモデルを読み込み
             checkpoint = torch.load(model_path, map_location=self.device)
             
             # モデル構造を復元
-            if 'model_type' in checkpoint and checkpoint['model_type'] == 'mobilenet_v2':
-                self.model = mobilenet_v2(pretrained=False)
-                num_features = self.model.classifier[1].in_features
-                self.model.classifier[1] = nn.Linear(num_features, len(self.classes))
-            else:
-                # デフォルトモデルにフォールバック
-                self._create_default_model()
-                return
+            model_type = checkpoint.get('model_type') if isinstance(checkpoint, dict) else None
+            if model_type != 'mobilenet_v2':
+                raise ValueError(f"Unsupported model type: {model_type}")
+            # 幅を縮小したモデル（カスケードの高速モデル等）は width_mult を保存しておく
+            self.width_mult = checkpoint.get('width_mult', 1.0)
+            self.model = mobilenet_v2(pretrained=False, width_mult=self.width_mult)
+            num_features = self.model.classifier[1].in_features
+            self.model.classifier[1] = nn.Linear(num_features, len(self.classes))
                 
             # 学習済み重みを読み込み
             self.model.load_state_dict(checkpoint['model_state_dict'])
-            self.model.to(self.device)
-            self.model.eval()
-            
-            # 混合精度対応
-            if self.device.type == 'cuda':
-                self.model = self.model.half()
-                
-            self.loaded = True
-            logger.info(f"Model loaded from {model_path} on {self.device}")
-            
+            self._prepare_model()
         except Exception as e:
-            logger.error(f"Failed to load model: {e}")
-            self._create_default_model()
+            logger.error(f"Failed to load model from {model_path}: {e}")
+            raise
+            
+        self.loaded = True
+        logger.info(f"Model loaded from {model_path} on {self.device} ({self.precision})")
     
     def preprocess_image(self, image: Image.Image) -> torch.Tensor:
         """画像の前処理"""
@@ -139,17 +253,101 @@ class CUDAImageClassifier:
         # バッチ次元を追加
         tensor = tensor.unsqueeze(0)
         
-        # デバイスに移動
+        # デバイスに移動（精度変換は autocast に任せる）
         tensor = tensor.to(self.device)
-        
-        # 混合精度対応
-        if self.device.type == 'cuda':
-            tensor = tensor.half()
             
         return tensor
     
-    def predict(self, image: Image.Image) -> Dict:
-        """画像分類の推論実行"""
+    def _summarize_outputs(self, outputs: torch.Tensor,
+                           top_k: Optional[int] = None,
+                           min_confidence: Optional[float] = None,
+                           classes: Optional[List[str]] = None) -> List[Dict]:
+        """ロジットから予測結果を作成（top_k / min_confidence はデバイス上で適用）"""
+        return summarize_logits(outputs, classes or self.classes, top_k, min_confidence)
+    
+    def preprocess_config(self) -> Dict:
+        """前処理設定（前処理済みテンソルキャッシュのキーに使用）"""
+        return {
+            'input_size': list(self.input_size),
+            'resize': 'bilinear',
+            'layout': 'HWC',
+            'dtype': 'uint8',
+        }
+    
+    def prepare_image(self, image: Image.Image) -> np.ndarray:
+        """画像をリサイズ済みの uint8 配列 (H, W, 3) に変換（正規化前）"""
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.asarray(self.resize(image), dtype=np.uint8)
+    
+    def tensor_from_arrays(self, arrays: np.ndarray) -> torch.Tensor:
+        """uint8 配列 (N, H, W, 3) をデバイス上で正規化したテンソルに変換"""
+        arrays = np.ascontiguousarray(arrays)
+        if not arrays.flags.writeable:
+            # 読み取り専用の memmap はテンソル化の前に一度だけ読み出す
+            arrays = arrays.copy()
+        batch = torch.from_numpy(arrays).to(self.device)
+        # NHWC -> NCHW の転置はそのまま channels_last のメモリ配置になる
+        batch = batch.permute(0, 3, 1, 2).float().div_(255)
+        mean = torch.tensor(self.mean, device=self.device).view(1, 3, 1, 1)
+        std = torch.tensor(self.std, device=self.device).view(1, 3, 1, 1)
+        return (batch - mean) / std
+    
+    def predict_arrays(self, arrays: np.ndarray, top_k: Optional[int] = None,
+                       min_confidence: Optional[float] = None) -> List[Dict]:
+        """前処理済み uint8 配列 (N, H, W, 3) のバッチ推論（デコード・リサイズを省略）"""
+        if not self.loaded:
+            raise RuntimeError("Model not loaded")
+        
+        start_time = time.time()
+        outputs = self._forward(self.tensor_from_arrays(arrays))
+        results = self._summarize_outputs(outputs, top_k, min_confidence)
+        processing_time = (time.time() - start_time) / max(len(results), 1)
+        
+        for result in results:
+            result.update({
+                'processing_time': processing_time,
+                'device': str(self.device)
+            })
+        return results
+
+    def backbone_fingerprint(self) -> str:
+        """分類層を除いた重みのハッシュ（ヘッドのみ異なるモデルは同じ値, 初回のみ計算）"""
+        if getattr(self, '_backbone_fingerprint', None) is None:
+            self._backbone_fingerprint = compute_backbone_fingerprint(self.model.state_dict(), self.width_mult)
+        return self._backbone_fingerprint
+
+    @property
+    def embedding_dim(self) -> int:
+        """埋め込みの次元数（分類層の入力次元）"""
+        return self.model.classifier[1].in_features
+
+    def embed_arrays(self, arrays: np.ndarray) -> np.ndarray:
+        """前処理済み uint8 配列 (N, H, W, 3) の埋め込み（分類層直前の特徴量, float16 (N, D)）"""
+        if not self.loaded:
+            raise RuntimeError("Model not loaded")
+        features = self._forward_features(self.tensor_from_arrays(arrays))
+        return features.to(torch.float16).cpu().numpy()
+
+    def extract_embeddings(self, image: Image.Image) -> np.ndarray:
+        """画像1枚の埋め込み（float16 (D,)）"""
+        return self.embed_arrays(self.prepare_image(image)[None])[0]
+
+    def extract_embeddings_batch(self, images: List[Image.Image], batch_size: int = 8) -> np.ndarray:
+        """複数画像の埋め込み（float16 (N, D)）"""
+        embeddings = np.empty((len(images), self.embedding_dim), dtype=np.float16)
+        for i in range(0, len(images), batch_size):
+            arrays = np.stack([self.prepare_image(img) for img in images[i:i + batch_size]])
+            embeddings[i:i + len(arrays)] = self.embed_arrays(arrays)
+        return embeddings
+
+    def predict(self, image: Image.Image, top_k: Optional[int] = None,
+                min_confidence: Optional[float] = None) -> Dict:
+        """画像分類の推論実行
+        
+        top_k を指定すると確率上位 k クラスのみ、min_confidence を指定すると
+        その値以上の確率を持つクラスのみを class_probabilities に含める。
+        """
         if not self.loaded:
             raise RuntimeError("Model not loaded")
             
@@ -160,29 +358,8 @@ class CUDAImageClassifier:
             input_tensor = self.preprocess_image(image)
             
             # 推論実行
-            with torch.no_grad():
-                if self.device.type == 'cuda':
-                    # CUDA最適化
-                    with torch.cuda.amp.autocast():
-                        outputs = self.model(input_tensor)
-                else:
-                    outputs = self.model(input_tensor)
-                
-                # 確率計算
-                probabilities = torch.nn.functional.softmax(outputs, dim=1)
-                confidence, predicted = torch.max(probabilities, 1)
-                
-                # CPUに移動して値を取得
-                confidence = confidence.cpu().item()
-                predicted_class_idx = predicted.cpu().item()
-                predicted_class = self.classes[predicted_class_idx]
-                
-                # 全クラスの確率
-                all_probs = probabilities.cpu().numpy()[0]
-                class_probs = {
-                    self.classes[i]: float(prob) 
-                    for i, prob in enumerate(all_probs)
-                }
+            outputs = self._forward(input_tensor)
+            result = self._summarize_outputs(outputs, top_k, min_confidence)[0]
         
         except Exception as e:
             logger.error(f"Prediction error: {e}")
@@ -190,15 +367,15 @@ class CUDAImageClassifier:
         
         processing_time = time.time() - start_time
         
-        return {
-            'predicted_class': predicted_class,
-            'confidence': confidence,
-            'class_probabilities': class_probs,
+        result.update({
             'processing_time': processing_time,
             'device': str(self.device)
-        }
+        })
+        return result
     
-    def predict_batch(self, images: List[Image.Image], batch_size: int = 8) -> List[Dict]:
+    def predict_batch(self, images: List[Image.Image], batch_size: int = 8,
+                      top_k: Optional[int] = None,
+                      min_confidence: Optional[float] = None) -> List[Dict]:
         """バッチ推論（CUDA効率化）"""
         if not self.loaded:
             raise RuntimeError("Model not loaded")
@@ -219,44 +396,25 @@ class CUDAImageClassifier:
                 batch_input = torch.cat(batch_tensors, dim=0)
                 
                 # バッチ推論
-                with torch.no_grad():
-                    if self.device.type == 'cuda':
-                        with torch.cuda.amp.autocast():
-                            outputs = self.model(batch_input)
-                    else:
-                        outputs = self.model(batch_input)
-                    
-                    probabilities = torch.nn.functional.softmax(outputs, dim=1)
-                    confidences, predicted = torch.max(probabilities, 1)
-                    
-                    # 結果を個別に処理
-                    for j in range(len(batch_images)):
-                        confidence = confidences[j].cpu().item()
-                        predicted_class_idx = predicted[j].cpu().item()
-                        predicted_class = self.classes[predicted_class_idx]
-                        
-                        probs = probabilities[j].cpu().numpy()
-                        class_probs = {
-                            self.classes[k]: float(prob) 
-                            for k, prob in enumerate(probs)
-                        }
-                        
-                        processing_time = (time.time() - start_time) / len(batch_images)
-                        
-                        results.append({
-                            'predicted_class': predicted_class,
-                            'confidence': confidence,
-                            'class_probabilities': class_probs,
-                            'processing_time': processing_time,
-                            'device': str(self.device)
-                        })
+                outputs = self._forward(batch_input)
+                batch_results = self._summarize_outputs(outputs, top_k, min_confidence)
+                
+                processing_time = (time.time() - start_time) / len(batch_images)
+                
+                # 結果を個別に処理
+                for result in batch_results:
+                    result.update({
+                        'processing_time': processing_time,
+                        'device': str(self.device)
+                    })
+                    results.append(result)
                         
             except Exception as e:
                 logger.error(f"Batch prediction error: {e}")
                 # エラー時は個別処理にフォールバック
                 for img in batch_images:
                     try:
-                        result = self.predict(img)
+                        result = self.predict(img, top_k=top_k, min_confidence=min_confidence)
                         results.append(result)
                     except:
                         results.append({
@@ -274,25 +432,55 @@ class CUDAImageClassifier:
         """デバイス情報を取得"""
         info = {
             'device_type': str(self.device),
-            'device_name': str(self.device)
+            'device_name': str(self.device),
+            'precision': self.precision,
+            'supported_precisions': self.supported_precisions(),
+            'channels_last': self.channels_last,
+            'cpu_execution': self.cpu_config
         }
         
+        capabilities = get_device_capabilities()
         if self.device.type == 'cuda':
+            cuda = capabilities['cuda']
+            device_index = self.device.index or 0
             info.update({
-                'cuda_available': torch.cuda.is_available(),
-                'cuda_device_count': torch.cuda.device_count(),
-                'cuda_device_name': torch.cuda.get_device_name(0),
-                'cuda_memory_total': f"{torch.cuda.get_device_properties(0).total_memory / 1024**3:.1f}GB",
+                'cuda_available': cuda['available'],
+                'cuda_device_count': cuda['device_count'],
+                'cuda_device_name': cuda['devices'][device_index]['name'],
+                'cuda_memory_total': f"{cuda['devices'][device_index]['total_memory'] / 1024**3:.1f}GB",
+                # 使用量は実行時に変化するため都度取得（アロケータのカウンタ参照のみ）
                 'cuda_memory_allocated': f"{torch.cuda.memory_allocated() / 1024**3:.1f}GB",
                 'cuda_memory_cached': f"{torch.cuda.memory_reserved() / 1024**3:.1f}GB"
             })
         elif self.device.type == 'mps':
             info.update({
-                'mps_available': torch.backends.mps.is_available()
+                'mps_available': capabilities['mps']['available']
             })
             
         return info
     
+    def warmup(self, batch_sizes: List[int] = (1,), iterations: int = 2) -> Dict:
+        """指定バッチサイズで事前に推論を実行（初回のカーネル初期化等を済ませる）"""
+        if not self.loaded:
+            raise RuntimeError("Model not loaded")
+        
+        dummy_image = Image.new('RGB', (224, 224), color='red')
+        timings = {}
+        for batch_size in batch_sizes:
+            images = [dummy_image] * batch_size
+            start_time = time.time()
+            for _ in range(iterations):
+                self.predict_batch(images, batch_size=batch_size)
+            self._synchronize()
+            timings[batch_size] = (time.time() - start_time) / iterations
+        
+        return {
+            'device': str(self.device),
+            'precision': self.precision,
+            'batch_sizes': list(batch_sizes),
+            'average_time_per_batch': timings
+        }
+    
     def benchmark(self, num_iterations: int = 100) -> Dict:
         """推論速度ベンチマーク"""
         if not self.loaded:
@@ -321,18 +509,167 @@ class CUDAImageClassifier:
             'device': str(self.device),
             'iterations': num_iterations
         }
+    
+    def benchmark_arrays(self, batches) -> Dict:
+        """前処理済み配列バッチを順に推論してスループットを計測（デコードなし）"""
+        if not self.loaded:
+            raise RuntimeError("Model not loaded")
+        
+        num_images = 0
+        num_batches = 0
+        start_time = time.time()
+        for batch in batches:
+            self.predict_arrays(batch)
+            num_images += len(batch)
+            num_batches += 1
+        self._synchronize()
+        total_time = time.time() - start_time
+        
+        return {
+            'total_time': total_time,
+            'average_time_per_inference': total_time / num_images if num_images else 0.0,
+            'throughput_fps': num_images / total_time if total_time > 0 else 0.0,
+            'device': str(self.device),
+            'images': num_images,
+            'batches': num_batches
+        }
+    
+    def validate_precision(self, images: Optional[List[Image.Image]] = None,
+                           num_samples: int = 16, num_iterations: int = 20) -> Dict:
+        """精度設定ごとの精度差・レイテンシ差をFP32基準で計測"""
+        if not self.loaded:
+            raise RuntimeError("Model not loaded")
+        
+        batch_input = self._validation_input(images, num_samples)
+        return self._compare_precisions(self._forward, batch_input, num_iterations)
+    
+    def _validation_input(self, images: Optional[List[Image.Image]] = None,
+                          num_samples: int = 16) -> torch.Tensor:
+        """精度検証用の入力（省略時は再現性のある乱数画像）"""
+        if images:
+            return torch.cat([self.preprocess_image(img) for img in images], dim=0)
+        generator = torch.Generator().manual_seed(0)
+        batch_input = torch.rand(num_samples, 3, 224, 224, generator=generator)
+        batch_input = transforms.Normalize(mean=[0.485, 0.456, 0.406],
+                                           std=[0.229, 0.224, 0.225])(batch_input)
+        return batch_input.to(self.device)
+    
+    def _compare_precisions(self, forward, batch_input: torch.Tensor, num_iterations: int) -> Dict:
+        """forward(入力, 精度) のロジットとレイテンシを精度ごとにFP32と比較"""
+        results = {}
+        reference = None
+        for precision in self.supported_precisions():
+            # ウォームアップ
+            for _ in range(3):
+                forward(batch_input, precision)
+            self._synchronize()
+            
+            start_time = time.time()
+            for _ in range(num_iterations):
+                outputs = forward(batch_input, precision)
+            self._synchronize()
+            average_time = (time.time() - start_time) / num_iterations
+            
+            probabilities = torch.nn.functional.softmax(outputs.float(), dim=1)
+            if reference is None:
+                reference = (probabilities, average_time)
+            reference_probs, reference_time = reference
+            
+            results[precision] = {
+                'average_batch_time': average_time,
+                'latency_delta': average_time - reference_time,
+                'speedup': reference_time / average_time if average_time > 0 else 0.0,
+                'top1_agreement': (probabilities.argmax(dim=1) == reference_probs.argmax(dim=1)).float().mean().item(),
+                'max_abs_prob_diff': (probabilities - reference_probs).abs().max().item()
+            }
+        
+        return {
+            'device': str(self.device),
+            'reference': 'fp32',
+            'current_precision': self.precision,
+            'channels_last': self.channels_last,
+            'num_samples': batch_input.shape[0],
+            'iterations': num_iterations,
+            'results': results
+        }
+    
+    def _synchronize(self):
+        """非同期実行デバイスの処理完了を待機"""
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize()
+
+class ArrayClassifierMixin:
+    """predict_arrays を実装した分類器（共有バックボーン・カスケード等）に画像単位の推論を提供"""
+    
+    # ベンチマークは委譲先の分類器ではなく、この分類器の predict / predict_arrays の経路を計測
+    benchmark = CUDAImageClassifier.benchmark
+    benchmark_arrays = CUDAImageClassifier.benchmark_arrays
+    
+    def predict(self, image: Image.Image, top_k: Optional[int] = None,
+                min_confidence: Optional[float] = None) -> Dict:
+        return self.predict_arrays(self.prepare_image(image)[None], top_k, min_confidence)[0]
+    
+    def predict_batch(self, images: List[Image.Image], batch_size: int = 8,
+                      top_k: Optional[int] = None,
+                      min_confidence: Optional[float] = None) -> List[Dict]:
+        results = []
+        for i in range(0, len(images), batch_size):
+            batch_images = images[i:i + batch_size]
+            try:
+                arrays = np.stack([self.prepare_image(img) for img in batch_images])
+                results.extend(self.predict_arrays(arrays, top_k, min_confidence))
+            except Exception as e:
+                logger.error(f"Batch prediction error: {e}")
+                results.extend({
+                    'predicted_class': 'error',
+                    'confidence': 0.0,
+                    'class_probabilities': {},
+                    'processing_time': 0.0,
+                    'device': str(self.device),
+                    'error': str(e)
+                } for _ in batch_images)
+        return results
+
+# グローバルインスタンス（設定ごとのシングルトン）
+_classifier_instances = {}
+_classifier_lock = threading.Lock()
+
+def _classifier_key(device_type, precision, channels_last, model_path, model_version):
+    return (device_type, precision, channels_last, model_path, model_version)
+
+def get_classifier(device_type: str = 'auto', precision: str = 'fp32',
+                   channels_last: bool = True, model_path: Optional[str] = None,
+                   model_version: Optional[str] = None) -> CUDAImageClassifier:
+    """グローバル分類器インスタンスを取得
 
-# グローバルインスタンス（シングルトン）
-_classifier_instance = None
+    model_version はキャッシュのキーにのみ使用し、同じパスのモデルファイルが
+    更新された場合に別インスタンスとして読み込むために指定する。
+    """
+    key = _classifier_key(device_type, precision, channels_last, model_path, model_version)
+    classifier = _classifier_instances.get(key)
+    if classifier is None:
+        # 同時に初回リクエストが来ても読み込みは1回のみ
+        with _classifier_lock:
+            classifier = _classifier_instances.get(key)
+            if classifier is None:
+                classifier = CUDAImageClassifier(
+                    model_path=model_path,
+                    device_type=device_type,
+                    precision=precision,
+                    channels_last=channels_last
+                )
+                _classifier_instances[key] = classifier
+    return classifier
 
-def get_classifier(device_type: str = 'auto') -> CUDAImageClassifier:
-    """グローバル分類器インスタンスを取得"""
-    global _classifier_instance
-    if _classifier_instance is None:
-        _classifier_instance = CUDAImageClassifier(device_type=device_type)
-    return _classifier_instance
+def release_classifier(device_type: str = 'auto', precision: str = 'fp32',
+                       channels_last: bool = True, model_path: Optional[str] = None,
+                       model_version: Optional[str] = None):
+    """分類器インスタンスをキャッシュから外す（使用中の参照がなくなった時点で解放される）"""
+    key = _classifier_key(device_type, precision, channels_last, model_path, model_version)
+    with _classifier_lock:
+        return _classifier_instances.pop(key, None)
 
 def reset_classifier():
     """分類器インスタンスをリセット"""
-    global _classifier_instance
-    _classifier_instance = None
+    with _classifier_lock:
+        _classifier_instances.clear()
@@ -0,0 +1,439 @@
+"""
+物体検知推論（SSDlite320-MobileNetV3）
+
+CUDAImageClassifier とデバイス選択・推論精度・ウォームアップ・ベンチマークを
+共通化し、前処理と後処理のみを置き換える。
+
+- 前処理: アスペクト比を保って縮小し、余白を埋める（レターボックス）。
+  バッチ分の uint8 配列を一度に確保して書き込む。
+- 後処理: 画像 × クラスごとの NMS を、画像番号とクラス番号を組み合わせた
+  グループごとにボックスの座標をずらして torchvision.ops.nms を1回呼ぶだけで行う
+  （CPU で候補が多い場合のみ画像単位）。候補の抽出とボックスの復号もバッチ単位。
+  画像ごとの上限件数の切り詰めもテンソル演算で行う。
+- 結果: 画像ごとに boxes / scores / labels の並列配列（元画像の座標）。
+
+top_k は画像あたりの最大検出数、min_confidence はスコアの閾値として扱う。
+"""
+import time
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision.models.detection import ssdlite320_mobilenet_v3_large, SSDLite320_MobileNet_V3_Large_Weights
+from torchvision.models.detection.image_list import ImageList
+from torchvision.ops import box_iou, clip_boxes_to_image, nms
+
+from .cuda_inference import CUDAImageClassifier
+
+logger = logging.getLogger(__name__)
+
+# レターボックスの余白の色
+LETTERBOX_FILL = 114
+# CPU で1回の NMS にまとめる候補数の上限（超える場合は画像単位）
+CPU_NMS_MAX_BOXES = 4000
+
+
+def letterbox_params(width: int, height: int, input_size: Tuple[int, int]) -> Tuple[float, int, int]:
+    """元画像を入力サイズに収める縮小率と余白（左, 上）"""
+    input_height, input_width = input_size
+    scale = min(input_width / width, input_height / height)
+    new_width, new_height = max(1, round(width * scale)), max(1, round(height * scale))
+    return scale, (input_width - new_width) // 2, (input_height - new_height) // 2
+
+
+def letterbox_batch(images: Sequence[Image.Image], input_size: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    """複数画像をレターボックス化した uint8 配列 (N, H, W, 3) と元画像のサイズ (N, 2)"""
+    input_height, input_width = input_size
+    batch = np.full((len(images), input_height, input_width, 3), LETTERBOX_FILL, dtype=np.uint8)
+    sizes = np.empty((len(images), 2), dtype=np.int64)
+    for i, image in enumerate(images):
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        scale, left, top = letterbox_params(image.width, image.height, input_size)
+        new_width, new_height = max(1, round(image.width * scale)), max(1, round(image.height * scale))
+        resized = image.resize((new_width, new_height), Image.BILINEAR)
+        batch[i, top:top + new_height, left:left + new_width] = np.asarray(resized)
+        sizes[i] = (image.width, image.height)
+    return batch, sizes
+
+
+def batched_multiclass_nms(boxes: torch.Tensor, scores: torch.Tensor, score_threshold: float,
+                           iou_threshold: float, max_detections: int, pre_nms_top_k: int):
+    """バッチ全体の画像 × クラスごとの NMS
+
+    boxes は (N, A, 4)（入力画像の範囲に収めたもの）、scores は背景を除いた (N, A, C)。
+    戻り値は検出ごとの (画像番号, ボックス, スコア, クラス番号) で、画像番号順・スコア降順。
+    """
+    num_images, num_anchors, num_classes = scores.shape
+
+    # 画像ごとに (アンカー, クラス) の上位候補を取り出す
+    k = min(pre_nms_top_k, num_anchors * num_classes)
+    top_scores, top_indices = scores.reshape(num_images, -1).topk(k, dim=1)
+    anchor_indices = torch.div(top_indices, num_classes, rounding_mode='floor')
+    class_indices = top_indices % num_classes
+    candidate_boxes = boxes.gather(1, anchor_indices.unsqueeze(-1).expand(-1, -1, 4))
+    image_indices = torch.arange(num_images, device=scores.device).unsqueeze(1).expand(-1, k)
+
+    mask = top_scores > score_threshold
+    candidate_boxes = candidate_boxes[mask]
+    top_scores = top_scores[mask]
+    class_indices = class_indices[mask]
+    image_indices = image_indices[mask]
+
+    # 画像 × クラスをグループとした NMS
+    # グループごとにボックスを重ならない位置へずらし、全グループを1回の NMS で処理する
+    keep = torch.empty(0, dtype=torch.int64, device=scores.device)
+    if len(top_scores):
+        # （座標が負のボックスがあってもグループ同士が重ならないよう、座標の範囲の幅でずらす）
+        groups = image_indices * num_classes + class_indices
+        span = candidate_boxes.max() - candidate_boxes.min() + 1
+        offsets = groups.to(candidate_boxes.dtype) * span
+        shifted = candidate_boxes + offsets.unsqueeze(1)
+        if scores.device.type != 'cpu' or len(top_scores) <= CPU_NMS_MAX_BOXES:
+            keep = nms(shifted, top_scores, iou_threshold)
+        else:
+            # CPU の NMS は候補数の2乗で遅くなるため画像単位で実行（候補は画像順に並んでいる）
+            counts = torch.bincount(image_indices, minlength=num_images).tolist()
+            starts = np.cumsum([0] + counts[:-1]).tolist()
+            keep = torch.cat([
+                nms(shifted[start:start + count], top_scores[start:start + count], iou_threshold) + start
+                for start, count in zip(starts, counts) if count
+            ])
+
+    # 画像番号で安定ソートし、画像ごとの順位で上限件数に切り詰め
+    order = torch.sort(image_indices[keep], stable=True).indices
+    keep = keep[order]
+    kept_images = image_indices[keep]
+    counts = torch.bincount(kept_images, minlength=num_images)
+    starts = torch.cumsum(counts, 0) - counts
+    rank = torch.arange(len(keep), device=keep.device) - starts[kept_images]
+    keep = keep[rank < max_detections]
+
+    return image_indices[keep], candidate_boxes[keep], top_scores[keep], class_indices[keep]
+
+
+class CUDAObjectDetector(CUDAImageClassifier):
+    """CUDA対応物体検知器（SSDlite320-MobileNetV3）"""
+
+    def __init__(self, model_path: Optional[str] = None, device_type: str = 'auto',
+                 precision: str = 'fp32', channels_last: bool = True,
+                 score_threshold: float = 0.3, iou_threshold: float = 0.55,
+                 max_detections: int = 100, pre_nms_top_k: int = 1000):
+        super().__init__(model_path=model_path, device_type=device_type,
+                         precision=precision, channels_last=channels_last)
+        self.input_size = (320, 320)
+        self.mean = [0.5, 0.5, 0.5]
+        self.std = [0.5, 0.5, 0.5]
+        self.score_threshold = score_threshold
+        self.iou_threshold = iou_threshold
+        self.max_detections = max_detections
+        self.pre_nms_top_k = pre_nms_top_k
+        self._anchors = {}
+
+    def _create_default_model(self):
+        """デフォルトの COCO 学習済みモデルを作成（重みを取得できない場合は未学習）"""
+        weights = SSDLite320_MobileNet_V3_Large_Weights.COCO_V1
+        try:
+            self.model = ssdlite320_mobilenet_v3_large(weights=weights)
+        except Exception as e:
+            logger.warning(f"Failed to load pretrained detection weights, using random weights: {e}")
+            self.model = ssdlite320_mobilenet_v3_large(weights=None, weights_backbone=None,
+                                                       num_classes=len(weights.meta['categories']))
+        self.classes = list(weights.meta['categories'])
+        self._prepare_model()
+        self.loaded = True
+        logger.info(f"Default detection model loaded on {self.device} ({self.precision})")
+
+    def load_model(self, model_path: str):
+        """学習済みモデルを読み込み（model_info.json の classes は背景クラスを先頭に含む）
+
+        読み込めない場合は例外を送出する（CUDAImageClassifier.load_model と同様）。
+        """
+        model_path = Path(model_path)
+        if not model_path.exists():
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+
+        model_info_path = model_path.parent / 'model_info.json'
+        if model_info_path.exists():
+            with open(model_info_path, 'r') as f:
+                self.classes = json.load(f).get('classes', [])
+
+        try:
+            checkpoint = torch.load(model_path, map_location=self.device)
+            model_type = checkpoint.get('model_type') if isinstance(checkpoint, dict) else None
+            if model_type != 'ssdlite320_mobilenet_v3_large':
+                raise ValueError(f"Unsupported detection model type: {model_type}")
+
+            num_classes = checkpoint.get('num_classes', len(self.classes))
+            if len(self.classes) != num_classes:
+                self.classes = ['__background__'] + [f'class_{i}' for i in range(1, num_classes)]
+            self.model = ssdlite320_mobilenet_v3_large(weights=None, weights_backbone=None, num_classes=num_classes)
+            self.model.load_state_dict(checkpoint['model_state_dict'])
+            self._prepare_model()
+        except Exception as e:
+            logger.error(f"Failed to load detection model from {model_path}: {e}")
+            raise
+
+        self.loaded = True
+        logger.info(f"Detection model loaded from {model_path} on {self.device} ({self.precision})")
+
+    def preprocess_config(self) -> Dict:
+        config = super().preprocess_config()
+        config['letterbox'] = LETTERBOX_FILL
+        return config
+
+    def prepare_image(self, image: Image.Image) -> np.ndarray:
+        """画像をレターボックス化した uint8 配列 (H, W, 3) に変換（正規化前）"""
+        return letterbox_batch([image], self.input_size)[0][0]
+
+    def _forward(self, input_tensor: torch.Tensor, precision: Optional[str] = None):
+        """バックボーンと検出ヘッドを実行し、ボックス (N, A, 4, 入力画像の範囲内) と背景を除くスコア (N, A, C) を返す"""
+        if self.channels_last:
+            input_tensor = input_tensor.contiguous(memory_format=torch.channels_last)
+        with torch.no_grad(), self._autocast(precision):
+            features = list(self.model.backbone(input_tensor).values())
+            head_outputs = self.model.head(features)
+
+        with torch.no_grad():
+            anchors = self._get_anchors(input_tensor, features)
+            num_images = input_tensor.shape[0]
+            regression = head_outputs['bbox_regression'].float()
+            boxes = self.model.box_coder.decode_single(
+                regression.reshape(-1, 4), anchors.repeat(num_images, 1)
+            ).view(num_images, -1, 4)
+            # SSD.postprocess_detections と同様に入力画像の範囲に収める
+            boxes = clip_boxes_to_image(boxes, tuple(input_tensor.shape[-2:]))
+            scores = torch.softmax(head_outputs['cls_logits'].float(), dim=-1)[..., 1:]
+        return boxes, scores
+
+    def _get_anchors(self, input_tensor: torch.Tensor, features: List[torch.Tensor]) -> torch.Tensor:
+        """入力サイズごとのアンカー（画像によらず同じのためキャッシュ）"""
+        height, width = input_tensor.shape[-2:]
+        key = (height, width, input_tensor.device)
+        if key not in self._anchors:
+            image_list = ImageList(input_tensor[:1], [(height, width)])
+            self._anchors[key] = self.model.anchor_generator(image_list, [f[:1] for f in features])[0]
+        return self._anchors[key]
+
+    def predict_arrays(self, arrays: np.ndarray, top_k: Optional[int] = None,
+                       min_confidence: Optional[float] = None,
+                       image_sizes: Optional[np.ndarray] = None) -> List[Dict]:
+        """レターボックス済み uint8 配列 (N, H, W, 3) のバッチ検出
+
+        image_sizes（元画像の幅・高さ (N, 2)）を指定するとボックスを元画像の座標に戻す。
+        """
+        if not self.loaded:
+            raise RuntimeError("Model not loaded")
+
+        start_time = time.time()
+        num_images = len(arrays)
+        boxes, scores = self._forward(self.tensor_from_arrays(arrays))
+        image_indices, boxes, scores, labels = batched_multiclass_nms(
+            boxes, scores,
+            score_threshold=self.score_threshold if min_confidence is None else min_confidence,
+            iou_threshold=self.iou_threshold,
+            max_detections=self.max_detections if top_k is None else top_k,
+            pre_nms_top_k=self.pre_nms_top_k,
+        )
+
+        if image_sizes is not None:
+            # レターボックスの余白・縮小を戻し、元画像の範囲に収める
+            sizes = torch.as_tensor(np.asarray(image_sizes), dtype=torch.float32, device=boxes.device)
+            input_height, input_width = self.input_size
+            scale = torch.minimum(input_width / sizes[:, 0], input_height / sizes[:, 1])
+            pad_x = torch.div(input_width - torch.clamp((sizes[:, 0] * scale).round(), min=1), 2, rounding_mode='floor')
+            pad_y = torch.div(input_height - torch.clamp((sizes[:, 1] * scale).round(), min=1), 2, rounding_mode='floor')
+            offsets = torch.stack([pad_x, pad_y, pad_x, pad_y], dim=1)[image_indices]
+            limits = torch.cat([sizes, sizes], dim=1)[image_indices]
+            boxes = ((boxes - offsets) / scale[image_indices].unsqueeze(1)).clamp(min=0)
+            boxes = torch.minimum(boxes, limits)
+
+        # まとめてCPUに移動し、画像ごとに分割
+        counts = torch.bincount(image_indices, minlength=num_images).cpu().tolist()
+        boxes = boxes.cpu().numpy().astype(np.float64).round(1)
+        scores = scores.cpu().numpy().astype(np.float64).round(4)
+        labels = (labels + 1).cpu().numpy()   # 背景クラス分をずらす
+
+        processing_time = (time.time() - start_time) / max(num_images, 1)
+        results = []
+        offset = 0
+        for count in counts:
+            image_labels = labels[offset:offset + count].tolist()
+            results.append({
+                'boxes': boxes[offset:offset + count].tolist(),
+                'scores': scores[offset:offset + count].tolist(),
+                'labels': [self.classes[i] if i < len(self.classes) else str(i) for i in image_labels],
+                'label_ids': image_labels,
+                'num_detections': count,
+                'processing_time': processing_time,
+                'device': str(self.device),
+            })
+            offset += count
+        return results
+
+    def predict(self, image: Image.Image, top_k: Optional[int] = None,
+                min_confidence: Optional[float] = None) -> Dict:
+        """物体検知の推論実行（ボックスは元画像の座標）"""
+        return self.predict_batch([image], batch_size=1, top_k=top_k, min_confidence=min_confidence)[0]
+
+    def predict_batch(self, images: List[Image.Image], batch_size: int = 8,
+                      top_k: Optional[int] = None,
+                      min_confidence: Optional[float] = None,
+                      original_sizes: Optional[List[Tuple[int, int]]] = None) -> List[Dict]:
+        """複数画像の一括検出（レターボックス化と NMS もバッチ単位）
+
+        縮小デコードした画像の場合は original_sizes（元画像の幅・高さ）を指定すると
+        ボックスを元画像の座標で返す。
+        """
+        results = []
+        for i in range(0, len(images), batch_size):
+            batch_images = images[i:i + batch_size]
+            try:
+                arrays, sizes = letterbox_batch(batch_images, self.input_size)
+                batch_results = self.predict_arrays(arrays, top_k, min_confidence, image_sizes=sizes)
+                if original_sizes is not None:
+                    for result, size, original in zip(batch_results, sizes, original_sizes[i:i + batch_size]):
+                        if result['boxes'] and tuple(size) != tuple(original):
+                            ratio = np.tile(np.asarray(original, dtype=np.float64) / size, 2)
+                            result['boxes'] = (np.asarray(result['boxes']) * ratio).round(1).tolist()
+                results.extend(batch_results)
+            except Exception as e:
+                logger.error(f"Batch detection error: {e}")
+                results.extend({
+                    'boxes': [],
+                    'scores': [],
+                    'labels': [],
+                    'label_ids': [],
+                    'num_detections': 0,
+                    'processing_time': 0.0,
+                    'device': str(self.device),
+                    'error': str(e)
+                } for _ in batch_images)
+        return results
+
+    def validate_precision(self, images: Optional[List[Image.Image]] = None,
+                           num_samples: int = 16, num_iterations: int = 20,
+                           iou_threshold: float = 0.5) -> Dict:
+        """精度設定ごとの検出結果の差・レイテンシ差をFP32基準で計測
+
+        FP32 の検出ごとに同じ画像・同じクラスで IoU が最大の検出を対応付け、
+        IoU が iou_threshold 以上の割合（matched_ratio）とスコア差を比較する。
+        """
+        if not self.loaded:
+            raise RuntimeError("Model not loaded")
+
+        if images:
+            arrays = letterbox_batch(images, self.input_size)[0]
+        else:
+            # 再現性のある乱数画像を作成
+            generator = np.random.default_rng(0)
+            arrays = generator.integers(0, 256, (num_samples, *self.input_size, 3), dtype=np.uint8)
+        batch_input = self.tensor_from_arrays(arrays)
+
+        results = {}
+        reference = None
+        for precision in self.supported_precisions():
+            # ウォームアップ
+            for _ in range(3):
+                self._forward(batch_input, precision)
+            self._synchronize()
+
+            start_time = time.time()
+            for _ in range(num_iterations):
+                boxes, scores = self._forward(batch_input, precision)
+            self._synchronize()
+            average_time = (time.time() - start_time) / num_iterations
+
+            detections = batched_multiclass_nms(
+                boxes, scores, self.score_threshold, self.iou_threshold,
+                self.max_detections, self.pre_nms_top_k,
+            )
+            if reference is None:
+                reference = (detections, average_time)
+            reference_detections, reference_time = reference
+
+            result = {
+                'average_batch_time': average_time,
+                'latency_delta': average_time - reference_time,
+                'speedup': reference_time / average_time if average_time > 0 else 0.0,
+                'num_detections': len(detections[0]),
+                'reference_detections': len(reference_detections[0]),
+            }
+            result.update(_match_detections(reference_detections, detections, iou_threshold))
+            results[precision] = result
+
+        return {
+            'device': str(self.device),
+            'reference': 'fp32',
+            'current_precision': self.precision,
+            'channels_last': self.channels_last,
+            'num_samples': len(arrays),
+            'iterations': num_iterations,
+            'iou_threshold': iou_threshold,
+            'results': results
+        }
+
+
+def _match_detections(reference, detections, iou_threshold: float) -> Dict:
+    """基準の検出ごとに同じ画像・クラスの最も重なる検出を対応付けて比較"""
+    ref_images, ref_boxes, ref_scores, ref_labels = reference
+    images, boxes, scores, labels = detections
+    if not len(ref_boxes):
+        return {'matched_ratio': 1.0 if not len(boxes) else 0.0, 'mean_iou': 1.0, 'max_abs_score_diff': 0.0}
+    if not len(boxes):
+        return {'matched_ratio': 0.0, 'mean_iou': 0.0, 'max_abs_score_diff': 0.0}
+
+    same_group = (ref_images[:, None] == images[None]) & (ref_labels[:, None] == labels[None])
+    iou = box_iou(ref_boxes, boxes) * same_group
+    best_iou, best_index = iou.max(dim=1)
+    matched = best_iou >= iou_threshold
+    score_diff = (ref_scores - scores[best_index]).abs()[matched]
+    return {
+        'matched_ratio': matched.float().mean().item(),
+        'mean_iou': best_iou.mean().item(),
+        'max_abs_score_diff': score_diff.max().item() if len(score_diff) else 0.0,
+    }
+
+
+# グローバルインスタンス（設定ごとのシングルトン）
+_detector_instances = {}
+_detector_lock = threading.Lock()
+
+
+def get_detector(device_type: str = 'auto', precision: str = 'fp32',
+                 channels_last: bool = True, model_path: Optional[str] = None,
+                 model_version: Optional[str] = None) -> CUDAObjectDetector:
+    """設定ごとの物体検知器を取得（model_version はキャッシュのキーにのみ使用）"""
+    key = (device_type, precision, channels_last, model_path, model_version)
+    detector = _detector_instances.get(key)
+    if detector is None:
+        with _detector_lock:
+            detector = _detector_instances.get(key)
+            if detector is None:
+                detector = CUDAObjectDetector(
+                    model_path=model_path,
+                    device_type=device_type,
+                    precision=precision,
+                    channels_last=channels_last
+                )
+                _detector_instances[key] = detector
+    return detector
+
+
+def release_detector(device_type: str = 'auto', precision: str = 'fp32',
+                     channels_last: bool = True, model_path: Optional[str] = None,
+                     model_version: Optional[str] = None):
+    """物体検知器をキャッシュから外す（参照中のリクエストが終われば解放される）"""
+    with _detector_lock:
+        return _detector_instances.pop((device_type, precision, channels_last, model_path, model_version), None)
+
+
+def reset_detector():
+    """物体検知器インスタンスをリセット"""
+    with _detector_lock:
+        _detector_instances.clear()
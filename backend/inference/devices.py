@@ -0,0 +1,127 @@
+"""
+プロセス全体で共有するデバイス性能情報のキャッシュ
+
+CUDA/MPS の可用性やデバイスプロパティの問い合わせは起動時（または初回利用時）に
+一度だけ行い、以降のバッチサイズ決定・デバイス選択はキャッシュを参照する。
+再取得は refresh=True を指定した場合のみ行う。
+"""
+import time
+import logging
+import threading
+from typing import Dict, List
+
+from .cpu_config import get_available_cores
+
+logger = logging.getLogger(__name__)
+
+# 推論精度の設定値
+PRECISIONS = ('fp32', 'fp16', 'bf16')
+
+_capabilities = None
+_capabilities_lock = threading.Lock()
+
+
+def get_device_capabilities(refresh: bool = False) -> Dict:
+    """デバイス性能情報を取得（初回のみ問い合わせ）"""
+    global _capabilities
+    with _capabilities_lock:
+        if _capabilities is None or refresh:
+            _capabilities = _probe_devices()
+        return _capabilities
+
+
+def resolve_device_type(device_type: str = 'auto') -> str:
+    """'auto' を実際のデバイス種別（cuda / mps / cpu）に解決"""
+    if device_type == 'auto':
+        return get_device_capabilities()['default_device']
+    return device_type
+
+
+def get_supported_precisions(device_type: str) -> List[str]:
+    """デバイス種別ごとの利用可能な推論精度"""
+    info = get_device_capabilities().get(resolve_device_type(device_type))
+    if not info or not info['available']:
+        return ['fp32']
+    return list(info['supported_precisions'])
+
+
+def resolve_precision(device_type: str, precision: str) -> str:
+    """要求された精度をデバイスで実際に使用する精度に解決"""
+    supported = get_supported_precisions(device_type)
+    if precision == 'auto':
+        # CUDAはFP16、CPUはBF16（対応時）を優先
+        for candidate in ('fp16', 'bf16'):
+            if candidate in supported:
+                return candidate
+        return 'fp32'
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}")
+    if precision not in supported:
+        logger.warning(f"Precision {precision} is not supported on {device_type}, falling back to fp32")
+        return 'fp32'
+    return precision
+
+
+def _probe_devices() -> Dict:
+    """torch にデバイス情報を問い合わせ"""
+    import torch
+
+    start_time = time.time()
+
+    cuda = {'available': torch.cuda.is_available(), 'device_count': 0, 'devices': [],
+            'supported_precisions': ['fp32']}
+    if cuda['available']:
+        cuda['device_count'] = torch.cuda.device_count()
+        for index in range(cuda['device_count']):
+            props = torch.cuda.get_device_properties(index)
+            cuda['devices'].append({
+                'index': index,
+                'name': props.name,
+                'total_memory': props.total_memory,
+                'multi_processor_count': props.multi_processor_count,
+                'compute_capability': f"{props.major}.{props.minor}",
+            })
+        cuda['supported_precisions'].append('fp16')
+        if torch.cuda.is_bf16_supported():
+            cuda['supported_precisions'].append('bf16')
+
+    mps = {
+        'available': hasattr(torch.backends, 'mps') and torch.backends.mps.is_available(),
+        'supported_precisions': ['fp32'],
+    }
+
+    cpu = {
+        'available': True,
+        'num_cores': len(get_available_cores()),
+        'supported_precisions': ['fp32'],
+    }
+    if _cpu_supports_bf16():
+        cpu['supported_precisions'].append('bf16')
+
+    if cuda['available']:
+        default_device = 'cuda'
+    elif mps['available']:
+        default_device = 'mps'
+    else:
+        default_device = 'cpu'
+
+    capabilities = {
+        'default_device': default_device,
+        'cuda': cuda,
+        'mps': mps,
+        'cpu': cpu,
+        'probed_at': time.time(),
+        'probe_time': time.time() - start_time,
+    }
+    logger.info(f"Device capabilities probed: default={default_device}, "
+                f"cuda_devices={cuda['device_count']}, cpu_cores={cpu['num_cores']}")
+    return capabilities
+
+
+def _cpu_supports_bf16() -> bool:
+    """CPUがBF16演算（AVX512-BF16/AMX等）に対応しているか"""
+    import torch
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
@@ -0,0 +1,103 @@
+"""
+保存済みアップロード画像の埋め込み（特徴量）ストア
+
+分類層直前の特徴量（MobileNetV2 では 1280 次元）を float16 で保存し、
+類似画像検索やヘッドの再学習で画像を再デコード・再推論せずに使う。
+埋め込みはバックボーン（分類層を除いた重み）ごとのディレクトリに、アップロードID →
+レコード番号のインデックスと追記型の配列ファイルで保存する
+（tensor_cache.AppendOnlyArrayStore と同じ形式）。
+"""
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .tensor_cache import AppendOnlyArrayStore, get_tensor_cache, get_upload_array
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingStore(AppendOnlyArrayStore):
+    """アップロードID → float16 埋め込みの追記型ストア"""
+
+    def __init__(self, directory, model_key: str, dim: int):
+        super().__init__(Path(directory) / model_key, (dim,), np.float16)
+        self.model_key = model_key
+        self.dim = dim
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats.update({'model_key': self.model_key, 'dim': self.dim})
+        return stats
+
+
+def get_embedding_key(classifier) -> str:
+    """埋め込みを計算するバックボーンの識別子（ストアのディレクトリ名）
+
+    分類層を除いた重み・前処理・推論精度から作成する。ヘッドのみを再学習したモデル
+    （retrain_head）や共有バックボーンのアプリでは同じ埋め込みを使い続けられる。
+    """
+    key = json.dumps({
+        'backbone': classifier.backbone_fingerprint(),
+        'preprocess': classifier.preprocess_config(),
+        'precision': classifier.precision,
+    }, sort_keys=True)
+    return hashlib.sha1(key.encode()).hexdigest()[:12]
+
+
+def embed_uploads(classifier, uploads: List, store: Optional[EmbeddingStore] = None,
+                  batch_size: int = 32) -> Tuple[np.ndarray, List[bool]]:
+    """保存済みアップロード画像の埋め込みを取得（ストアにない分のみ計算して追記）
+
+    読み込めなかった画像の行はゼロで埋め、成否を2つ目の戻り値で返す。
+    """
+    keys = [str(upload.pk) for upload in uploads]
+    if store is not None:
+        embeddings, found = store.get_many(keys)
+    else:
+        embeddings = np.zeros((len(uploads), classifier.embedding_dim), dtype=np.float16)
+        found = [False] * len(uploads)
+
+    missing = [i for i, ok in enumerate(found) if not ok]
+    cache = get_tensor_cache(classifier.preprocess_config())
+    for start in range(0, len(missing), batch_size):
+        indices, arrays = [], []
+        for i in missing[start:start + batch_size]:
+            try:
+                arrays.append(get_upload_array(classifier, uploads[i], cache))
+                indices.append(i)
+            except Exception as e:
+                logger.warning(f"Failed to load upload {uploads[i].pk} for embedding: {e}")
+        if not indices:
+            continue
+        batch = classifier.embed_arrays(np.stack(arrays))
+        embeddings[indices] = batch
+        if store is not None:
+            store.put_many([keys[i] for i in indices], batch)
+        for i in indices:
+            found[i] = True
+    return embeddings, found
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(classifier, enabled: Optional[bool] = None) -> Optional[EmbeddingStore]:
+    """分類器のバックボーンに対応する埋め込みストアを取得
+
+    enabled を省略すると INFERENCE_EMBEDDING_STORE['ENABLED'] に従う（無効時は None）。
+    """
+    config = getattr(settings, 'INFERENCE_EMBEDDING_STORE', {})
+    if not (config.get('ENABLED', False) if enabled is None else enabled):
+        return None
+    key = get_embedding_key(classifier)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = EmbeddingStore(config['DIRECTORY'], key, classifier.embedding_dim)
+        return _stores[key]
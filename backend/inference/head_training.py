@@ -0,0 +1,117 @@
+"""
+埋め込みからの線形ヘッドの再学習
+
+バックボーンを固定し、保存済みアップロード画像の埋め込み（embedding_store.py）と
+推論ログのユーザーフィードバックから分類層（classifier[1]）のみを学習する。
+全サンプルを1バッチとして L-BFGS で最適化するため、CPU でも数秒で終わる。
+
+- 正解（correct）: 予測クラスを正解ラベルとして交差エントロピー
+- 不正解（incorrect）: 予測クラスの確率 p を下げる -log(1 - p)
+- 現在のヘッドの重みからの L2 正則化（フィードバックが少なくても大きく崩さない）
+"""
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+logger = logging.getLogger(__name__)
+
+
+def initial_head(weight: torch.Tensor, bias: torch.Tensor, current_classes: List[str],
+                 classes: List[str]):
+    """現在のヘッドから初期値を作成（同名のクラスの重みを引き継ぎ、新しいクラスはゼロ）"""
+    init_weight = torch.zeros(len(classes), weight.shape[1])
+    init_bias = torch.zeros(len(classes))
+    for i, name in enumerate(classes):
+        if name in current_classes:
+            j = current_classes.index(name)
+            init_weight[i] = weight[j].detach().float().cpu()
+            init_bias[i] = bias[j].detach().float().cpu()
+    return init_weight, init_bias
+
+
+def train_linear_head(features: np.ndarray, labels: np.ndarray, is_positive: np.ndarray,
+                      init_weight: torch.Tensor, init_bias: torch.Tensor,
+                      weight_decay: float = 1e-3, max_iter: int = 100) -> Dict:
+    """線形ヘッドを全バッチの L-BFGS で学習
+
+    labels は正解サンプルでは正解クラス、不正解サンプルでは誤って予測されたクラスの番号。
+    """
+    x = torch.from_numpy(np.asarray(features, dtype=np.float32))
+    y = torch.from_numpy(np.asarray(labels, dtype=np.int64))
+    positive = torch.from_numpy(np.asarray(is_positive, dtype=bool))
+    negative = ~positive
+
+    weight = init_weight.clone().requires_grad_(True)
+    bias = init_bias.clone().requires_grad_(True)
+    optimizer = torch.optim.LBFGS([weight, bias], max_iter=max_iter, line_search_fn='strong_wolfe')
+
+    def loss_fn():
+        logits = x @ weight.t() + bias
+        loss = logits.new_zeros(())
+        if positive.any():
+            loss = loss + F.cross_entropy(logits[positive], y[positive], reduction='sum')
+        if negative.any():
+            # -log(1 - p_wrong) = logsumexp(全クラス) - logsumexp(誤りクラス以外)
+            neg_logits = logits[negative]
+            wrong = F.one_hot(y[negative], logits.shape[1]).bool()
+            others = neg_logits.masked_fill(wrong, float('-inf'))
+            loss = loss + (torch.logsumexp(neg_logits, 1) - torch.logsumexp(others, 1)).sum()
+        loss = loss / max(len(x), 1)
+        return loss + weight_decay * ((weight - init_weight).pow(2).sum() + (bias - init_bias).pow(2).sum())
+
+    def closure():
+        optimizer.zero_grad()
+        loss = loss_fn()
+        loss.backward()
+        return loss
+
+    initial_loss = float(loss_fn())
+    optimizer.step(closure)
+    final_loss = float(loss_fn())
+    return {
+        'weight': weight.detach(),
+        'bias': bias.detach(),
+        'initial_loss': initial_loss,
+        'final_loss': final_loss,
+        'iterations': optimizer.state[weight].get('n_iter', 0),
+    }
+
+
+def evaluate_head(weight: torch.Tensor, bias: torch.Tensor, features: np.ndarray,
+                  labels: np.ndarray, is_positive: np.ndarray) -> Dict:
+    """正解サンプルの正解率と、不正解サンプルで同じ誤りを繰り返さない率"""
+    x = torch.from_numpy(np.asarray(features, dtype=np.float32))
+    with torch.no_grad():
+        predicted = (x @ weight.t() + bias).argmax(1).numpy()
+    labels = np.asarray(labels)
+    is_positive = np.asarray(is_positive, dtype=bool)
+    return {
+        'accuracy': float(np.mean(predicted[is_positive] == labels[is_positive])) if is_positive.any() else None,
+        'corrected': float(np.mean(predicted[~is_positive] != labels[~is_positive])) if (~is_positive).any() else None,
+    }
+
+
+def save_head_checkpoint(model, weight: torch.Tensor, bias: torch.Tensor, classes: List[str],
+                         output_path, width_mult: float = 1.0, extra_info: Optional[Dict] = None) -> Path:
+    """バックボーンの重みと学習したヘッドを load_model の形式で保存（model_info.json も出力）"""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    state = {k: v.detach().float().cpu() for k, v in model.state_dict().items()}
+    state['classifier.1.weight'] = weight.float().cpu()
+    state['classifier.1.bias'] = bias.float().cpu()
+    torch.save({
+        'model_type': 'mobilenet_v2',
+        'width_mult': width_mult,
+        'model_state_dict': state,
+    }, output_path)
+
+    model_info = dict(extra_info or {}, classes=list(classes))
+    with open(output_path.parent / 'model_info.json', 'w') as f:
+        json.dump(model_info, f, ensure_ascii=False, indent=2)
+    return output_path
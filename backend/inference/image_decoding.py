@@ -0,0 +1,296 @@
+"""
+メモリ上限付きの画像デコード
+
+アップロード画像はヘッダーだけを先に読み、バイト数・ピクセル数の上限を
+デコード前に確認する。JPEG は DCT スケーリング（draft）で縮小デコードし、
+その他の形式はデコード直後に reduce で推論サイズ付近まで縮小する。
+デコード中の一時メモリはプロセス全体の予算で管理し、同時に大きな画像が
+届いてもピークメモリが増え続けないようにする。
+
+StreamingDecodeUploadHandler（upload_handlers.py）は受信中のチャンクを IncrementalImageDecoder に
+渡し、ネットワーク転送と並行してデコードする。decode_image はその結果があれば再利用する。
+"""
+import io
+import weakref
+import logging
+import threading
+from typing import Dict, Tuple
+
+from PIL import Image, ImageFile
+from django.conf import settings
+
+from .upload_handlers import open_for_decoding
+
+logger = logging.getLogger(__name__)
+
+
+class ImageDecodeError(ValueError):
+    """画像をデコードできない（不正な画像）"""
+    status_code = 400
+
+
+class ImageTooLargeError(ImageDecodeError):
+    """画像がバイト数・ピクセル数・メモリの上限を超えている"""
+    status_code = 413
+
+
+class DecodeMemoryBudget:
+    """デコード中の一時メモリ量をプロセス全体で制限"""
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self.in_use = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, num_bytes: int, timeout: float) -> bool:
+        with self._condition:
+            acquired = self._condition.wait_for(
+                lambda: self.in_use + num_bytes <= self.limit_bytes, timeout=timeout
+            )
+            if acquired:
+                self.in_use += num_bytes
+                self.peak = max(self.peak, self.in_use)
+            return acquired
+
+    def release(self, num_bytes: int):
+        with self._condition:
+            self.in_use -= num_bytes
+            self._condition.notify_all()
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {'limit_bytes': self.limit_bytes, 'in_use_bytes': self.in_use, 'peak_bytes': self.peak}
+
+
+_memory_budget = None
+_memory_budget_lock = threading.Lock()
+
+
+def get_memory_budget() -> DecodeMemoryBudget:
+    """プロセス全体のデコードメモリ予算"""
+    global _memory_budget
+    with _memory_budget_lock:
+        if _memory_budget is None:
+            _memory_budget = DecodeMemoryBudget(_get_setting('MEMORY_BUDGET_BYTES', 512 * 1024 * 1024))
+        return _memory_budget
+
+
+def decode_image(image_file, target_size: Tuple[int, int] = None) -> Tuple[Image.Image, Dict]:
+    """上限を確認しつつ推論サイズ付近まで縮小デコード
+
+    戻り値は (RGB画像, 元画像の情報)。元画像の情報には縮小前の幅・高さ・形式を含む。
+    """
+    target_size = target_size or tuple(_get_setting('TARGET_SIZE', (224, 224)))
+
+    size = getattr(image_file, 'size', None)
+    max_bytes = _get_setting('MAX_UPLOAD_BYTES', 20 * 1024 * 1024)
+    if size is not None and size > max_bytes:
+        raise ImageTooLargeError(f'Image file is too large ({size} bytes, limit {max_bytes})')
+
+    # 受信中にデコード済み（StreamingDecodeUploadHandler）で、目標サイズが同じであれば再利用
+    streamed = getattr(image_file, 'streamed_decode', None)
+    if streamed is not None and streamed[2] == target_size:
+        image, info, _ = streamed
+        return image, dict(info)
+
+    # 一時ファイルはメモリマップして読み込み（バッファへの再コピーを避ける）
+    with open_for_decoding(image_file) as source:
+        # ヘッダーのみ読み込み（ピクセルデータはまだデコードしない）
+        try:
+            image = Image.open(source)
+        except Image.DecompressionBombError as e:
+            raise ImageTooLargeError(str(e))
+        except Exception as e:
+            raise ImageDecodeError(f'Invalid image file: {e}')
+
+        width, height = image.size
+        max_pixels = _get_setting('MAX_PIXELS', 100_000_000)
+        if width * height > max_pixels:
+            raise ImageTooLargeError(f'Image has too many pixels ({width}x{height}, limit {max_pixels})')
+
+        info = {
+            'width': width,
+            'height': height,
+            'format': image.format,
+            'mode': image.mode,
+        }
+
+        # JPEGはDCTスケーリングで目標サイズ以上の最小サイズに縮小デコード
+        if image.format == 'JPEG':
+            image.draft('RGB', target_size)
+
+        # デコード時の一時メモリを見積もって予算を確保（RGB変換分を含む）
+        decoded_width, decoded_height = image.size
+        estimated_bytes = decoded_width * decoded_height * 4 * (1 if image.mode == 'RGB' else 2)
+        if estimated_bytes > _get_setting('MAX_DECODE_BYTES', 256 * 1024 * 1024):
+            raise ImageTooLargeError(
+                f'Image requires too much memory to decode ({decoded_width}x{decoded_height} {image.mode})'
+            )
+
+        budget = get_memory_budget()
+        if not budget.acquire(estimated_bytes, timeout=_get_setting('MEMORY_WAIT_TIMEOUT', 10)):
+            raise ImageTooLargeError('Image decode memory budget exhausted, try again later')
+
+        try:
+            try:
+                image.load()
+            except Exception as e:
+                raise ImageDecodeError(f'Failed to decode image: {e}')
+            image = _reduce_to_rgb(image, target_size)
+        finally:
+            budget.release(estimated_bytes)
+
+    info['decoded_width'], info['decoded_height'] = image.size
+    return image, info
+
+
+def _reduce_to_rgb(image: Image.Image, target_size: Tuple[int, int]) -> Image.Image:
+    """デコード済み画像を目標サイズ付近まで整数倍で縮小し RGB に変換"""
+    # 目標サイズの2倍以上あれば整数倍で縮小（reduce は一部のモードのみ対応）
+    factor = min(image.width // target_size[0], image.height // target_size[1])
+    if factor >= 2:
+        if image.mode not in ('L', 'RGB', 'RGBA', 'LA', 'RGBa', 'La', 'I', 'F', 'CMYK'):
+            image = image.convert('RGB')
+        image = image.reduce(factor)
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+
+class _DraftParser(ImageFile.Parser):
+    """ヘッダーを読んだ時点で上限の確認と JPEG の DCT スケーリング（draft）を行う増分パーサー
+
+    ヘッダー以降のデコードは ImageFile.Parser のまま。on_header が False を返した場合、
+    または増分デコードできない形式（PNG 等）の場合は StreamingDecodeAborted を送出する。
+    """
+
+    def __init__(self, target_size: Tuple[int, int], on_header):
+        self.target_size = target_size
+        self.on_header = on_header
+
+    def feed(self, data: bytes):
+        if self.image is not None or self.finished:
+            return super().feed(data)
+
+        self.data = data if self.data is None else self.data + data
+        try:
+            with io.BytesIO(self.data) as fp:
+                image = Image.open(fp)
+        except Image.DecompressionBombError:
+            raise StreamingDecodeAborted('decompression bomb')
+        except OSError:
+            return   # ヘッダーが揃っていない
+
+        # JPEG の load_read は途中で切れたファイルの補完用のみのため、デコーダに直接渡せる
+        # （ImageFile.Parser は load_read があると全体を受信するまでデコードしない）
+        custom_read = hasattr(image, 'load_read') and image.format != 'JPEG'
+        if hasattr(image, 'load_seek') or custom_read or len(image.tile) != 1:
+            raise StreamingDecodeAborted(f'{image.format} cannot be decoded incrementally')
+        info = {'width': image.width, 'height': image.height, 'format': image.format, 'mode': image.mode}
+        if image.format == 'JPEG':
+            image.draft('RGB', self.target_size)
+        if not self.on_header(image, info):
+            raise StreamingDecodeAborted('limit exceeded')
+
+        # 以降は ImageFile.Parser と同じ（デコーダを作成し、ヘッダー分を読み飛ばす）
+        image.load_prepare()
+        decoder_name, extents, offset, args = image.tile[0]
+        image.tile = []
+        self.decoder = Image._getdecoder(image.mode, decoder_name, args, image.decoderconfig)
+        self.decoder.setimage(image.im, extents)
+        self.offset = offset
+        if self.offset <= len(self.data):
+            self.data = self.data[self.offset:]
+            self.offset = 0
+        self.image = image
+        self.info = info
+
+
+class StreamingDecodeAborted(Exception):
+    """受信中のデコードを中断（受信後に decode_image で通常どおりデコードする）"""
+
+
+class IncrementalImageDecoder:
+    """受信中のチャンクを順にデコードし、ネットワーク転送とデコードを重ねる
+
+    上限（ピクセル数・デコードメモリ）はヘッダーを読んだ時点で確認し、予算は待たずに
+    確保できた場合のみ使用する。増分デコードできない形式・上限超過・予算不足・不正な画像の
+    場合は中断し、エラーの判定も含めて受信後の decode_image に任せる。
+    確保した予算は close() / abort() で返却し、呼ばれないまま破棄された場合
+    （ヘッダーの受信後に multipart の解析がエラーになった場合等）も破棄時に返却する。
+    """
+
+    # ヘッダーの識別を諦めるまでのバイト数（EXIF 等が大きい JPEG を考慮）
+    MAX_HEADER_BYTES = 512 * 1024
+
+    def __init__(self, target_size: Tuple[int, int] = None):
+        self.target_size = target_size or tuple(_get_setting('TARGET_SIZE', (224, 224)))
+        self.parser = _DraftParser(self.target_size, self._on_header)
+        self.active = True
+        self.received = 0
+        self.reserved_bytes = 0
+        self._reservation = None
+
+    def _on_header(self, image: Image.Image, info: Dict) -> bool:
+        if info['width'] * info['height'] > _get_setting('MAX_PIXELS', 100_000_000):
+            return False
+        # decode_image と同じ見積もり（RGB変換分を含む）
+        width, height = image.size
+        estimated_bytes = width * height * 4 * (1 if image.mode == 'RGB' else 2)
+        if estimated_bytes > _get_setting('MAX_DECODE_BYTES', 256 * 1024 * 1024):
+            return False
+        budget = get_memory_budget()
+        if not budget.acquire(estimated_bytes, timeout=0):
+            return False
+        self.reserved_bytes = estimated_bytes
+        self._reservation = weakref.finalize(self, budget.release, estimated_bytes)
+        return True
+
+    def feed(self, chunk):
+        if not self.active:
+            return
+        self.received += len(chunk)
+        try:
+            self.parser.feed(bytes(chunk))
+        except Exception as e:
+            self.abort(e)
+            return
+        if self.parser.image is None and self.received > self.MAX_HEADER_BYTES:
+            self.abort('header not found')
+
+    def close(self):
+        """デコード結果 (RGB画像, 元画像の情報, 目標サイズ)（中断した場合は None）"""
+        if not self.active:
+            return None
+        try:
+            image = _reduce_to_rgb(self.parser.close(), self.target_size)
+        except Exception as e:
+            self.abort(e)
+            return None
+        finally:
+            self._release()
+        self.active = False
+        info = dict(self.parser.info)
+        info['decoded_width'], info['decoded_height'] = image.size
+        return image, info, self.target_size
+
+    def abort(self, reason=None):
+        if self.active:
+            logger.debug(f"Streaming decode aborted: {reason}")
+        self.active = False
+        self.parser = None
+        self._release()
+
+    def _release(self):
+        if self._reservation is not None:
+            # 返却は1回のみ（破棄時の返却も取り消される）
+            self._reservation()
+            self._reservation = None
+            self.reserved_bytes = 0
+
+
+def _get_setting(name: str, default=None):
+    """settings.INFERENCE_IMAGE_DECODE から設定値を取得"""
+    return getattr(settings, 'INFERENCE_IMAGE_DECODE', {}).get(name, default)
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inference.models import MLApp
+
+
+class Command(BaseCommand):
+    help = 'p99レイテンシ目標を満たす最大のバッチサイズをアプリ・デバイスごとに計測して保存します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', type=int, nargs='+', dest='app_ids',
+                            help='対象のMLアプリID（省略時は有効な画像分類アプリすべて）')
+        parser.add_argument('--target', type=float, help='p99レイテンシ目標（秒）')
+        parser.add_argument('--candidates', type=int, nargs='+', help='候補バッチサイズ')
+        parser.add_argument('--iterations', type=int, help='候補ごとの計測回数')
+        parser.add_argument('--dry-run', action='store_true', help='結果を保存しない')
+
+    def handle(self, *args, **options):
+        from inference.autotune import tune_batch_size
+
+        apps = MLApp.objects.filter(is_active=True, app_type='image_classification')
+        if options['app_ids']:
+            apps = apps.filter(id__in=options['app_ids'])
+        if not apps.exists():
+            raise CommandError('対象のMLアプリが見つかりません')
+
+        for ml_app in apps:
+            self.stdout.write(f"⚙️ {ml_app.name} (ID: {ml_app.id}) のバッチサイズを調整中...")
+            result = tune_batch_size(
+                ml_app,
+                latency_target=options['target'],
+                candidates=options['candidates'],
+                iterations=options['iterations'],
+                save=not options['dry_run']
+            )
+            for m in result['measurements']:
+                self.stdout.write(
+                    f"  batch={m['batch_size']:<4} p50={m['p50_latency']:.4f}s "
+                    f"p99={m['p99_latency']:.4f}s throughput={m['throughput_fps']:.1f} FPS"
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f"  ✅ 最適バッチサイズ: {result['batch_size']} "
+                f"(p99目標 {result['p99_latency_target']}s, device {result['device_fingerprint']})"
+            ))
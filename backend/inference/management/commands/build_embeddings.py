@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inference.models import MLApp, ImageUpload
+
+
+class Command(BaseCommand):
+    help = '保存済みアップロード画像の埋め込み（分類層直前の特徴量）を埋め込みストアに保存します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', type=int, dest='app_id', required=True, help='対象のMLアプリID')
+        parser.add_argument('--limit', type=int, help='処理する最大件数')
+        parser.add_argument('--batch-size', type=int, default=64, help='埋め込み計算のバッチサイズ')
+
+    def handle(self, *args, **options):
+        from inference.embedding_store import embed_uploads, get_embedding_store
+        from inference.model_registry import get_model_registry
+
+        try:
+            ml_app = MLApp.objects.get(id=options['app_id'])
+        except MLApp.DoesNotExist:
+            raise CommandError(f"MLアプリが見つかりません: {options['app_id']}")
+        if ml_app.app_type != 'image_classification':
+            raise CommandError(f"埋め込みは画像分類のアプリのみ対応しています: {ml_app.app_type}")
+
+        classifier = get_model_registry().get_classifier(ml_app)
+        # retrain_head と同様に設定に関わらずストアに保存
+        store = get_embedding_store(classifier, enabled=True)
+
+        uploads = ImageUpload.objects.filter(prediction_log__ml_app=ml_app).order_by('id')
+        if options['limit']:
+            uploads = uploads[:options['limit']]
+
+        start_time = time.time()
+        processed = failed = 0
+        chunk = []
+
+        def flush():
+            nonlocal processed, failed
+            _, found = embed_uploads(classifier, chunk, store, batch_size=options['batch_size'])
+            processed += sum(found)
+            for upload, ok in zip(chunk, found):
+                if not ok:
+                    failed += 1
+                    self.stderr.write(f"  ⚠️ {upload.image.name}: 読み込みに失敗しました")
+            chunk.clear()
+
+        for upload in uploads.iterator(chunk_size=500):
+            chunk.append(upload)
+            if len(chunk) >= 500:
+                flush()
+        if chunk:
+            flush()
+
+        elapsed = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {processed}件の埋め込みを保存しました（失敗 {failed}件, {processed / elapsed if elapsed else 0:.1f} images/s）"
+        ))
+        self.stdout.write(f"  {store.stats()}")
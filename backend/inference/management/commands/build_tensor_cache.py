@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inference.models import MLApp, ImageUpload
+
+
+class Command(BaseCommand):
+    help = '保存済みアップロード画像の前処理済みテンソルキャッシュを作成します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', type=int, dest='app_id', help='対象のMLアプリID（省略時は全アップロード）')
+        parser.add_argument('--limit', type=int, help='処理する最大件数')
+
+    def handle(self, *args, **options):
+        from inference.cuda_inference import get_classifier
+        from inference.image_decoding import ImageDecodeError
+        from inference.tensor_cache import get_tensor_cache, get_upload_array
+
+        uploads = ImageUpload.objects.order_by('id')
+        inference_options = {}
+        if options['app_id']:
+            try:
+                ml_app = MLApp.objects.get(id=options['app_id'])
+            except MLApp.DoesNotExist:
+                raise CommandError(f"MLアプリが見つかりません: {options['app_id']}")
+            uploads = uploads.filter(prediction_log__ml_app=ml_app)
+            inference_options = ml_app.get_inference_options()
+        if options['limit']:
+            uploads = uploads[:options['limit']]
+
+        classifier = get_classifier(**inference_options)
+        cache = get_tensor_cache(classifier.preprocess_config())
+        if cache is None:
+            raise CommandError('INFERENCE_TENSOR_CACHE が無効です')
+
+        start_time = time.time()
+        processed = failed = 0
+        for upload in uploads.iterator(chunk_size=500):
+            try:
+                get_upload_array(classifier, upload, cache)
+                processed += 1
+            except (OSError, ImageDecodeError) as e:
+                failed += 1
+                self.stderr.write(f"  ⚠️ {upload.image.name}: {e}")
+
+        elapsed = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {processed}件をキャッシュしました（失敗 {failed}件, {processed / elapsed if elapsed else 0:.1f} images/s）"
+        ))
+        self.stdout.write(f"  {cache.stats()}")
@@ -0,0 +1,57 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inference.models import MLApp
+
+
+class Command(BaseCommand):
+    help = 'MLアプリのモデルを更新します（稼働中のサーバーは次のリクエストでバックグラウンドに切り替え）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', type=int, dest='app_id', required=True, help='対象のMLアプリID')
+        parser.add_argument('--model-path', help='新しいモデルファイルパス')
+        parser.add_argument('--model-version', help='新しいモデルバージョン（同じファイルを再読み込みさせる場合に指定）')
+        parser.add_argument('--skip-check', action='store_true', help='切り替え前の読み込み確認を省略する')
+
+    def handle(self, *args, **options):
+        from inference.model_registry import get_model_key, get_model_registry
+
+        try:
+            ml_app = MLApp.objects.get(id=options['app_id'])
+        except MLApp.DoesNotExist:
+            raise CommandError(f"MLアプリが見つかりません: {options['app_id']}")
+
+        previous_version = ml_app.get_model_version()
+        if options['model_path']:
+            if not os.path.exists(options['model_path']):
+                raise CommandError(f"モデルファイルが見つかりません: {options['model_path']}")
+            ml_app.model_file_path = options['model_path']
+        if options['model_version']:
+            model_optimization = ml_app.get_optimization_settings()
+            model_optimization['model_version'] = options['model_version']
+            ml_app.model_optimization = model_optimization
+
+        if not options['skip_check']:
+            # 稼働中のサーバーに切り替えさせる前に、このプロセスで読み込めることを確認
+            # （アプリタイプ・最適化設定に応じたエンジンで読み込む）
+            start_time = time.time()
+            try:
+                classifier = get_model_registry()._load(get_model_key(ml_app))
+                classifier.warmup()
+            except Exception as e:
+                raise CommandError(f"モデルを読み込めません: {e}")
+            self.stdout.write(f"  読み込み確認: {time.time() - start_time:.2f}秒 ({classifier.device}, {len(classifier.classes)}クラス)")
+            del classifier
+
+        ml_app.save()
+        new_version = ml_app.get_model_version()
+        if new_version == previous_version:
+            self.stdout.write(self.style.WARNING(
+                f"⚠️ モデルバージョンが変わっていません ({new_version})。再読み込みさせる場合は --model-version を指定してください"
+            ))
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {ml_app.name}: {previous_version} → {new_version}（各サーバーは次のリクエストで切り替えます）"
+        ))
@@ -0,0 +1,122 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+
+from inference.models import MLApp, ImageUpload, VersionedPrediction
+
+
+class Command(BaseCommand):
+    help = '保存済みアップロード画像をモデルで一括再推論し、バージョン別推論結果に保存します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', type=int, dest='app_id', required=True, help='推論に使用するMLアプリID')
+        parser.add_argument('--model-version', help='結果に記録するモデルバージョン（省略時はアプリから算出）')
+        parser.add_argument('--all-uploads', action='store_true',
+                            help='他のアプリで推論された画像も含めて再推論する')
+        parser.add_argument('--chunk-size', type=int, default=500, help='DBから一度に読み込む件数')
+        parser.add_argument('--batch-size', type=int, default=64, help='推論のバッチサイズ')
+        parser.add_argument('--workers', type=int, default=4, help='デコードのワーカー数')
+        parser.add_argument('--limit', type=int, help='処理する最大件数')
+        parser.add_argument('--restart', action='store_true',
+                            help='チェックポイントを無視して最初から処理する（失敗分も再処理）')
+
+    def handle(self, *args, **options):
+        from inference.model_registry import get_model_registry
+        from inference.tensor_cache import get_tensor_cache, get_upload_array
+
+        try:
+            ml_app = MLApp.objects.get(id=options['app_id'])
+        except MLApp.DoesNotExist:
+            raise CommandError(f"MLアプリが見つかりません: {options['app_id']}")
+        if ml_app.app_type != 'image_classification':
+            # 保存済み画像を分類器の前処理で再推論するため、他のアプリタイプでは結果が無意味になる
+            raise CommandError(f"再推論は画像分類のアプリのみ対応しています: {ml_app.app_type}")
+
+        model_version = options['model_version'] or ml_app.get_model_version()
+        classifier = get_model_registry().get_classifier(ml_app)
+        cache = get_tensor_cache(classifier.preprocess_config())
+
+        uploads = ImageUpload.objects.order_by('id').only('id', 'image')
+        if not options['all_uploads']:
+            uploads = uploads.filter(prediction_log__ml_app=ml_app)
+
+        # チェックポイント: チャンク単位で保存済みの最大ID（チャンクは全件まとめてコミット）
+        last_id = 0
+        if options['restart']:
+            # 失敗した画像は再処理の対象にする
+            VersionedPrediction.objects.filter(
+                ml_app=ml_app, model_version=model_version, predicted_class='error'
+            ).delete()
+        else:
+            last_id = VersionedPrediction.objects.filter(
+                ml_app=ml_app, model_version=model_version
+            ).aggregate(last_id=Max('image_upload_id'))['last_id'] or 0
+
+        self.stdout.write(
+            f"🔁 {ml_app.name} [{model_version}] を再推論します"
+            f"（ID {last_id} 以降, device {classifier.device}, cache {'on' if cache else 'off'}）"
+        )
+
+        def load(upload):
+            try:
+                return upload, get_upload_array(classifier, upload, cache), None
+            except Exception as e:
+                return upload, None, e
+
+        start_time = time.time()
+        processed = failed = 0
+        limit = options['limit']
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            while limit is None or processed + failed < limit:
+                chunk_size = options['chunk_size']
+                if limit is not None:
+                    chunk_size = min(chunk_size, limit - processed - failed)
+                # キーセットページネーション
+                chunk = list(uploads.filter(id__gt=last_id)[:chunk_size])
+                if not chunk:
+                    break
+
+                rows = []
+                loaded = []
+                for upload, array, error in pool.map(load, chunk):
+                    if error is not None:
+                        failed += 1
+                        self.stderr.write(f"  ⚠️ {upload.image.name}: {error}")
+                        rows.append(VersionedPrediction(
+                            ml_app=ml_app, image_upload=upload, model_version=model_version,
+                            predicted_class='error', output_data={'error': str(error)}
+                        ))
+                    else:
+                        loaded.append((upload, array))
+
+                for i in range(0, len(loaded), options['batch_size']):
+                    batch = loaded[i:i + options['batch_size']]
+                    results = classifier.predict_arrays(np.stack([array for _, array in batch]))
+                    for (upload, _), result in zip(batch, results):
+                        rows.append(VersionedPrediction(
+                            ml_app=ml_app, image_upload=upload, model_version=model_version,
+                            predicted_class=result['predicted_class'],
+                            confidence_score=result['confidence'],
+                            output_data=result
+                        ))
+                    processed += len(batch)
+
+                with transaction.atomic():
+                    VersionedPrediction.objects.bulk_create(rows, batch_size=500, ignore_conflicts=True)
+                last_id = chunk[-1].id
+
+                elapsed = time.time() - start_time
+                self.stdout.write(
+                    f"  {processed + failed}件処理（ID {last_id} まで）: "
+                    f"{processed / elapsed if elapsed else 0:.1f} images/s"
+                )
+
+        elapsed = time.time() - start_time
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ 再推論完了: {processed}件成功, {failed}件失敗, {elapsed:.1f}秒 "
+            f"({processed / elapsed if elapsed else 0:.1f} images/s)"
+        ))
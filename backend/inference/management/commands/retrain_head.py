@@ -0,0 +1,130 @@
+import time
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from inference.models import MLApp, ImageUpload
+
+
+class Command(BaseCommand):
+    help = 'ユーザーフィードバックと保存済み画像の埋め込みから分類層（線形ヘッド）のみを再学習します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', type=int, dest='app_id', required=True, help='対象のMLアプリID')
+        parser.add_argument('--output', help='出力するチェックポイントのパス（省略時は models/app_<ID>/head-<日時>/model.pth）')
+        parser.add_argument('--limit', type=int, default=50000, help='使用するフィードバックの最大件数（新しい順）')
+        parser.add_argument('--weight-decay', type=float, default=1e-3, help='現在のヘッドの重みからの L2 正則化の強さ')
+        parser.add_argument('--max-iter', type=int, default=100, help='L-BFGS の最大反復回数')
+        parser.add_argument('--val-fraction', type=float, default=0.2, help='検証に使う割合')
+        parser.add_argument('--min-samples', type=int, default=20, help='学習に必要な最小件数')
+        parser.add_argument('--seed', type=int, default=0, help='学習・検証の分割の乱数シード')
+        parser.add_argument('--activate', action='store_true', help='学習したモデルをアプリに設定する（稼働中のサーバーはバックグラウンドで切り替え）')
+        parser.add_argument('--force', action='store_true', help='検証精度が下がった場合も保存する')
+
+    def handle(self, *args, **options):
+        from inference.embedding_store import embed_uploads, get_embedding_store
+        from inference.head_training import evaluate_head, initial_head, save_head_checkpoint, train_linear_head
+        from inference.model_registry import get_model_registry
+
+        try:
+            ml_app = MLApp.objects.get(id=options['app_id'])
+        except MLApp.DoesNotExist:
+            raise CommandError(f"MLアプリが見つかりません: {options['app_id']}")
+        if ml_app.app_type != 'image_classification':
+            raise CommandError(f"埋め込みは画像分類のアプリのみ対応しています: {ml_app.app_type}")
+
+        classifier = get_model_registry().get_classifier(ml_app)
+        classes = list(ml_app.classes or classifier.classes)
+
+        uploads, labels, is_positive = [], [], []
+        queryset = ImageUpload.objects.filter(
+            prediction_log__ml_app=ml_app,
+            prediction_log__user_feedback__in=['correct', 'incorrect'],
+        ).select_related('prediction_log').order_by('-id')[:options['limit']]
+        for upload in queryset:
+            log = upload.prediction_log
+            if log.predicted_class not in classes:
+                continue
+            uploads.append(upload)
+            labels.append(classes.index(log.predicted_class))
+            is_positive.append(log.user_feedback == 'correct')
+
+        if len(uploads) < options['min_samples']:
+            raise CommandError(f"フィードバック付きの画像が不足しています（{len(uploads)}件 < {options['min_samples']}件）")
+
+        start_time = time.time()
+        embeddings, found = embed_uploads(
+            classifier, uploads, store=get_embedding_store(classifier, enabled=True),
+            batch_size=ml_app.get_optimal_batch_size()
+        )
+        found = np.array(found)
+        if not found.all():
+            self.stderr.write(f"  ⚠️ 読み込めなかった画像 {int((~found).sum())}件を除外しました")
+        features = embeddings[found].astype(np.float32)
+        labels = np.array(labels)[found]
+        is_positive = np.array(is_positive)[found]
+        self.stdout.write(
+            f"📊 {ml_app.name}: 正解 {int(is_positive.sum())}件 / 不正解 {int((~is_positive).sum())}件 "
+            f"（埋め込み {time.time() - start_time:.2f}秒）"
+        )
+
+        # 学習・検証に分割
+        rng = np.random.default_rng(options['seed'])
+        order = rng.permutation(len(features))
+        val_count = int(len(features) * options['val_fraction'])
+        val, train = order[:val_count], order[val_count:]
+
+        # 現在のヘッド（共有バックボーンのアプリはアプリのヘッド）から学習を開始
+        head = getattr(classifier, 'head', None)
+        linear = head.linear if head is not None else classifier.model.classifier[1]
+        init_weight, init_bias = initial_head(linear.weight, linear.bias, list(classifier.classes), classes)
+
+        start_time = time.time()
+        result = train_linear_head(
+            features[train], labels[train], is_positive[train], init_weight, init_bias,
+            weight_decay=options['weight_decay'], max_iter=options['max_iter'],
+        )
+        self.stdout.write(
+            f"  学習: {len(train)}件, loss {result['initial_loss']:.4f} → {result['final_loss']:.4f} "
+            f"({result['iterations']}回, {time.time() - start_time:.2f}秒)"
+        )
+
+        before = after = None
+        if val_count:
+            before = evaluate_head(init_weight, init_bias, features[val], labels[val], is_positive[val])
+            after = evaluate_head(result['weight'], result['bias'], features[val], labels[val], is_positive[val])
+            self.stdout.write(
+                f"  検証: {val_count}件, 正解率 {_format_rate(before['accuracy'])} → {_format_rate(after['accuracy'])}, "
+                f"誤りの修正率 {_format_rate(before['corrected'])} → {_format_rate(after['corrected'])}"
+            )
+            if (before['accuracy'] is not None and after['accuracy'] < before['accuracy']
+                    and not options['force']):
+                raise CommandError('検証の正解率が下がったため保存しません（保存する場合は --force）')
+
+        output = options['output'] or (
+            settings.BASE_DIR / 'models' / f'app_{ml_app.id}' / f"head-{time.strftime('%Y%m%d-%H%M%S')}" / 'model.pth'
+        )
+        path = save_head_checkpoint(
+            classifier.model, result['weight'], result['bias'], classes, output,
+            width_mult=classifier.width_mult,
+            extra_info={
+                'base_model_version': ml_app.get_model_version(),
+                'trained_samples': len(train),
+                'validation': after,
+            },
+        )
+        self.stdout.write(self.style.SUCCESS(f"✅ チェックポイントを保存しました: {path}"))
+
+        if options['activate']:
+            ml_app.model_file_path = str(path)
+            model_optimization = ml_app.get_optimization_settings()
+            if model_optimization.pop('model_version', None):
+                # 固定のバージョン指定があるとモデルファイルの更新で切り替わらないため外す
+                ml_app.model_optimization = model_optimization
+            ml_app.save()
+            self.stdout.write(f"  {ml_app.name} のモデルを {ml_app.get_model_version()} に切り替えます")
+
+
+def _format_rate(value):
+    return '-' if value is None else f'{value:.3f}'
@@ -0,0 +1,103 @@
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from inference.models import MLApp, ImageUpload
+
+
+class Command(BaseCommand):
+    help = '推論ログの画像でカスケードの閾値ごとの精度・平均レイテンシを計測し、閾値を選択します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', type=int, dest='app_id', required=True, help='対象のMLアプリID')
+        parser.add_argument('--max-accuracy-drop', type=float, default=0.01,
+                            help='通常モデルのみの場合からの精度低下の許容値')
+        parser.add_argument('--limit', type=int, default=2000, help='評価に使う推論ログの最大件数（新しい順）')
+        parser.add_argument('--batch-size', type=int, default=64, help='推論のバッチサイズ')
+        parser.add_argument('--save', action='store_true', help='選択した閾値をアプリに保存する')
+
+    def handle(self, *args, **options):
+        from inference.cascade import CascadeClassifier, choose_threshold
+        from inference.model_registry import get_model_registry
+        from inference.tensor_cache import get_tensor_cache, get_upload_array
+
+        try:
+            ml_app = MLApp.objects.get(id=options['app_id'])
+        except MLApp.DoesNotExist:
+            raise CommandError(f"MLアプリが見つかりません: {options['app_id']}")
+
+        classifier = get_model_registry().get_classifier(ml_app)
+        if not isinstance(classifier, CascadeClassifier):
+            raise CommandError("model_optimization['cascade'] が設定されていません")
+        cache = get_tensor_cache(classifier.preprocess_config())
+        classes = list(classifier.classes)
+
+        # 不正解とフィードバックされた推論は正解ラベルが不明のため除外
+        uploads = ImageUpload.objects.filter(prediction_log__ml_app=ml_app).exclude(
+            prediction_log__user_feedback='incorrect'
+        ).select_related('prediction_log').order_by('-id')[:options['limit']]
+
+        records = {'fast_confidence': [], 'fast_predicted': [], 'full_predicted': [], 'reference': []}
+        fast_time = full_time = 0.0
+        batch, feedback = [], []
+
+        def evaluate():
+            nonlocal fast_time, full_time
+            result = classifier.evaluate_arrays(np.stack(batch))
+            fast_time += result['fast_time']
+            full_time += result['full_time']
+            for key in ('fast_confidence', 'fast_predicted', 'full_predicted'):
+                records[key].extend(result[key].tolist())
+            # ユーザーが正解とした予測は正解ラベル、それ以外は通常モデルの予測を基準にする
+            for label, full_predicted in zip(feedback, result['full_predicted'].tolist()):
+                records['reference'].append(classes.index(label) if label in classes else full_predicted)
+            batch.clear()
+            feedback.clear()
+
+        for upload in uploads:
+            try:
+                batch.append(get_upload_array(classifier, upload, cache))
+            except Exception as e:
+                self.stderr.write(f"  ⚠️ {upload.image.name}: {e}")
+                continue
+            log = upload.prediction_log
+            feedback.append(log.predicted_class if log.user_feedback == 'correct' else None)
+            if len(batch) >= options['batch_size']:
+                evaluate()
+        if batch:
+            evaluate()
+
+        count = len(records['reference'])
+        if not count:
+            raise CommandError('評価に使える推論ログがありません')
+
+        result = choose_threshold(
+            np.array(records['fast_confidence']), np.array(records['fast_predicted']),
+            np.array(records['full_predicted']), np.array(records['reference']),
+            fast_time=fast_time / count, full_time=full_time / count,
+            max_accuracy_drop=options['max_accuracy_drop'],
+        )
+
+        self.stdout.write(
+            f"📊 {ml_app.name}: {count}件で評価（通常モデルのみ: 精度 {result['full_accuracy']:.3f}, "
+            f"{result['full_latency'] * 1000:.2f}ms/枚）"
+        )
+        for candidate in result['candidates'][::5]:
+            self.stdout.write(
+                f"  threshold={candidate['threshold']:.2f} accuracy={candidate['accuracy']:.3f} "
+                f"escalation={candidate['escalation_rate']:.1%} latency={candidate['average_latency'] * 1000:.2f}ms"
+            )
+
+        best = result['best']
+        if best is None:
+            raise CommandError('精度低下の許容範囲を満たす閾値がありません')
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ 推奨閾値 {best['threshold']:.2f}: 精度 {best['accuracy']:.3f}, "
+            f"通常モデルへの送出 {best['escalation_rate']:.1%}, 平均 {best['average_latency'] * 1000:.2f}ms/枚"
+        ))
+
+        if options['save']:
+            model_optimization = ml_app.get_optimization_settings()
+            model_optimization['cascade']['threshold'] = best['threshold']
+            ml_app.model_optimization = model_optimization
+            ml_app.save()
+            self.stdout.write("  閾値を保存しました（稼働中のサーバーは次のリクエストで切り替えます）")
@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-19 07:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inference', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BatchSizeProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_fingerprint', models.CharField(max_length=64, verbose_name='デバイス識別子')),
+                ('device_description', models.JSONField(default=dict, verbose_name='デバイス情報')),
+                ('batch_size', models.PositiveIntegerField(verbose_name='最適バッチサイズ')),
+                ('p99_latency_target', models.FloatField(verbose_name='p99レイテンシ目標（秒）')),
+                ('measurements', models.JSONField(default=list, verbose_name='計測結果')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('ml_app', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inference.mlapp', verbose_name='MLアプリ')),
+            ],
+            options={
+                'verbose_name': 'バッチサイズプロファイル',
+                'verbose_name_plural': 'バッチサイズプロファイル',
+                'unique_together': {('ml_app', 'device_fingerprint')},
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2 on 2026-10-19 07:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inference', '0002_batchsizeprofile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionedPrediction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_version', models.CharField(max_length=200, verbose_name='モデルバージョン')),
+                ('predicted_class', models.CharField(blank=True, max_length=100, null=True, verbose_name='予測クラス')),
+                ('confidence_score', models.FloatField(blank=True, null=True, verbose_name='信頼度')),
+                ('output_data', models.JSONField(verbose_name='出力データ')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('image_upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inference.imageupload', verbose_name='アップロード画像')),
+                ('ml_app', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inference.mlapp', verbose_name='MLアプリ')),
+            ],
+            options={
+                'verbose_name': 'バージョン別推論結果',
+                'verbose_name_plural': 'バージョン別推論結果',
+                'unique_together': {('ml_app', 'model_version', 'image_upload')},
+            },
+        ),
+    ]
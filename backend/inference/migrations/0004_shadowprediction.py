@@ -0,0 +1,36 @@
+# Generated by Django 5.2 on 2026-10-19 07:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inference', '0003_versionedprediction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShadowPrediction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('candidate_version', models.CharField(max_length=300, verbose_name='候補モデルバージョン')),
+                ('primary_class', models.CharField(max_length=100, verbose_name='本番モデル予測クラス')),
+                ('primary_confidence', models.FloatField(verbose_name='本番モデル信頼度')),
+                ('shadow_class', models.CharField(max_length=100, verbose_name='候補モデル予測クラス')),
+                ('shadow_confidence', models.FloatField(verbose_name='候補モデル信頼度')),
+                ('agreed', models.BooleanField(verbose_name='予測一致')),
+                ('primary_latency', models.FloatField(verbose_name='本番モデル推論時間（秒）')),
+                ('shadow_latency', models.FloatField(verbose_name='候補モデル推論時間（秒）')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('ml_app', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='inference.mlapp', verbose_name='MLアプリ')),
+                ('prediction_log', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='inference.predictionlog', verbose_name='推論ログ')),
+            ],
+            options={
+                'verbose_name': 'シャドー推論結果',
+                'verbose_name_plural': 'シャドー推論結果',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-19 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inference', '0004_shadowprediction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='predictionlog',
+            name='perceptual_hash',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='知覚ハッシュ（dHash）'),
+        ),
+    ]
@@ -0,0 +1,291 @@
+"""
+アプリごとの使用中モデルの管理とホットリロード
+
+リクエストはアプリの使用中モデル（推論設定とモデルバージョンの組）の分類器を
+参照する。MLApp の保存やモデルファイルの更新で期待するモデルが変わると、
+新しいモデルをバックグラウンドで読み込み・ウォームアップし、完了した時点で
+参照を切り替える。切り替えまでは旧モデルで応答を続けるため、リロードによる
+レイテンシの悪化はない。旧モデルは処理中のリクエストが参照を手放した時点で
+解放される（CUDA ではキャッシュ済みメモリも返却する）。
+"""
+import json
+import time
+import weakref
+import logging
+import threading
+from collections import deque
+from typing import Dict, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# text_inference.py で推論するアプリタイプ
+TEXT_APP_TYPES = ('text_classification', 'sentiment_analysis')
+
+
+def get_model_key(ml_app):
+    """アプリの期待するモデルを識別するキー（推論設定, モデルバージョン）"""
+    options = ml_app.get_inference_options()
+    optimization = ml_app.get_optimization_settings()
+    if ml_app.app_type != 'image_classification':
+        # 画像分類以外は対応するエンジンで読み込む（detection.py 等）
+        options['app_type'] = ml_app.app_type
+    if optimization.get('shared_backbone'):
+        # 共有バックボーンにヘッドのみを追加（multihead.py）
+        options['shared_backbone'] = True
+    if isinstance(optimization.get('cascade'), dict):
+        # 高速モデルを前段に置くカスケード（cascade.py）
+        options['cascade'] = json.dumps(optimization['cascade'], sort_keys=True)
+    return tuple(sorted(options.items())), ml_app.get_model_version()
+
+
+class ModelRegistry:
+    """アプリごとの使用中モデルを管理し、更新時はバックグラウンドで切り替え"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = {}      # アプリID -> 使用中モデル
+        self._loading = {}     # アプリID -> 読み込み中のキー
+        self._failed = {}      # アプリID -> 読み込みに失敗したキー（再試行しない）
+        self._retired = []     # 切り替え済みモデルの弱参照（解放待ち）
+        self._events = deque(maxlen=50)
+
+    def get_classifier(self, ml_app):
+        """アプリの使用中モデルの分類器を取得
+
+        期待するモデルと異なる場合はバックグラウンドで読み込みを開始し、
+        切り替えが完了するまで現在のモデルを返す。
+        """
+        key = get_model_key(ml_app)
+        entry = self._active.get(ml_app.pk)
+        if entry is None:
+            # このプロセスで初めて使用するアプリは同期的に読み込む
+            classifier = self._load(key)
+            with self._lock:
+                entry = self._active.setdefault(ml_app.pk, self._make_entry(key, classifier))
+        elif entry['key'] != key:
+            self.schedule_reload(ml_app)
+        return entry['classifier']
+
+    def schedule_reload(self, ml_app, force: bool = False) -> Optional[threading.Thread]:
+        """期待するモデルをバックグラウンドで読み込んで切り替え"""
+        key = get_model_key(ml_app)
+        with self._lock:
+            entry = self._active.get(ml_app.pk)
+            if entry is not None and entry['key'] == key:
+                return None
+            if self._loading.get(ml_app.pk) == key:
+                return None
+            if self._failed.get(ml_app.pk) == key and not force:
+                return None
+            self._loading[ml_app.pk] = key
+            self._failed.pop(ml_app.pk, None)
+
+        thread = threading.Thread(
+            target=self._reload, args=(ml_app, key),
+            name=f'inference-reload-{ml_app.pk}', daemon=True
+        )
+        thread.start()
+        return thread
+
+    def is_active(self, ml_app) -> bool:
+        """このプロセスでアプリのモデルを使用中か"""
+        return ml_app.pk in self._active
+
+    def status(self, ml_app=None) -> Dict:
+        """使用中・読み込み中・解放待ちのモデル"""
+        with self._lock:
+            active = {
+                app_id: {'model_version': entry['key'][1], 'activated_at': entry['activated_at']}
+                for app_id, entry in self._active.items()
+                if ml_app is None or app_id == ml_app.pk
+            }
+            loading = {
+                app_id: key[1] for app_id, key in self._loading.items()
+                if ml_app is None or app_id == ml_app.pk
+            }
+            self._retired = [ref for ref in self._retired if ref() is not None]
+            draining = len(self._retired)
+            events = [e for e in self._events if ml_app is None or e['app_id'] == ml_app.pk]
+        return {'active': active, 'loading': loading, 'draining': draining, 'events': events}
+
+    def reset(self):
+        """管理中のモデルをすべて破棄"""
+        from .cuda_inference import reset_classifier
+        from .detection import reset_detector
+        from .text_inference import reset_text_classifier
+        with self._lock:
+            self._active.clear()
+            self._loading.clear()
+            self._failed.clear()
+        reset_classifier()
+        reset_detector()
+        reset_text_classifier()
+
+    def _reload(self, ml_app, key):
+        """新しいモデルの読み込み・ウォームアップ後に参照を切り替え"""
+        from django.db import close_old_connections
+
+        start_time = time.time()
+        try:
+            classifier = self._load(key)
+            batch_sizes = sorted(set(_get_setting('WARMUP_BATCH_SIZES', [1])) | {ml_app.get_optimal_batch_size()})
+            classifier.warmup(batch_sizes=batch_sizes, iterations=_get_setting('WARMUP_ITERATIONS', 2))
+
+            with self._lock:
+                if self._loading.get(ml_app.pk) != key:
+                    # より新しいリロードに置き換えられた
+                    return
+                old = self._active.get(ml_app.pk)
+                self._active[ml_app.pk] = self._make_entry(key, classifier)
+                del self._loading[ml_app.pk]
+                self._record_event(ml_app.pk, 'swapped', key, time.time() - start_time,
+                                   previous=old['key'][1] if old else None)
+            logger.info(f"Swapped model for {ml_app.name} to {key[1]} in {time.time() - start_time:.2f}s")
+
+            if old is not None and old['key'] != key:
+                self._retire(old)
+        except Exception as e:
+            logger.error(f"Model reload failed for {ml_app.name}: {e}")
+            with self._lock:
+                if self._loading.get(ml_app.pk) == key:
+                    del self._loading[ml_app.pk]
+                self._failed[ml_app.pk] = key
+                self._record_event(ml_app.pk, 'failed', key, time.time() - start_time, error=str(e))
+        finally:
+            close_old_connections()
+
+    def _load(self, key):
+        from .cuda_inference import get_classifier
+        options, model_version = key
+        options = dict(options)
+        app_type = options.pop('app_type', 'image_classification')
+        if app_type == 'object_detection':
+            from .detection import get_detector
+            return get_detector(model_version=model_version, **options)
+        if app_type in TEXT_APP_TYPES:
+            from .text_inference import get_text_classifier
+            return get_text_classifier(model_version=model_version, **options)
+        cascade = options.pop('cascade', None)
+        if cascade:
+            full = self._load((tuple(sorted(options.items())), model_version))
+            return self._load_cascade(json.loads(cascade), options, full)
+        if options.pop('shared_backbone', False):
+            from .multihead import get_multihead_engine
+            model_path = options.pop('model_path')
+            return get_multihead_engine(**options).get_head_classifier(model_path, model_version)
+        return get_classifier(model_version=model_version, **options)
+
+    def _load_cascade(self, config, options, full):
+        from .cascade import CascadeClassifier
+        from .cuda_inference import get_classifier
+        fast = get_classifier(
+            device_type=options['device_type'],
+            precision=options['precision'],
+            channels_last=options['channels_last'],
+            model_path=config['model_file_path'],
+        )
+        return CascadeClassifier(
+            fast, full,
+            threshold=float(config.get('threshold', 0.8)),
+            fast_input_size=config.get('input_size'),
+        )
+
+    def _retire(self, entry):
+        """旧モデルをキャッシュから外し、参照がなくなった時点で解放
+
+        カスケードは高速モデル・通常モデルを個別に扱い、使用中の他のモデル（閾値のみ変更した
+        カスケード、カスケードの有無のみ異なるモデル等）が共有している分類器は残す。
+        """
+        with self._lock:
+            in_use = {key for other in self._active.values() for key in _component_keys(other['key'])}
+        for key in _component_keys(entry['key']):
+            if key not in in_use:
+                self._release_component(key)
+
+    def _release_component(self, key):
+        """キャッシュ済みの分類器を1つ外し、参照がなくなった時点でデバイスメモリを返却"""
+        from .cuda_inference import release_classifier
+
+        options, model_version = key
+        options = dict(options)
+        app_type = options.pop('app_type', 'image_classification')
+        if options.pop('shared_backbone', False):
+            # ヘッドのみを外す（処理中のリクエストは参照中のヘッドで完了する）
+            from .multihead import get_multihead_engine
+            model_path = options.pop('model_path')
+            get_multihead_engine(**options).release_head(model_path, model_version)
+            return
+        if app_type == 'object_detection':
+            from .detection import release_detector
+            classifier = release_detector(model_version=model_version, **options)
+        elif app_type in TEXT_APP_TYPES:
+            from .text_inference import release_text_classifier
+            classifier = release_text_classifier(model_version=model_version, **options)
+        else:
+            classifier = release_classifier(model_version=model_version, **options)
+        if classifier is None:
+            return
+        device_type = classifier.device.type
+        weakref.finalize(classifier, _release_device_memory, device_type, model_version or options.get('model_path'))
+        with self._lock:
+            self._retired.append(weakref.ref(classifier))
+
+    def _make_entry(self, key, classifier) -> Dict:
+        return {'key': key, 'classifier': classifier, 'activated_at': time.time()}
+
+    def _record_event(self, app_id, event, key, duration, **extra):
+        self._events.append(dict({
+            'app_id': app_id,
+            'event': event,
+            'model_version': key[1],
+            'duration': duration,
+            'timestamp': time.time(),
+        }, **extra))
+
+
+def _component_keys(key):
+    """モデルのキーを、キャッシュされている分類器ごとのキーに分解
+
+    カスケードは通常モデル（cascade を除いたキー）と高速モデル（_load_cascade と同じ
+    get_classifier の引数, バージョンなし）の2つになる。
+    """
+    options, model_version = key
+    options = dict(options)
+    cascade = options.pop('cascade', None)
+    keys = [(tuple(sorted(options.items())), model_version)]
+    if cascade:
+        fast = {name: options[name] for name in ('device_type', 'precision', 'channels_last')}
+        fast['model_path'] = json.loads(cascade)['model_file_path']
+        keys.append((tuple(sorted(fast.items())), None))
+    return keys
+
+
+def _release_device_memory(device_type: str, model_version: str):
+    """旧モデルの解放後にデバイスのキャッシュ済みメモリを返却"""
+    logger.info(f"Released model {model_version}")
+    if device_type == 'cuda':
+        import torch
+        torch.cuda.empty_cache()
+
+
+_registry = ModelRegistry()
+
+
+def get_model_registry() -> ModelRegistry:
+    """プロセス全体のモデルレジストリ"""
+    return _registry
+
+
+def on_mlapp_saved(sender, instance, created, **kwargs):
+    """MLApp 保存時、このプロセスで使用中のモデルであればバックグラウンドで切り替え"""
+    if created or not instance.is_active:
+        return
+    if _registry.is_active(instance):
+        _registry.schedule_reload(instance, force=True)
+
+
+def _get_setting(name: str, default=None):
+    """settings.INFERENCE_MODEL_RELOAD から設定値を取得"""
+    return getattr(settings, 'INFERENCE_MODEL_RELOAD', {}).get(name, default)
@@ -1,3 +1,5 @@
+import os
+import json
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
 
@@ -42,29 +44,96 @@ class MLApp(models.Model):
         return self.name
     
     def get_device_info(self):
-        """使用可能なデバイス情報を取得"""
-        import torch
+        """使用可能なデバイス情報を取得（プロセス全体のキャッシュを参照）"""
+        from .devices import get_device_capabilities, resolve_device_type
         if self.device_type == 'auto':
-            if torch.cuda.is_available():
+            device = resolve_device_type('auto')
+            if device == 'cuda':
+                cuda_device = get_device_capabilities()['cuda']['devices'][0]
                 return {
                     'device': 'cuda',
-                    'name': torch.cuda.get_device_name(0),
-                    'memory': f"{torch.cuda.get_device_properties(0).total_memory / 1024**3:.1f}GB"
+                    'name': cuda_device['name'],
+                    'memory': f"{cuda_device['total_memory'] / 1024**3:.1f}GB"
                 }
-            elif hasattr(torch.backends, 'mps') and torch.backends.mps.is_available():
+            elif device == 'mps':
                 return {'device': 'mps', 'name': 'Apple Silicon GPU'}
             else:
                 return {'device': 'cpu', 'name': 'CPU'}
         return {'device': self.device_type}
     
+    def get_optimization_settings(self):
+        """モデル最適化設定を辞書で取得（JSON文字列で保存された値にも対応）"""
+        settings = self.model_optimization
+        if isinstance(settings, str):
+            try:
+                settings = json.loads(settings)
+            except ValueError:
+                settings = {}
+        return settings if isinstance(settings, dict) else {}
+    
+    def get_precision(self):
+        """推論精度を取得（fp32 / fp16 / bf16 / auto）"""
+        if not self.use_mixed_precision:
+            return 'fp32'
+        # 混合精度使用時は model_optimization['precision'] で fp16/bf16 を指定可能
+        return self.get_optimization_settings().get('precision', 'auto')
+    
+    def get_model_version(self):
+        """モデルのバージョン識別子
+
+        model_optimization['model_version'] が指定されていればそれを使い、
+        なければモデルファイル名と更新時刻から作成する。
+        """
+        version = self.get_optimization_settings().get('model_version')
+        if version:
+            return str(version)
+        if self.model_file_path and os.path.exists(self.model_file_path):
+            mtime = int(os.path.getmtime(self.model_file_path))
+            return f"{os.path.basename(self.model_file_path)}@{mtime}"
+        return 'default'
+    
+    def get_inference_options(self):
+        """分類器の生成オプションを取得"""
+        return {
+            'device_type': self.device_type,
+            'precision': self.get_precision(),
+            'channels_last': self.get_optimization_settings().get('channels_last', True),
+            'model_path': self.model_file_path or None,
+        }
+    
     def get_optimal_batch_size(self):
         """デバイスに応じた最適なバッチサイズを取得"""
+        # 自動調整済みの値があればそれを使用
+        from .autotune import get_tuned_batch_size
+        tuned = get_tuned_batch_size(self)
+        if tuned:
+            return tuned
+        
         device_info = self.get_device_info()
         if device_info['device'] == 'cuda':
             # GPU VRAMに応じてバッチサイズを調整
             return min(self.batch_size * 4, 32)
         return self.batch_size
 
+class BatchSizeProfile(models.Model):
+    """アプリ・デバイスごとの自動調整済みバッチサイズ"""
+    ml_app = models.ForeignKey(MLApp, on_delete=models.CASCADE, verbose_name="MLアプリ")
+    device_fingerprint = models.CharField(max_length=64, verbose_name="デバイス識別子")
+    device_description = models.JSONField(default=dict, verbose_name="デバイス情報")
+    batch_size = models.PositiveIntegerField(verbose_name="最適バッチサイズ")
+    p99_latency_target = models.FloatField(verbose_name="p99レイテンシ目標（秒）")
+    measurements = models.JSONField(default=list, verbose_name="計測結果")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "バッチサイズプロファイル"
+        verbose_name_plural = "バッチサイズプロファイル"
+        unique_together = ('ml_app', 'device_fingerprint')
+
+    def __str__(self):
+        return f"{self.ml_app.name} - batch {self.batch_size} ({self.device_fingerprint})"
+
 class PredictionLog(models.Model):
     """推論ログのモデル"""
     ml_app = models.ForeignKey(MLApp, on_delete=models.CASCADE, verbose_name="MLアプリ")
@@ -85,6 +154,7 @@ class PredictionLog(models.Model):
         null=True, 
         blank=True
     )
+    perceptual_hash = models.BigIntegerField(verbose_name="知覚ハッシュ（dHash）", null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -108,3 +178,45 @@ class ImageUpload(models.Model):
     class Meta:
         verbose_name = "画像アップロード"
         verbose_name_plural = "画像アップロード"
+
+class VersionedPrediction(models.Model):
+    """保存済み画像のモデルバージョンごとの推論結果（再推論用）"""
+    ml_app = models.ForeignKey(MLApp, on_delete=models.CASCADE, verbose_name="MLアプリ")
+    image_upload = models.ForeignKey(ImageUpload, on_delete=models.CASCADE, verbose_name="アップロード画像")
+    model_version = models.CharField(max_length=200, verbose_name="モデルバージョン")
+    predicted_class = models.CharField(max_length=100, verbose_name="予測クラス", null=True, blank=True)
+    confidence_score = models.FloatField(verbose_name="信頼度", null=True, blank=True)
+    output_data = models.JSONField(verbose_name="出力データ")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "バージョン別推論結果"
+        verbose_name_plural = "バージョン別推論結果"
+        unique_together = ('ml_app', 'model_version', 'image_upload')
+
+    def __str__(self):
+        return f"{self.ml_app.name} [{self.model_version}] - {self.predicted_class}"
+
+class ShadowPrediction(models.Model):
+    """候補モデルのシャドー推論結果（本番モデルとの比較）"""
+    ml_app = models.ForeignKey(MLApp, on_delete=models.CASCADE, verbose_name="MLアプリ")
+    prediction_log = models.ForeignKey(
+        PredictionLog, on_delete=models.SET_NULL, verbose_name="推論ログ", null=True, blank=True
+    )
+    candidate_version = models.CharField(max_length=300, verbose_name="候補モデルバージョン")
+    primary_class = models.CharField(max_length=100, verbose_name="本番モデル予測クラス")
+    primary_confidence = models.FloatField(verbose_name="本番モデル信頼度")
+    shadow_class = models.CharField(max_length=100, verbose_name="候補モデル予測クラス")
+    shadow_confidence = models.FloatField(verbose_name="候補モデル信頼度")
+    agreed = models.BooleanField(verbose_name="予測一致")
+    primary_latency = models.FloatField(verbose_name="本番モデル推論時間（秒）")
+    shadow_latency = models.FloatField(verbose_name="候補モデル推論時間（秒）")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "シャドー推論結果"
+        verbose_name_plural = "シャドー推論結果"
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.ml_app.name} [{self.candidate_version}] - {self.primary_class} / {self.shadow_class}"
@@ -0,0 +1,293 @@
+"""
+共有バックボーン・マルチヘッド推論
+
+MobileNetV2 の画像分類アプリは分類層（classifier[1]）以外が共通のため、
+特徴抽出部（バックボーン）を1つだけ読み込み、アプリごとの線形ヘッドを
+追加する。異なるアプリへのリクエストもまとめてバックボーンで一括推論し、
+特徴量を各アプリのヘッドに振り分ける。アプリ追加ごとのメモリはヘッドの
+重み（数KB）のみで、アプリが混在するトラフィックでもバッチが埋まりやすい。
+
+model_optimization['shared_backbone'] = true のアプリが対象。ヘッドの重みは
+アプリのチェックポイントの classifier.1.weight / classifier.1.bias を使用する
+（バックボーンは共有のものを使い、チェックポイント側の重みは読み込まない）。
+チェックポイントのバックボーンの重みが共有バックボーンと異なる場合（バックボーンごと
+ファインチューニングしたモデル等）は、誤った予測を返さないよう読み込みを拒否する。
+"""
+import json
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.nn as nn
+from django.conf import settings
+from PIL import Image
+
+from .cuda_inference import ArrayClassifierMixin, CUDAImageClassifier, compute_backbone_fingerprint
+
+logger = logging.getLogger(__name__)
+
+
+class _Head:
+    """アプリごとの線形ヘッド"""
+
+    def __init__(self, linear: nn.Linear, classes: List[str], source: str):
+        self.linear = linear
+        self.classes = classes
+        self.source = source
+
+
+class MultiHeadEngine:
+    """共有バックボーンと複数の線形ヘッドによる推論エンジン"""
+
+    def __init__(self, device_type: str = 'auto', precision: str = 'fp32',
+                 channels_last: bool = True, backbone_path: Optional[str] = None,
+                 max_batch_size: int = 32, max_delay: float = 0.002, result_timeout: float = 30.0):
+        self.base = CUDAImageClassifier(
+            model_path=backbone_path, device_type=device_type,
+            precision=precision, channels_last=channels_last
+        )
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.result_timeout = result_timeout
+        self._heads = {}
+        self._heads_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._stats = {'batches': 0, 'rows': 0, 'requests': 0, 'mixed_batches': 0, 'timeouts': 0}
+        self._stats_lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name='inference-multihead', daemon=True)
+        self._worker.start()
+
+    def get_head_classifier(self, model_path: Optional[str] = None,
+                            model_version: Optional[str] = None) -> 'SharedBackboneClassifier':
+        """アプリのヘッドを読み込み、分類器と同じインターフェースで返す"""
+        key = (model_path, model_version)
+        with self._heads_lock:
+            if key not in self._heads:
+                self._heads[key] = self._load_head(model_path)
+                logger.info(f"Attached head {self._heads[key].source} "
+                            f"({len(self._heads[key].classes)} classes) to shared backbone")
+            head = self._heads[key]
+        return SharedBackboneClassifier(self, head)
+
+    def release_head(self, model_path: Optional[str] = None, model_version: Optional[str] = None):
+        """ヘッドをキャッシュから外す（処理中のリクエストは参照中のヘッドで最後まで推論）"""
+        with self._heads_lock:
+            return self._heads.pop((model_path, model_version), None)
+
+    def predict_arrays(self, head: _Head, arrays: np.ndarray, top_k: Optional[int] = None,
+                       min_confidence: Optional[float] = None) -> List[Dict]:
+        """前処理済み uint8 配列を他のリクエストとまとめてバックボーンで推論
+
+        ワーカーが result_timeout 秒以内に応答しない場合は TimeoutError を送出する
+        （リクエストのスレッドと受付枠を解放するため）。
+        """
+        if not self._worker.is_alive():
+            raise RuntimeError("Shared backbone worker is not running")
+        future = Future()
+        self._queue.put((head, arrays, top_k, min_confidence, future))
+        try:
+            return future.result(timeout=self.result_timeout)
+        except FutureTimeoutError:
+            # 未処理ならキューに残った要求をワーカーが読み飛ばす
+            future.cancel()
+            with self._stats_lock:
+                self._stats['timeouts'] += 1
+            raise TimeoutError(f"Shared backbone did not respond within {self.result_timeout}s")
+
+    def stats(self) -> Dict:
+        with self._heads_lock:
+            heads = {
+                version or head.source: len(head.classes)
+                for (_, version), head in self._heads.items()
+            }
+            head_bytes = sum(
+                p.numel() * p.element_size() for head in self._heads.values() for p in head.linear.parameters()
+            )
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['average_batch_rows'] = stats['rows'] / stats['batches'] if stats['batches'] else 0.0
+        stats.update({'heads': heads, 'head_bytes': head_bytes, 'queued': self._queue.qsize()})
+        return stats
+
+    def _load_head(self, model_path: Optional[str]) -> _Head:
+        """チェックポイントから線形ヘッドのみを読み込み（なければバックボーンのヘッド）"""
+        default_linear = self.base.model.classifier[1]
+        if not model_path or not Path(model_path).exists():
+            return _Head(default_linear, list(self.base.classes), 'default')
+
+        model_path = Path(model_path)
+        checkpoint = torch.load(model_path, map_location=self.base.device)
+        state = checkpoint.get('model_state_dict', {})
+        if 'classifier.1.weight' not in state:
+            raise ValueError(f"Checkpoint has no classifier head: {model_path}")
+        weight, bias = state['classifier.1.weight'], state['classifier.1.bias']
+        if weight.shape[1] != default_linear.in_features:
+            raise ValueError(f"Head input size {weight.shape[1]} does not match backbone "
+                             f"({default_linear.in_features}): {model_path}")
+        if any(not name.startswith('classifier.') for name in state):
+            # ヘッドのみのチェックポイント以外は、バックボーンの重みが共有のものと同じ場合のみ使用
+            fingerprint = compute_backbone_fingerprint(state, checkpoint.get('width_mult', 1.0))
+            if fingerprint != self.base.backbone_fingerprint():
+                raise ValueError(f"Checkpoint backbone ({fingerprint}) differs from the shared backbone "
+                                 f"({self.base.backbone_fingerprint()}); disable shared_backbone: {model_path}")
+
+        classes = [f'class_{i}' for i in range(weight.shape[0])]
+        model_info_path = model_path.parent / 'model_info.json'
+        if model_info_path.exists():
+            with open(model_info_path, 'r') as f:
+                classes = json.load(f).get('classes', classes)
+        if len(classes) != weight.shape[0]:
+            raise ValueError(f"Head has {weight.shape[0]} outputs but {len(classes)} classes: {model_path}")
+
+        linear = nn.Linear(weight.shape[1], weight.shape[0])
+        linear.load_state_dict({'weight': weight, 'bias': bias})
+        linear.to(self.base.device).eval()
+        return _Head(linear, classes, model_path.name)
+
+    def _run(self):
+        """リクエストをまとめてバックボーンで推論し、各ヘッドに振り分けるワーカー"""
+        while True:
+            items = [self._queue.get()]
+            rows = len(items[0][1])
+            deadline = time.time() + self.max_delay
+            while rows < self.max_batch_size:
+                remaining = deadline - time.time()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                items.append(item)
+                rows += len(item[1])
+
+            # 待機がタイムアウトして取り消された要求は推論しない
+            items = [item for item in items if item[4].set_running_or_notify_cancel()]
+            if not items:
+                continue
+            try:
+                self._process(items)
+            except Exception as e:
+                logger.error(f"Shared backbone batch failed: {e}")
+                for item in items:
+                    if not item[4].done():
+                        item[4].set_exception(e)
+
+    def _process(self, items):
+        start_time = time.time()
+        arrays = np.concatenate([np.asarray(item[1]) for item in items])
+        features = self.base._forward_features(self.base.tensor_from_arrays(arrays))
+
+        # ヘッドごとに特徴量をまとめて線形層を適用
+        offsets = np.cumsum([0] + [len(item[1]) for item in items])
+        by_head = {}
+        for index, item in enumerate(items):
+            by_head.setdefault(item[0], []).append(index)
+
+        for head, indices in by_head.items():
+            rows = torch.cat([
+                torch.arange(offsets[i], offsets[i + 1], device=features.device) for i in indices
+            ])
+            with torch.no_grad(), self.base._autocast():
+                logits = head.linear(features.index_select(0, rows))
+
+            position = 0
+            for index in indices:
+                _, item_arrays, top_k, min_confidence, future = items[index]
+                count = len(item_arrays)
+                results = self.base._summarize_outputs(
+                    logits[position:position + count], top_k, min_confidence, classes=head.classes
+                )
+                position += count
+                processing_time = (time.time() - start_time) / max(count, 1)
+                for result in results:
+                    result.update({'processing_time': processing_time, 'device': str(self.base.device)})
+                future.set_result(results)
+
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['rows'] += len(arrays)
+            self._stats['requests'] += len(items)
+            if len(by_head) > 1:
+                self._stats['mixed_batches'] += 1
+
+
+class SharedBackboneClassifier(ArrayClassifierMixin):
+    """共有バックボーン上の1ヘッドを CUDAImageClassifier と同じインターフェースで提供
+
+    前処理・デバイス情報等はバックボーンの分類器に委譲する。
+    """
+
+    loaded = True
+
+    def __init__(self, engine: MultiHeadEngine, head: _Head):
+        self.engine = engine
+        self.head = head
+
+    def __getattr__(self, name):
+        return getattr(self.engine.base, name)
+
+    @property
+    def classes(self) -> List[str]:
+        return self.head.classes
+
+    def predict_arrays(self, arrays: np.ndarray, top_k: Optional[int] = None,
+                       min_confidence: Optional[float] = None) -> List[Dict]:
+        return self.engine.predict_arrays(self.head, arrays, top_k, min_confidence)
+
+    def warmup(self, batch_sizes: List[int] = (1,), iterations: int = 2) -> Dict:
+        result = self.engine.base.warmup(batch_sizes=batch_sizes, iterations=iterations)
+        dummy = np.zeros((1,) + tuple(self.input_size) + (3,), dtype=np.uint8)
+        self.predict_arrays(dummy)
+        result['shared_backbone'] = True
+        return result
+
+    def validate_precision(self, images: Optional[List[Image.Image]] = None,
+                           num_samples: int = 16, num_iterations: int = 20) -> Dict:
+        """精度設定ごとの精度差・レイテンシ差（共有バックボーン＋このヘッド）をFP32基準で計測"""
+        base = self.engine.base
+
+        def forward(input_tensor, precision):
+            features = base._forward_features(input_tensor, precision)
+            with torch.no_grad(), base._autocast(precision):
+                return self.head.linear(features)
+
+        result = base._compare_precisions(forward, base._validation_input(images, num_samples), num_iterations)
+        result['shared_backbone'] = True
+        return result
+
+    def get_device_info(self) -> Dict:
+        info = self.engine.base.get_device_info()
+        info['shared_backbone'] = self.engine.stats()
+        return info
+
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+
+def get_multihead_engine(device_type: str = 'auto', precision: str = 'fp32',
+                         channels_last: bool = True) -> MultiHeadEngine:
+    """推論設定ごとの共有バックボーンエンジン"""
+    key = (device_type, precision, channels_last)
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = MultiHeadEngine(
+                device_type=device_type,
+                precision=precision,
+                channels_last=channels_last,
+                backbone_path=_get_setting('BACKBONE_PATH'),
+                max_batch_size=_get_setting('MAX_BATCH_SIZE', 32),
+                max_delay=_get_setting('MAX_DELAY_MS', 2) / 1000,
+                result_timeout=_get_setting('RESULT_TIMEOUT', 30),
+            )
+        return _engines[key]
+
+
+def _get_setting(name: str, default=None):
+    """settings.INFERENCE_MULTIHEAD から設定値を取得"""
+    return getattr(settings, 'INFERENCE_MULTIHEAD', {}).get(name, default)
@@ -0,0 +1,130 @@
+"""
+multipart を使わないアップロード用のパーサー
+
+- RawImageParser: リクエストボディをそのまま画像ファイルとして受け取る
+  （Content-Type: image/jpeg 等）。multipart の境界の解析を省き、multipart と同じ
+  アップロードハンドラで受信して request.FILES['image'] に入れる。
+- NpyTensorParser / RawTensorParser: 前処理済み（リサイズ済み・正規化前）の uint8 配列を
+  .npy（application/x-npy）またはヘッダーなしのバイト列（application/octet-stream）で受け取る。
+  デコード・リサイズを省略して推論する predict_tensor 用。
+"""
+import io
+import mimetypes
+
+from django.conf import settings
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.utils.datastructures import MultiValueDict
+from rest_framework import status
+from rest_framework.exceptions import APIException, ParseError
+from rest_framework.parsers import BaseParser, DataAndFiles
+from rest_framework.utils.mediatypes import parse_header_parameters
+
+from .upload_handlers import StreamingDecodeUploadHandler
+
+
+class RequestBodyTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Request body is too large'
+    default_code = 'request_body_too_large'
+
+
+def get_content_length(parser_context) -> int:
+    request = (parser_context or {}).get('request')
+    try:
+        return int(request.META.get('CONTENT_LENGTH') or 0)
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+
+def check_content_length(content_length: int, max_bytes: int):
+    """ボディを読む前に Content-Length で上限を確認"""
+    if content_length > max_bytes:
+        raise RequestBodyTooLarge(f'Request body is too large ({content_length} bytes, limit {max_bytes})')
+
+
+def get_upload_filename(parser_context, media_type: str) -> str:
+    """?filename= または Content-Disposition のファイル名（なければ Content-Type から作成）"""
+    request = (parser_context or {}).get('request')
+    filename = request.query_params.get('filename') if request is not None else None
+    if not filename and request is not None:
+        disposition = request.META.get('HTTP_CONTENT_DISPOSITION')
+        if disposition:
+            filename = parse_header_parameters(disposition)[1].get('filename')
+    if not filename:
+        filename = 'upload' + (mimetypes.guess_extension(media_type) or '.bin')
+    return filename
+
+
+class RawImageParser(BaseParser):
+    """画像のバイト列をそのまま受け取り request.FILES['image'] に入れる
+
+    multipart と同じアップロードハンドラ（StreamingDecodeUploadHandler）でボディを受信するため、
+    受信中のハッシュの計算・デコードも同様に行われる。
+    """
+
+    media_type = 'image/*'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        media_type = parse_header_parameters(media_type or '')[0] or 'application/octet-stream'
+        content_length = get_content_length(parser_context)
+        check_content_length(content_length, _get_image_setting('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+        filename = get_upload_filename(parser_context, media_type)
+        request = (parser_context or {}).get('request')
+
+        # 小さなボディは1つのバッファ、大きなボディは保存先と同じ場所の一時ファイルに受信
+        handler = StreamingDecodeUploadHandler(request._request if request is not None else None)
+        handler.handle_raw_input(stream, getattr(request, 'META', {}), content_length, None)
+        try:
+            handler.new_file('image', filename, media_type, content_length, None)
+        except StopFutureHandlers:
+            pass
+        size = 0
+        for chunk in iter(lambda: stream.read(handler.chunk_size), b''):
+            handler.receive_data_chunk(chunk, size)
+            size += len(chunk)
+        image = handler.file_complete(size)
+
+        files = MultiValueDict({'image': [image]})
+        if request is not None:
+            # DRF がフォームの場合に行うのと同様に、リクエスト終了時に一時ファイルが閉じられるようにする
+            request._request._files = files
+        return DataAndFiles({}, files)
+
+
+class NpyTensorParser(BaseParser):
+    """.npy 形式の前処理済み配列（request.data['array']）"""
+
+    media_type = 'application/x-npy'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        import numpy as np
+
+        data = _read_tensor_body(stream, parser_context)
+        try:
+            array = np.load(io.BytesIO(data), allow_pickle=False)
+        except Exception as e:
+            raise ParseError(f'Invalid .npy data: {e}')
+        return {'array': array}
+
+
+class RawTensorParser(BaseParser):
+    """ヘッダーなしの uint8 のバイト列（request.data['array'] は1次元, 形状はビューで確認）"""
+
+    media_type = 'application/octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        import numpy as np
+
+        return {'array': np.frombuffer(_read_tensor_body(stream, parser_context), dtype=np.uint8)}
+
+
+def _read_tensor_body(stream, parser_context) -> bytes:
+    content_length = get_content_length(parser_context)
+    # 224x224x3 の uint8 で 32 枚分程度を上限とする
+    check_content_length(content_length, _get_image_setting('MAX_TENSOR_BYTES', 8 * 1024 * 1024))
+    return stream.read(content_length) if content_length else stream.read()
+
+
+def _get_image_setting(name: str, default=None):
+    """settings.INFERENCE_IMAGE_DECODE から設定値を取得"""
+    return getattr(settings, 'INFERENCE_IMAGE_DECODE', {}).get(name, default)
@@ -0,0 +1,170 @@
+"""
+知覚ハッシュによる近似重複画像の推論結果の再利用
+
+再エンコード・リサイズされた同じ写真はバイト列のハッシュ（coalescing.py）では
+一致しないため、縮小デコード済みの画像から 64 ビットの dHash を計算し、
+ハミング距離が閾値以内の過去の推論結果を返して順伝播を省略する。
+
+検索はマルチインデックスハッシング: 64 ビットを (閾値 + 1) 個の区間に分けて
+区間ごとの辞書に登録する。距離が閾値以内のハッシュは鳩の巣原理で少なくとも
+1区間が完全一致するため、各区間の辞書引きで候補を絞り、候補のみ距離を計算する。
+
+model_optimization['near_duplicate'] = {'max_distance': 4} のアプリが対象（true で既定値）。
+インデックスはプロセス内のみで、アプリ・モデルごとに1つ。全クラスの確率を保存し、
+top_k / min_confidence は読み出し時に適用する（クライアントが指定する値ごとに
+インデックスを作らず、メモリ使用量を容量の上限内に保つ）。
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+
+
+def dhash(image: Image.Image) -> int:
+    """64 ビットの dHash（9x8 グレースケールの横方向の輝度差）"""
+    # 72画素のみのため numpy を使わずに計算（views の import 時に numpy を読み込まない）
+    pixels = image.convert('L').resize((9, 8), Image.BILINEAR).tobytes()
+    value = 0
+    for row in range(0, 72, 9):
+        for col in range(row, row + 8):
+            value = (value << 1) | (pixels[col + 1] > pixels[col])
+    return value
+
+
+def to_signed(value: int) -> int:
+    """符号なし 64 ビット値を BigIntegerField に保存できる符号付きに変換"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+class MultiIndexHashIndex:
+    """ハミング距離で検索する 64 ビットハッシュのインデックス（容量を超えると古い順に削除）"""
+
+    def __init__(self, max_distance: int = 4, capacity: int = 10000):
+        self.max_distance = max_distance
+        self.capacity = capacity
+        chunks = max_distance + 1
+        bounds = [HASH_BITS * i // chunks for i in range(chunks + 1)]
+        self._chunks = [(start, (1 << (end - start)) - 1) for start, end in zip(bounds, bounds[1:])]
+        self._tables = [{} for _ in self._chunks]
+        self._entries = OrderedDict()   # ハッシュ -> 値
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'hits': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, hash_value: int, value):
+        with self._lock:
+            if hash_value in self._entries:
+                self._entries.move_to_end(hash_value)
+                self._entries[hash_value] = value
+                return
+            self._entries[hash_value] = value
+            for table, key in zip(self._tables, self._keys(hash_value)):
+                table.setdefault(key, set()).add(hash_value)
+            while len(self._entries) > self.capacity:
+                self._remove(next(iter(self._entries)))
+
+    def query(self, hash_value: int) -> Optional[Tuple[object, int]]:
+        """距離が閾値以内で最も近いハッシュの値と距離（なければ None）"""
+        with self._lock:
+            self._stats['lookups'] += 1
+            best, best_distance = None, self.max_distance + 1
+            for table, key in zip(self._tables, self._keys(hash_value)):
+                for candidate in table.get(key, ()):
+                    distance = (candidate ^ hash_value).bit_count()
+                    if distance < best_distance:
+                        best, best_distance = candidate, distance
+            if best is None:
+                return None
+            self._stats['hits'] += 1
+            self._entries.move_to_end(best)
+            return self._entries[best], best_distance
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({'entries': len(self._entries), 'max_distance': self.max_distance})
+        stats['hit_rate'] = stats['hits'] / stats['lookups'] if stats['lookups'] else 0.0
+        return stats
+
+    def _keys(self, hash_value: int):
+        return [(hash_value >> start) & mask for start, mask in self._chunks]
+
+    def _remove(self, hash_value: int):
+        del self._entries[hash_value]
+        for table, key in zip(self._tables, self._keys(hash_value)):
+            bucket = table[key]
+            bucket.discard(hash_value)
+            if not bucket:
+                del table[key]
+
+
+def get_near_duplicate_config(ml_app) -> Optional[Dict]:
+    """アプリの近似重複の再利用設定（無効時は None）"""
+    config = ml_app.get_optimization_settings().get('near_duplicate')
+    if not config or not _get_setting('ENABLED', True):
+        return None
+    if not isinstance(config, dict):
+        config = {}
+    return {'max_distance': int(config.get('max_distance', _get_setting('MAX_DISTANCE', 4)))}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_near_duplicate_index(ml_app) -> Optional[MultiIndexHashIndex]:
+    """アプリ・使用中モデルごとのインデックス（無効時は None）"""
+    from .model_registry import get_model_key
+
+    config = get_near_duplicate_config(ml_app)
+    if config is None:
+        return None
+    key = (ml_app.pk, get_model_key(ml_app), config['max_distance'])
+    with _indexes_lock:
+        if key not in _indexes:
+            # 古いモデル・設定のインデックスは破棄
+            for old in [k for k in _indexes if k[0] == ml_app.pk]:
+                del _indexes[old]
+            _indexes[key] = MultiIndexHashIndex(
+                max_distance=config['max_distance'],
+                capacity=_get_setting('CAPACITY', 10000),
+            )
+        return _indexes[key]
+
+
+def apply_output_options(result: Dict, top_k: Optional[int] = None,
+                         min_confidence: Optional[float] = None) -> Dict:
+    """全クラスの確率を含む推論結果に top_k / min_confidence を適用（summarize_logits と同じ形式）"""
+    if top_k is None and min_confidence is None:
+        return result
+    items = sorted(result['class_probabilities'].items(), key=lambda item: item[1], reverse=True)
+    if top_k is not None:
+        items = items[:max(1, top_k)]
+    if min_confidence is not None:
+        items = [item for item in items if item[1] >= min_confidence]
+    return dict(result, class_probabilities=dict(items))
+
+
+def near_duplicate_stats(ml_app) -> Optional[Dict]:
+    """アプリのインデックスの統計（未使用・無効時は None）"""
+    with _indexes_lock:
+        indexes = [index for k, index in _indexes.items() if k[0] == ml_app.pk]
+    return indexes[0].stats() if indexes else None
+
+
+def _get_setting(name: str, default=None):
+    """settings.INFERENCE_NEAR_DUPLICATE から設定値を取得"""
+    return getattr(settings, 'INFERENCE_NEAR_DUPLICATE', {}).get(name, default)
@@ -0,0 +1,213 @@
+"""
+推論エンドポイント向けの高速レスポンスレンダラー
+
+バッチ推論の全クラスの class_probabilities 等、入れ子の dict と多数の float を含む
+レスポンスは標準の JSONRenderer（json.dumps）で無視できない時間がかかる。
+
+- FastJSONRenderer: orjson があれば orjson で、なければ標準の json で出力する
+  （indent 指定時・64 ビットを超える整数を含む場合は標準の実装を使用）。出力は JSONRenderer と
+  同じバイト列だが、指数表記の float は 1e-05 ではなく 1e-5 と出力し（値は同じ）、
+  NaN / Infinity は JSONRenderer のようにエラーにせず null を出力する。
+- MessagePackRenderer: Accept: application/msgpack（または ?format=msgpack）で選択される
+  バイナリ形式。msgpack パッケージがなければ組み込みのエンコーダで出力する。
+
+float の精度は INFERENCE_RENDERING['FLOAT_PRECISION']（小数点以下の桁数）、または
+Accept ヘッダーのパラメータ（application/json; precision=4）で指定する。
+MessagePack は float=32（または MSGPACK_SINGLE_FLOAT）で単精度にできる。
+"""
+import struct
+import contextlib
+
+from django.conf import settings
+from rest_framework.utils import encoders
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.mediatypes import parse_header_parameters
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MAX_FLOAT_PRECISION = 17
+
+
+def round_floats(data, ndigits: int):
+    """入れ子の dict / list に含まれる float を小数点以下 ndigits 桁に丸める"""
+    # 要素の大半を占める float は再帰呼び出しせずにその場で丸める
+    if isinstance(data, dict):
+        return {
+            key: round(value, ndigits) if type(value) is float else round_floats(value, ndigits)
+            for key, value in data.items()
+        }
+    if isinstance(data, (list, tuple)):
+        return [
+            round(value, ndigits) if type(value) is float else round_floats(value, ndigits)
+            for value in data
+        ]
+    if isinstance(data, float):
+        return round(data, ndigits)
+    return data
+
+
+def get_media_type_param(accepted_media_type, name):
+    """Accept のメディアタイプのパラメータ（application/json; precision=4 の precision 等）"""
+    if not accepted_media_type:
+        return None
+    _, params = parse_header_parameters(accepted_media_type)
+    return params.get(name)
+
+
+def get_float_precision(accepted_media_type):
+    """float を丸める桁数（None は丸めない）"""
+    precision = get_media_type_param(accepted_media_type, 'precision')
+    if precision is None:
+        precision = _get_setting('FLOAT_PRECISION')
+    with contextlib.suppress(TypeError, ValueError):
+        return max(min(int(precision), MAX_FLOAT_PRECISION), 0)
+    return None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """orjson による JSON レンダラー（JSONRenderer と同じメディアタイプ・出力）"""
+
+    _encoder = encoders.JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        precision = get_float_precision(accepted_media_type)
+        if precision is not None:
+            data = round_floats(data, precision)
+
+        renderer_context = renderer_context or {}
+        if orjson is None or self.get_indent(accepted_media_type, renderer_context) is not None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Decimal・遅延評価の文字列・numpy の値等は DRF のエンコーダで変換
+        # （datetime は DRF と同じく UTC を Z で表記、dict の数値キーは文字列化）
+        try:
+            ret = orjson.dumps(
+                data, default=self._encoder.default,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z
+            )
+        except orjson.JSONEncodeError:
+            # 64 ビットを超える整数等、orjson で出力できない値
+            return super().render(data, accepted_media_type, renderer_context)
+        # JSONRenderer と同じく JavaScript の文字列で不正な \u2028 / \u2029 はエスケープ
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+    """MessagePack レンダラー（Accept: application/msgpack）"""
+
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    _encoder = encoders.JSONEncoder()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        precision = get_float_precision(accepted_media_type)
+        if precision is not None:
+            data = round_floats(data, precision)
+
+        float_bits = get_media_type_param(accepted_media_type, 'float')
+        single_float = float_bits == '32' if float_bits else _get_setting('MSGPACK_SINGLE_FLOAT', False)
+
+        if msgpack is not None:
+            return msgpack.packb(data, default=self._encoder.default,
+                                 use_single_float=single_float, use_bin_type=True)
+        out = bytearray()
+        _pack(data, out, single_float, self._encoder.default)
+        return bytes(out)
+
+
+def _pack(obj, out: bytearray, single_float: bool, default):
+    """MessagePack の組み込みエンコーダ（msgpack パッケージがない場合）"""
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        _pack_int(obj, out)
+    elif isinstance(obj, float):
+        out += struct.pack('>Bf', 0xca, obj) if single_float else struct.pack('>Bd', 0xcb, obj)
+    elif isinstance(obj, str):
+        data = obj.encode('utf-8')
+        size = len(data)
+        if size < 32:
+            out.append(0xa0 | size)
+        elif size < 0x100:
+            out += struct.pack('>BB', 0xd9, size)
+        elif size < 0x10000:
+            out += struct.pack('>BH', 0xda, size)
+        else:
+            out += struct.pack('>BI', 0xdb, size)
+        out += data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        size = len(obj)
+        if size < 0x100:
+            out += struct.pack('>BB', 0xc4, size)
+        elif size < 0x10000:
+            out += struct.pack('>BH', 0xc5, size)
+        else:
+            out += struct.pack('>BI', 0xc6, size)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        _pack_header(len(obj), out, 0x90, 0xdc, 0xdd)
+        for value in obj:
+            _pack(value, out, single_float, default)
+    elif isinstance(obj, dict):
+        _pack_header(len(obj), out, 0x80, 0xde, 0xdf)
+        for key, value in obj.items():
+            _pack(key, out, single_float, default)
+            _pack(value, out, single_float, default)
+    else:
+        _pack(default(obj), out, single_float, default)
+
+
+def _pack_header(size: int, out: bytearray, fix: int, code16: int, code32: int):
+    if size < 16:
+        out.append(fix | size)
+    elif size < 0x10000:
+        out += struct.pack('>BH', code16, size)
+    else:
+        out += struct.pack('>BI', code32, size)
+
+
+def _pack_int(value: int, out: bytearray):
+    if 0 <= value < 0x80:
+        out.append(value)
+    elif -32 <= value < 0:
+        out.append(value & 0xff)
+    elif value >= 0:
+        for code, fmt, limit in ((0xcc, '>BB', 0x100), (0xcd, '>BH', 0x10000),
+                                 (0xce, '>BI', 0x100000000), (0xcf, '>BQ', 0x10000000000000000)):
+            if value < limit:
+                out += struct.pack(fmt, code, value)
+                return
+        raise OverflowError('Integer value out of range for MessagePack')
+    else:
+        for code, fmt, limit in ((0xd0, '>Bb', 0x80), (0xd1, '>Bh', 0x8000),
+                                 (0xd2, '>Bi', 0x80000000), (0xd3, '>Bq', 0x8000000000000000)):
+            if value >= -limit:
+                out += struct.pack(fmt, code, value)
+                return
+        raise OverflowError('Integer value out of range for MessagePack')
+
+
+def _get_setting(name: str, default=None):
+    """settings.INFERENCE_RENDERING から設定値を取得"""
+    return getattr(settings, 'INFERENCE_RENDERING', {}).get(name, default)
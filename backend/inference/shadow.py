@@ -0,0 +1,206 @@
+"""
+候補モデルのシャドー推論（A/B評価）
+
+本番の推論結果を返した後、サンプリングしたリクエストの前処理済み uint8 配列を
+バックグラウンドのワーカーに渡し、候補モデル（model_optimization['shadow']）で
+同じ入力を推論する。予測クラスの一致とレイテンシを ShadowPrediction に保存し、
+本番のレスポンス経路には推論・DB書き込みを追加しない。
+レイテンシは本番・候補とも predict_arrays の処理時間（processing_time, 前処理済み配列の
+順伝播と結果の作成のみ）で比較する。
+キューが埋まっている場合は投入せずに破棄し、本番側を待たせない。
+候補モデルは設定の変更・削除時にキャッシュから外し、参照がなくなった時点で解放する
+（ModelRegistry の旧モデルと同様）。
+"""
+import random
+import weakref
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db.models.signals import post_delete
+
+logger = logging.getLogger(__name__)
+
+
+class ShadowEvaluator:
+    """候補モデルでのシャドー推論をバックグラウンドで実行"""
+
+    def __init__(self, max_workers: int = 1, max_pending: int = 32):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='inference-shadow')
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._counters = {'submitted': 0, 'completed': 0, 'dropped': 0, 'errors': 0}
+        self._candidates = {}  # アプリID -> 読み込んだ候補モデルの生成オプション
+        self._retired = []     # 解放した候補モデルの弱参照（処理中の参照がなくなるまで残る）
+
+    def submit(self, ml_app, shadow_config: Dict, array, primary_result: Dict,
+               primary_latency: float, prediction_log_id: Optional[int] = None) -> bool:
+        """シャドー推論を投入（キューが満杯の場合は破棄して False）"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self._counters['dropped'] += 1
+                return False
+            self._pending += 1
+            self._counters['submitted'] += 1
+        self._executor.submit(
+            self._run, ml_app, shadow_config, array, primary_result, primary_latency, prediction_log_id
+        )
+        return True
+
+    def stats(self) -> Dict:
+        with self._lock:
+            self._retired = [ref for ref in self._retired if ref() is not None]
+            return dict(self._counters, pending=self._pending, max_pending=self.max_pending,
+                        candidates=len(self._candidates), draining=len(self._retired))
+
+    def sync(self, ml_app, shadow_config: Optional[Dict]):
+        """設定の変更・削除・アプリの無効化で使われなくなった候補モデルを解放"""
+        if shadow_config is None or not ml_app.is_active:
+            self._track_candidate(ml_app.pk, None)
+        else:
+            with self._lock:
+                previous = self._candidates.get(ml_app.pk)
+            if previous is not None and previous != get_candidate_options(ml_app, shadow_config):
+                # 新しい候補モデルは次のシャドー推論で読み込む
+                self._track_candidate(ml_app.pk, None)
+
+    def _track_candidate(self, app_id, options: Optional[Dict]):
+        """アプリの候補モデルを記録し、置き換えた候補モデルを解放"""
+        with self._lock:
+            previous = self._candidates.get(app_id)
+            if previous == options:
+                return
+            if options is None:
+                del self._candidates[app_id]
+            else:
+                self._candidates[app_id] = options
+            # 他のアプリが同じ候補モデルを使用中なら残す
+            if previous is None or previous in self._candidates.values():
+                return
+        self._release(previous)
+
+    def _release(self, options: Dict):
+        """候補モデルをキャッシュから外し、参照がなくなった時点で解放"""
+        from .cuda_inference import release_classifier
+        from .model_registry import _release_device_memory
+
+        classifier = release_classifier(**options)
+        if classifier is None:
+            return
+        weakref.finalize(classifier, _release_device_memory, classifier.device.type, options['model_path'])
+        with self._lock:
+            self._retired.append(weakref.ref(classifier))
+
+    def _run(self, ml_app, shadow_config, array, primary_result, primary_latency, prediction_log_id):
+        from django.db import close_old_connections
+        from .cuda_inference import get_classifier
+        from .models import ShadowPrediction
+
+        try:
+            options = get_candidate_options(ml_app, shadow_config)
+            self._track_candidate(ml_app.pk, options)
+            classifier = get_classifier(**options)
+
+            # 本番と同じ区間（predict_arrays の processing_time）で計測
+            result = classifier.predict_arrays(array[None])[0]
+            shadow_latency = result['processing_time']
+
+            ShadowPrediction.objects.create(
+                ml_app=ml_app,
+                prediction_log_id=prediction_log_id,
+                candidate_version=get_candidate_version(shadow_config),
+                primary_class=primary_result['predicted_class'],
+                primary_confidence=primary_result['confidence'],
+                shadow_class=result['predicted_class'],
+                shadow_confidence=result['confidence'],
+                agreed=result['predicted_class'] == primary_result['predicted_class'],
+                primary_latency=primary_latency,
+                shadow_latency=shadow_latency,
+            )
+            with self._lock:
+                self._counters['completed'] += 1
+        except Exception as e:
+            logger.error(f"Shadow inference failed for {ml_app.name}: {e}")
+            with self._lock:
+                self._counters['errors'] += 1
+        finally:
+            with self._lock:
+                self._pending -= 1
+            close_old_connections()
+
+
+def get_shadow_config(ml_app) -> Optional[Dict]:
+    """アプリのシャドー推論設定（未設定・無効時は None）
+
+    model_optimization['shadow'] = {'model_file_path': ..., 'sample_rate': 0.1, 'model_version': ...}
+    """
+    if not _get_setting('ENABLED', True):
+        return None
+    config = ml_app.get_optimization_settings().get('shadow')
+    if not isinstance(config, dict) or not config.get('model_file_path'):
+        return None
+    return config
+
+
+def get_candidate_options(ml_app, shadow_config: Dict) -> Dict:
+    """候補モデルの分類器の生成オプション（推論設定は本番と共通）"""
+    return dict(ml_app.get_inference_options(), model_path=shadow_config['model_file_path'])
+
+
+def get_candidate_version(shadow_config: Dict) -> str:
+    """候補モデルのバージョン識別子"""
+    return str(shadow_config.get('model_version') or shadow_config['model_file_path'])
+
+
+def should_sample(shadow_config: Dict) -> bool:
+    """このリクエストをシャドー推論の対象にするか"""
+    sample_rate = float(shadow_config.get('sample_rate', _get_setting('DEFAULT_SAMPLE_RATE', 0.1)))
+    return random.random() < sample_rate
+
+
+def maybe_submit_shadow(ml_app, array, primary_result: Dict, primary_latency: float,
+                        prediction_log_id: Optional[int] = None) -> bool:
+    """設定とサンプリング率に応じてシャドー推論を投入"""
+    shadow_config = get_shadow_config(ml_app)
+    if shadow_config is None:
+        # 他プロセスで設定が削除された場合も候補モデルを解放
+        if _evaluator is not None:
+            _evaluator.sync(ml_app, None)
+        return False
+    if not should_sample(shadow_config):
+        return False
+    return get_shadow_evaluator().submit(
+        ml_app, shadow_config, array, primary_result, primary_latency, prediction_log_id
+    )
+
+
+_evaluator = None
+_evaluator_lock = threading.Lock()
+
+
+def get_shadow_evaluator() -> ShadowEvaluator:
+    """プロセス全体のシャドー推論ワーカー"""
+    global _evaluator
+    with _evaluator_lock:
+        if _evaluator is None:
+            _evaluator = ShadowEvaluator(
+                max_workers=_get_setting('MAX_WORKERS', 1),
+                max_pending=_get_setting('MAX_PENDING', 32),
+            )
+        return _evaluator
+
+
+def on_mlapp_changed(sender, instance, **kwargs):
+    """MLApp の保存・削除時、使われなくなった候補モデルを解放"""
+    if _evaluator is None:
+        return
+    shadow_config = None if kwargs.get('signal') is post_delete else get_shadow_config(instance)
+    _evaluator.sync(instance, shadow_config)
+
+
+def _get_setting(name: str, default=None):
+    """settings.INFERENCE_SHADOW から設定値を取得"""
+    return getattr(settings, 'INFERENCE_SHADOW', {}).get(name, default)
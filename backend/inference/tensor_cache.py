@@ -0,0 +1,267 @@
+"""
+前処理済みテンソルのディスクキャッシュ
+
+モデルの新バージョンで保存済み画像を再推論する際に、JPEGデコードとリサイズを
+毎回やり直さないよう、リサイズ済みの uint8 配列 (H, W, 3) を保存する。
+前処理設定ごとのディレクトリに、固定長レコードを追記する1つの配列ファイル
+（data.bin）と、画像ハッシュ → レコード番号のインデックス（index.tsv）を置き、
+読み出しは numpy.memmap で行う（AppendOnlyArrayStore は特徴量ストアでも使用）。
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from .upload_handlers import hash_file
+
+logger = logging.getLogger(__name__)
+
+
+class AppendOnlyArrayStore:
+    """キー → 固定長レコードの追記型配列ストア
+
+    1つの配列ファイル（data.bin）にレコードを追記し、キー → レコード番号の
+    インデックス（index.tsv）で参照する。読み出しは numpy.memmap で行い、
+    追記は複数プロセスからでもファイルロックで直列化する。
+    """
+
+    def __init__(self, directory, record_shape: Tuple[int, ...], dtype=np.uint8):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+        self.record_shape = tuple(record_shape)
+        self.dtype = np.dtype(dtype)
+        self.record_size = int(np.prod(self.record_shape)) * self.dtype.itemsize
+
+        self.data_path = self.directory / 'data.bin'
+        self.index_path = self.directory / 'index.tsv'
+        self.lock_path = self.directory / '.lock'
+
+        self._index = {}
+        self._index_offset = 0
+        self._mapped = None
+        self._mapped_rows = 0
+        self._lock = threading.Lock()
+        self._reload_index()
+
+    def __len__(self):
+        with self._lock:
+            self._reload_index()
+            return len(self._index)
+
+    def __contains__(self, key: str):
+        return self.get_row(key) is not None
+
+    def get_row(self, key: str) -> Optional[int]:
+        """キーに対応するレコード番号"""
+        with self._lock:
+            row = self._index.get(key)
+            if row is None:
+                # 他プロセスが追記した分を読み込む
+                self._reload_index()
+                row = self._index.get(key)
+            return row
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        """レコードを取得（memmap のビュー）"""
+        row = self.get_row(key)
+        if row is None:
+            return None
+        return self._map(row + 1)[row]
+
+    def get_many(self, keys: List[str]) -> Tuple[np.ndarray, List[bool]]:
+        """複数のレコードをまとめて取得（未登録分はゼロで埋める）"""
+        rows = [self.get_row(key) for key in keys]
+        found = [row is not None for row in rows]
+        batch = np.zeros((len(rows),) + self.record_shape, dtype=self.dtype)
+        if any(found):
+            mapped = self._map(max(row for row in rows if row is not None) + 1)
+            indices = [i for i, ok in enumerate(found) if ok]
+            batch[indices] = mapped[[rows[i] for i in indices]]
+        return batch, found
+
+    def put(self, key: str, array: np.ndarray) -> int:
+        """レコードを追記してレコード番号を返す"""
+        return self.put_many([key], np.asarray(array)[None])[0]
+
+    def put_many(self, keys: List[str], arrays: np.ndarray) -> List[int]:
+        """複数のレコードを一度に追記（登録済みのキーは追記しない）"""
+        arrays = np.ascontiguousarray(arrays, dtype=self.dtype)
+        if arrays.shape[1:] != self.record_shape:
+            raise ValueError(f"Expected array of shape {self.record_shape}, got {arrays.shape[1:]}")
+
+        with self._lock, open(self.lock_path, 'a') as lock_file:
+            _lock_file(lock_file)
+            try:
+                self._truncate_torn_writes()
+                self._reload_index()
+                new = [i for i, key in enumerate(keys) if key not in self._index]
+                new = [i for n, i in enumerate(new) if keys[i] not in {keys[j] for j in new[:n]}]
+                if new:
+                    with open(self.data_path, 'ab') as data_file:
+                        first_row = data_file.tell() // self.record_size
+                        data_file.write(arrays[new].data)
+                    with open(self.index_path, 'a') as index_file:
+                        index_file.writelines(f"{keys[i]}\t{first_row + n}\n" for n, i in enumerate(new))
+                    self._reload_index()
+                return [self._index[key] for key in keys]
+            finally:
+                _unlock_file(lock_file)
+
+    def iter_batches(self, batch_size: int = 64) -> Iterator[Tuple[List[str], np.ndarray]]:
+        """全レコードを (キー一覧, 配列バッチ) として順に読み出し"""
+        with self._lock:
+            self._reload_index()
+            entries = sorted(self._index.items(), key=lambda item: item[1])
+        if not entries:
+            return
+        mapped = self._map(entries[-1][1] + 1)
+        for start in range(0, len(entries), batch_size):
+            chunk = entries[start:start + batch_size]
+            first, last = chunk[0][1], chunk[-1][1]
+            if last - first + 1 == len(chunk):
+                # 連続したレコードはスライスで読み出し（コピーなし）
+                batch = mapped[first:last + 1]
+            else:
+                batch = mapped[[row for _, row in chunk]]
+            yield [key for key, _ in chunk], batch
+
+    def stats(self) -> Dict:
+        size = self.data_path.stat().st_size if self.data_path.exists() else 0
+        return {
+            'directory': str(self.directory),
+            'entries': len(self),
+            'data_bytes': size,
+        }
+
+    def _truncate_torn_writes(self):
+        """追記中に停止したプロセスが残した不完全なレコード・インデックス行を切り詰める
+
+        ファイルロック取得中に呼ぶ（他に書き込み中のプロセスはいないため、
+        末尾の不完全な部分は二度と完成しない）。
+        """
+        if self.data_path.exists():
+            size = os.path.getsize(self.data_path)
+            if size % self.record_size:
+                logger.warning(f"Truncating torn record in {self.data_path}")
+                os.truncate(self.data_path, size - size % self.record_size)
+        if self.index_path.exists():
+            with open(self.index_path, 'rb+') as f:
+                end = f.seek(0, os.SEEK_END)
+                position = end
+                while position > 0:
+                    start = max(0, position - 4096)
+                    f.seek(start)
+                    newline = f.read(position - start).rfind(b'\n')
+                    if newline >= 0:
+                        position = start + newline + 1
+                        break
+                    position = start
+                if position < end:
+                    logger.warning(f"Truncating torn index line in {self.index_path}")
+                    f.truncate(position)
+
+    def _reload_index(self):
+        """インデックスファイルの未読部分を読み込む"""
+        if not self.index_path.exists():
+            return
+        with open(self.index_path, 'r') as f:
+            f.seek(self._index_offset)
+            for line in f:
+                if not line.endswith('\n'):
+                    # 書き込み途中の行は次回に読む
+                    break
+                self._index_offset += len(line.encode())
+                try:
+                    key, row = line.rstrip('\n').split('\t')
+                    self._index[key] = int(row)
+                except ValueError:
+                    logger.warning(f"Skipping malformed index line in {self.index_path}: {line!r}")
+
+    def _map(self, min_rows: int) -> np.memmap:
+        """配列ファイルを memmap（追記で行数が増えていれば再マップ）"""
+        with self._lock:
+            if self._mapped is None or self._mapped_rows < min_rows:
+                rows = os.path.getsize(self.data_path) // self.record_size
+                self._mapped = np.memmap(self.data_path, dtype=self.dtype, mode='r',
+                                         shape=(rows,) + self.record_shape)
+                self._mapped_rows = rows
+            return self._mapped
+
+
+class PreprocessedTensorCache(AppendOnlyArrayStore):
+    """前処理済み uint8 テンソルの追記型キャッシュ（キーは画像ハッシュ）"""
+
+    def __init__(self, directory, preprocess_config: Dict):
+        config_json = json.dumps(preprocess_config, sort_keys=True)
+        self.config_key = hashlib.sha1(config_json.encode()).hexdigest()[:12]
+        height, width = preprocess_config['input_size']
+        super().__init__(Path(directory) / self.config_key, (height, width, 3), np.uint8)
+        (self.directory / 'config.json').write_text(config_json)
+
+    def get_or_compute(self, image_hash: str, compute) -> np.ndarray:
+        """キャッシュがあれば取得、なければ compute() の結果を保存して返す"""
+        array = self.get(image_hash)
+        if array is None:
+            array = compute()
+            self.put(image_hash, array)
+        return array
+
+    def stats(self) -> Dict:
+        stats = super().stats()
+        stats['config_key'] = self.config_key
+        return stats
+
+
+def _lock_file(f):
+    try:
+        import fcntl
+        fcntl.flock(f, fcntl.LOCK_EX)
+    except ImportError:
+        pass
+
+
+def _unlock_file(f):
+    try:
+        import fcntl
+        fcntl.flock(f, fcntl.LOCK_UN)
+    except ImportError:
+        pass
+
+
+def get_upload_array(classifier, image_upload, cache: Optional[PreprocessedTensorCache] = None) -> np.ndarray:
+    """保存済みアップロード画像の前処理済み配列を取得（キャッシュがあれば再デコードしない）"""
+    from .image_decoding import decode_image
+
+    def compute():
+        with image_upload.image.open('rb') as f:
+            image, _ = decode_image(f, target_size=classifier.input_size)
+        return classifier.prepare_image(image)
+
+    if cache is None:
+        return compute()
+    with image_upload.image.open('rb') as f:
+        image_hash = hash_file(f)
+    return cache.get_or_compute(image_hash, compute)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_tensor_cache(preprocess_config: Dict) -> Optional[PreprocessedTensorCache]:
+    """前処理設定に対応するキャッシュを取得（無効時は None）"""
+    config = getattr(settings, 'INFERENCE_TENSOR_CACHE', {})
+    if not config.get('ENABLED', False):
+        return None
+    key = json.dumps(preprocess_config, sort_keys=True)
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = PreprocessedTensorCache(config['DIRECTORY'], preprocess_config)
+        return _caches[key]
@@ -1,3 +1,1937 @@
-from django.test import TestCase
+import io
+import os
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from .models import MLApp, PredictionLog
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+class ImportTimeTests(SimpleTestCase):
+    """管理コマンド起動時のimport時間の回帰テスト"""
+
+    # manage.py check 全体のimport時間の上限（秒）
+    IMPORT_TIME_BUDGET = 1.5
+    # 推論時にのみ読み込むべきモジュール
+    LAZY_MODULES = ('torch', 'torchvision', 'numpy')
+
+    def run_with_importtime(self, *args):
+        env = dict(os.environ, INFERENCE_WARMUP='0')
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', 'manage.py', *args],
+            cwd=BACKEND_DIR, env=env, capture_output=True, text=True, timeout=120
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+
+        modules = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, _, name = line[len('import time:'):].split('|')
+            modules[name.strip()] = int(self_us)
+        return modules
+
+    def test_check_does_not_import_ml_stack(self):
+        modules = self.run_with_importtime('check')
+        self.assertIn('inference.views', modules)
+        for name in self.LAZY_MODULES:
+            self.assertNotIn(name, modules, f'{name} is imported by manage.py check')
+
+    def test_check_import_time_within_budget(self):
+        modules = self.run_with_importtime('check')
+        total = sum(modules.values()) / 1e6
+        self.assertLess(total, self.IMPORT_TIME_BUDGET,
+                        f'manage.py check imports took {total:.2f}s')
+
+
+class ModelRegistryReloadTests(SimpleTestCase):
+    """モデルのホットリロードの失敗時の動作"""
+
+    def setUp(self):
+        from .model_registry import ModelRegistry
+
+        self.registry = ModelRegistry()
+        self.addCleanup(self.registry.reset)
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = Path(tmpdir.name)
+
+    def test_missing_checkpoint_raises(self):
+        from .cuda_inference import CUDAImageClassifier
+
+        with self.assertRaises(FileNotFoundError):
+            CUDAImageClassifier(model_path=str(self.tmpdir / 'missing.pth'), device_type='cpu')
+
+    def test_bad_checkpoint_keeps_previous_model(self):
+        ml_app = MLApp(pk=1, name='demo', device_type='cpu')
+        previous = self.registry.get_classifier(ml_app)
+
+        bad_checkpoint = self.tmpdir / 'model.pth'
+        bad_checkpoint.write_bytes(b'not a checkpoint')
+        ml_app.model_file_path = str(bad_checkpoint)
+        thread = self.registry.schedule_reload(ml_app, force=True)
+        thread.join(timeout=60)
+
+        # 旧モデルで応答を続け、失敗したバージョンは再試行しない
+        self.assertIs(self.registry.get_classifier(ml_app), previous)
+        status = self.registry.status(ml_app)
+        self.assertEqual(status['active'][1]['model_version'], 'default')
+        self.assertEqual(status['loading'], {})
+        self.assertEqual(status['events'][-1]['event'], 'failed')
+        self.assertEqual(status['events'][-1]['model_version'], ml_app.get_model_version())
+
+
+class ModelRegistryRetireTests(SimpleTestCase):
+    """切り替え済みモデルの解放（カスケードの構成要素の共有）"""
+
+    options = {'device_type': 'cpu', 'precision': 'fp32', 'channels_last': True, 'model_path': '/models/full.pth'}
+
+    def setUp(self):
+        import types
+        from . import cuda_inference
+        from .model_registry import ModelRegistry
+
+        self.registry = ModelRegistry()
+        self.enterContext(mock.patch.dict(cuda_inference._classifier_instances, clear=True))
+        for path in ('/models/full.pth', '/models/fast.pth', '/models/fast-v2.pth'):
+            # 読み込みの代わりにスタブをキャッシュに置く
+            for version in ('v1', None):
+                classifier = StubClassifier()
+                classifier.device = types.SimpleNamespace(type='cpu')
+                cuda_inference._classifier_instances[
+                    cuda_inference._classifier_key(model_version=version, **dict(self.options, model_path=path))
+                ] = classifier
+
+    def key(self, cascade=None):
+        import json
+
+        options = dict(self.options)
+        if cascade:
+            options['cascade'] = json.dumps(cascade, sort_keys=True)
+        return tuple(sorted(options.items())), 'v1'
+
+    def swap(self, old, new):
+        """old から new に切り替えた後、キャッシュに残っているモデルのパスとバージョン"""
+        from . import cuda_inference
+
+        self.registry._active = {1: self.registry._make_entry(new, None)}
+        self.registry._retire(self.registry._make_entry(old, None))
+        return sorted((key[3], key[4] or '') for key in cuda_inference._classifier_instances)
+
+    def test_threshold_change_keeps_both_models(self):
+        remaining = self.swap(self.key({'model_file_path': '/models/fast.pth', 'threshold': 0.8}),
+                              self.key({'model_file_path': '/models/fast.pth', 'threshold': 0.9}))
+        self.assertIn(('/models/full.pth', 'v1'), remaining)
+        self.assertIn(('/models/fast.pth', ''), remaining)
+
+    def test_switch_to_cascade_keeps_full_model(self):
+        remaining = self.swap(self.key(), self.key({'model_file_path': '/models/fast.pth'}))
+        self.assertIn(('/models/full.pth', 'v1'), remaining)
+
+    def test_removed_cascade_releases_fast_model(self):
+        remaining = self.swap(self.key({'model_file_path': '/models/fast.pth'}), self.key())
+        self.assertIn(('/models/full.pth', 'v1'), remaining)
+        self.assertNotIn(('/models/fast.pth', ''), remaining)
+        self.assertEqual(self.registry.status()['draining'], 0)
+
+    def test_replaced_fast_model_is_released(self):
+        remaining = self.swap(self.key({'model_file_path': '/models/fast.pth'}),
+                              self.key({'model_file_path': '/models/fast-v2.pth'}))
+        self.assertIn(('/models/full.pth', 'v1'), remaining)
+        self.assertIn(('/models/fast-v2.pth', ''), remaining)
+        self.assertNotIn(('/models/fast.pth', ''), remaining)
+
+
+class DeviceFingerprintTests(SimpleTestCase):
+    """バッチサイズ自動調整のデバイス識別子"""
+
+    def setUp(self):
+        from . import autotune
+
+        self.autotune = autotune
+        autotune._fingerprints.clear()
+        self.addCleanup(autotune._fingerprints.clear)
+
+    def test_fingerprint_is_computed_once_per_options(self):
+        options = {'device_type': 'cpu', 'precision': 'fp32', 'channels_last': True, 'model_path': None}
+        with mock.patch.object(self.autotune, '_cpu_model_name', return_value='Test CPU') as cpu_model_name:
+            first = self.autotune.get_device_fingerprint(options)
+            second = self.autotune.get_device_fingerprint(dict(options, model_path='/models/other.pth'))
+            other = self.autotune.get_device_fingerprint(dict(options, channels_last=False))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first[0], other[0])
+        self.assertEqual(cpu_model_name.call_count, 2)
+
+
+def make_jpeg(size=(64, 48), direction='horizontal', quality=90) -> bytes:
+    """輝度が一方向に変化するテスト用の JPEG"""
+    width, height = size
+    image = Image.new('RGB', size)
+    image.putdata([
+        ((x * 255 // width if direction == 'horizontal' else y * 255 // height),) * 3
+        for y in range(height) for x in range(width)
+    ])
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+class NearDuplicateIndexTests(SimpleTestCase):
+    """知覚ハッシュのマルチインデックス検索"""
+
+    def test_chunks_cover_all_bits(self):
+        from .perceptual_hash import HASH_BITS, MultiIndexHashIndex
+
+        index = MultiIndexHashIndex(max_distance=4)
+        self.assertEqual(len(index._chunks), 5)
+        # 区間は重ならずに 64 ビットを覆う
+        covered = 0
+        for start, mask in index._chunks:
+            self.assertEqual(covered & (mask << start), 0)
+            covered |= mask << start
+        self.assertEqual(covered, (1 << HASH_BITS) - 1)
+
+    def test_query_within_distance_threshold(self):
+        from .perceptual_hash import MultiIndexHashIndex
+
+        index = MultiIndexHashIndex(max_distance=4)
+        base = 0x0123456789abcdef
+        index.add(base, 'base')
+        # 1区間に集中した差分・全区間に分散した差分のどちらも閾値以内なら一致
+        self.assertEqual(index.query(base ^ 0b1111), ('base', 4))
+        spread = base ^ (1 << 0) ^ (1 << 20) ^ (1 << 40) ^ (1 << 63)
+        self.assertEqual(index.query(spread), ('base', 4))
+        self.assertIsNone(index.query(base ^ 0b11111))
+        self.assertEqual(index.stats()['hits'], 2)
+
+    def test_query_returns_nearest(self):
+        from .perceptual_hash import MultiIndexHashIndex
+
+        index = MultiIndexHashIndex(max_distance=4)
+        index.add(0, 'far')
+        index.add(0b111, 'near')
+        self.assertEqual(index.query(0b1111), ('near', 1))
+
+    def test_evicts_least_recently_used(self):
+        from .perceptual_hash import MultiIndexHashIndex
+
+        index = MultiIndexHashIndex(max_distance=2, capacity=2)
+        a, b, c = 0, (1 << 64) - 1, (1 << 32) - 1
+        index.add(a, 'a')
+        index.add(b, 'b')
+        index.query(a)
+        index.add(c, 'c')
+        self.assertEqual(len(index), 2)
+        self.assertIsNone(index.query(b))
+        self.assertEqual(index.query(a), ('a', 0))
+        # 削除したハッシュは区間ごとの辞書からも外す
+        self.assertFalse(any(b in bucket for table in index._tables for bucket in table.values()))
+
+
+class StubClassifier:
+    """推論した画像の枚数を記録する分類器"""
+
+    device = 'cpu'
+
+    def __init__(self):
+        self.predicted = 0
+
+    def predict_batch(self, images, batch_size=8, top_k=None, min_confidence=None):
+        self.predicted += len(images)
+        return [self.result() for _ in images]
+
+    def prepare_image(self, image):
+        import numpy as np
+
+        return np.asarray(image.convert('RGB').resize((8, 8)))
+
+    def predict_arrays(self, arrays, top_k=None, min_confidence=None):
+        self.predicted += len(arrays)
+        return [self.result() for _ in arrays]
+
+    def result(self):
+        return {
+            'predicted_class': 'cat',
+            'confidence': 0.9,
+            'class_probabilities': {'cat': 0.9, 'dog': 0.1},
+            'processing_time': 0.01,
+            'device': self.device,
+        }
+
+
+class PredictBatchNearDuplicateTests(TestCase):
+    """バッチ推論での近似重複画像の推論結果の再利用"""
+
+    def setUp(self):
+        from . import perceptual_hash
+
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.addCleanup(perceptual_hash._indexes.clear)
+        self.classifier = StubClassifier()
+        self.enterContext(mock.patch('inference.views.get_app_classifier', return_value=self.classifier))
+        self.ml_app = MLApp.objects.create(
+            name='demo', description='demo', device_type='cpu',
+            model_optimization={'near_duplicate': {'max_distance': 4}},
+        )
+        self.client = APIClient()
+
+    def post_batch(self, *images, **options):
+        files = [SimpleUploadedFile(f'{i}.jpg', data, content_type='image/jpeg') for i, data in enumerate(images)]
+        response = self.client.post(f'/api/ml-apps/{self.ml_app.pk}/predict_batch/', dict(options, images=files),
+                                    format='multipart')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['results']
+
+    def test_reuses_near_duplicates_and_predicts_misses(self):
+        first = self.post_batch(make_jpeg(direction='horizontal'))
+        self.assertEqual(self.classifier.predicted, 1)
+        self.assertIsNone(first[0]['near_duplicate'])
+
+        # 再エンコード・リサイズした画像は再利用し、新しい画像のみ推論
+        results = self.post_batch(make_jpeg((128, 96), 'horizontal', quality=60), make_jpeg(direction='vertical'))
+        self.assertEqual(self.classifier.predicted, 2)
+        self.assertEqual(results[0]['near_duplicate']['prediction_id'], first[0]['prediction_id'])
+        self.assertIsNone(results[1]['near_duplicate'])
+        self.assertEqual(PredictionLog.objects.count(), 3)
+
+    def test_output_options_share_one_index(self):
+        from . import perceptual_hash
+
+        first, = self.post_batch(make_jpeg(direction='horizontal'), top_k=1)
+        self.assertEqual(first['class_probabilities'], {'cat': 0.9})
+        # 出力オプションの値ごとにインデックスを作らず、保存した全クラスの確率に適用
+        for min_confidence in ('0.05', '0.5', '0.123456'):
+            result, = self.post_batch(make_jpeg(direction='horizontal'), min_confidence=min_confidence)
+            self.assertEqual(result['near_duplicate']['prediction_id'], first['prediction_id'])
+            expected = {name: p for name, p in {'cat': 0.9, 'dog': 0.1}.items() if p >= float(min_confidence)}
+            self.assertEqual(result['class_probabilities'], expected)
+        self.assertEqual(self.classifier.predicted, 1)
+        self.assertEqual(len(perceptual_hash._indexes), 1)
+
+    def test_apply_output_options(self):
+        from .perceptual_hash import apply_output_options
+
+        result = {'predicted_class': 'b', 'confidence': 0.6,
+                  'class_probabilities': {'a': 0.1, 'b': 0.6, 'c': 0.3}}
+        self.assertIs(apply_output_options(result), result)
+        self.assertEqual(list(apply_output_options(result, top_k=2)['class_probabilities']), ['b', 'c'])
+        self.assertEqual(apply_output_options(result, top_k=2, min_confidence=0.5)['class_probabilities'], {'b': 0.6})
+        self.assertEqual(apply_output_options(result, min_confidence=0.9)['class_probabilities'], {})
+        self.assertEqual(result['class_probabilities'], {'a': 0.1, 'b': 0.6, 'c': 0.3})
+
+
+class BatchedMulticlassNMSTests(SimpleTestCase):
+    """バッチ全体の NMS を画像ごとの torchvision.ops.batched_nms と比較"""
+
+    def make_inputs(self, num_images, num_anchors, num_classes, seed=0):
+        import torch
+
+        generator = torch.Generator().manual_seed(seed)
+        corners = torch.rand(num_images, num_anchors, 2, generator=generator) * 300
+        sizes = torch.rand(num_images, num_anchors, 2, generator=generator) * 60 + 1
+        boxes = torch.cat([corners, corners + sizes], dim=-1)
+        scores = torch.rand(num_images, num_anchors, num_classes, generator=generator)
+        return boxes, scores
+
+    def reference(self, boxes, scores, score_threshold, iou_threshold, max_detections, pre_nms_top_k):
+        import torch
+        from torchvision.ops import batched_nms
+
+        num_images, num_anchors, num_classes = scores.shape
+        outputs = []
+        for i in range(num_images):
+            top_scores, top_indices = scores[i].reshape(-1).topk(min(pre_nms_top_k, num_anchors * num_classes))
+            mask = top_scores > score_threshold
+            top_scores, top_indices = top_scores[mask], top_indices[mask]
+            candidate_boxes = boxes[i][top_indices // num_classes]
+            labels = top_indices % num_classes
+            keep = batched_nms(candidate_boxes, top_scores, labels, iou_threshold)[:max_detections]
+            outputs.append((torch.full((len(keep),), i), candidate_boxes[keep], top_scores[keep], labels[keep]))
+        return [torch.cat(values) for values in zip(*outputs)]
+
+    def assert_matches_reference(self, boxes, scores, **params):
+        import torch
+        from .detection import batched_multiclass_nms
+
+        result = batched_multiclass_nms(boxes, scores, **params)
+        expected = self.reference(boxes, scores, **params)
+        for actual, wanted in zip(result, expected):
+            torch.testing.assert_close(actual, wanted.to(actual.dtype))
+
+    def test_offset_groups_in_single_nms(self):
+        from torchvision.ops import nms
+        from . import detection
+
+        boxes, scores = self.make_inputs(num_images=3, num_anchors=200, num_classes=4)
+        params = dict(score_threshold=0.5, iou_threshold=0.3, max_detections=40, pre_nms_top_k=300)
+        with mock.patch.object(detection, 'nms', wraps=nms) as nms_calls:
+            self.assert_matches_reference(boxes, scores, **params)
+        self.assertEqual(nms_calls.call_count, 1)
+
+    def test_per_image_fallback_above_cpu_limit(self):
+        from torchvision.ops import nms
+        from . import detection
+
+        boxes, scores = self.make_inputs(num_images=2, num_anchors=1500, num_classes=3, seed=1)
+        params = dict(score_threshold=0.0, iou_threshold=0.5, max_detections=100, pre_nms_top_k=3000)
+        self.assertGreater(2 * 3000, detection.CPU_NMS_MAX_BOXES)
+        with mock.patch.object(detection, 'nms', wraps=nms) as nms_calls:
+            self.assert_matches_reference(boxes, scores, **params)
+        self.assertEqual(nms_calls.call_count, 2)
+
+    def test_no_candidates_above_threshold(self):
+        from .detection import batched_multiclass_nms
+
+        boxes, scores = self.make_inputs(num_images=2, num_anchors=10, num_classes=2)
+        image_indices, kept_boxes, kept_scores, labels = batched_multiclass_nms(
+            boxes, scores * 0.1, score_threshold=0.5, iou_threshold=0.5, max_detections=10, pre_nms_top_k=20
+        )
+        self.assertEqual(len(image_indices), 0)
+        self.assertEqual(tuple(kept_boxes.shape), (0, 4))
+
+    def test_negative_coordinates_do_not_cross_groups(self):
+        import torch
+        from .detection import batched_multiclass_nms
+
+        # 座標の最大値だけでずらすと、クラス1のボックスがクラス0のボックスと同じ位置に重なる
+        boxes = torch.tensor([[[-20., -20, 0, 0], [-31, -31, -11, -11], [0, 0, 10, 10]]])
+        scores = torch.tensor([[[0.9, 0.0], [0.0, 0.8], [0.7, 0.0]]])
+        image_indices, kept_boxes, kept_scores, labels = batched_multiclass_nms(
+            boxes, scores, score_threshold=0.5, iou_threshold=0.5, max_detections=10, pre_nms_top_k=6
+        )
+        self.assertEqual([round(score, 2) for score in kept_scores.tolist()], [0.9, 0.8, 0.7])
+        self.assertEqual(labels.tolist(), [0, 1, 0])
+
+    def test_detector_boxes_are_clipped_to_input(self):
+        import numpy as np
+        from torchvision.models.detection import ssdlite320_mobilenet_v3_large
+        from .detection import CUDAObjectDetector
+
+        def offline(weights=None, **kwargs):
+            # 学習済みの重みは取得せず、未学習のモデルで代用
+            if weights is not None:
+                raise RuntimeError('offline')
+            return ssdlite320_mobilenet_v3_large(weights=None, **kwargs)
+
+        with mock.patch('inference.detection.ssdlite320_mobilenet_v3_large', side_effect=offline), \
+                self.assertLogs('inference.detection', 'WARNING'):
+            detector = CUDAObjectDetector(device_type='cpu')
+        boxes, _ = detector._forward(detector.tensor_from_arrays(np.zeros((1, 320, 320, 3), np.uint8)))
+        self.assertGreaterEqual(float(boxes.min()), 0.0)
+        self.assertLessEqual(float(boxes.max()), 320.0)
+
+    def test_match_detections_by_image_and_class(self):
+        import torch
+        from .detection import _match_detections
+
+        reference = (torch.tensor([0, 0, 1]), torch.tensor([[0., 0, 10, 10], [20, 20, 30, 30], [0, 0, 10, 10]]),
+                     torch.tensor([0.9, 0.8, 0.7]), torch.tensor([1, 2, 1]))
+        # 2件目は同じ位置の検出のクラスが異なり、3件目は同じ画像に検出がないため対応付けない
+        detections = (torch.tensor([0, 0, 0]), torch.tensor([[0., 0, 10, 11], [20, 20, 30, 30], [0, 0, 10, 10]]),
+                      torch.tensor([0.85, 0.8, 0.7]), torch.tensor([1, 3, 2]))
+        result = _match_detections(reference, detections, iou_threshold=0.5)
+        self.assertAlmostEqual(result['matched_ratio'], 1 / 3)
+        self.assertAlmostEqual(result['max_abs_score_diff'], 0.05, places=5)
+
+
+class EmbeddingKeyTests(SimpleTestCase):
+    """埋め込みストアのキーとヘッドの再学習"""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = Path(tmpdir.name)
+
+    def test_key_survives_head_retraining(self):
+        import torch
+        from .cuda_inference import CUDAImageClassifier
+        from .embedding_store import get_embedding_key
+        from .head_training import save_head_checkpoint
+
+        base = CUDAImageClassifier(device_type='cpu')
+        linear = base.model.classifier[1]
+        path = save_head_checkpoint(
+            base.model, torch.randn(3, linear.in_features), torch.zeros(3), ['a', 'b', 'c'],
+            self.tmpdir / 'head' / 'model.pth',
+        )
+        retrained = CUDAImageClassifier(model_path=str(path), device_type='cpu')
+        self.assertEqual(retrained.classes, ['a', 'b', 'c'])
+        self.assertEqual(get_embedding_key(retrained), get_embedding_key(base))
+
+        # バックボーンの重みが異なれば別のストア
+        with torch.no_grad():
+            retrained.model.features[0][0].weight.add_(1)
+        retrained._backbone_fingerprint = None
+        self.assertNotEqual(get_embedding_key(retrained), get_embedding_key(base))
+
+    def test_train_linear_head_reports_iterations(self):
+        import numpy as np
+        import torch
+        from .head_training import evaluate_head, train_linear_head
+
+        rng = np.random.default_rng(0)
+        labels = rng.integers(0, 2, 64)
+        features = rng.normal(size=(64, 8)).astype(np.float32)
+        features[:, 0] += np.where(labels == 1, 3, -3)
+        result = train_linear_head(features, labels, np.ones(64, dtype=bool), torch.zeros(2, 8), torch.zeros(2))
+        self.assertGreater(result['iterations'], 0)
+        self.assertLess(result['final_loss'], result['initial_loss'])
+        accuracy = evaluate_head(result['weight'], result['bias'], features, labels, np.ones(64, dtype=bool))['accuracy']
+        self.assertGreater(accuracy, 0.9)
+
+
+class SharedBackboneTests(SimpleTestCase):
+    """共有バックボーンのワーカー経由の推論"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        from .multihead import MultiHeadEngine
+
+        cls.engine = MultiHeadEngine(device_type='cpu', result_timeout=10)
+        cls.classifier = cls.engine.get_head_classifier()
+
+    def dummy_arrays(self, count=1):
+        import numpy as np
+
+        return np.zeros((count, 224, 224, 3), dtype=np.uint8)
+
+    def test_timeout_when_worker_stalls(self):
+        import threading
+
+        release = threading.Event()
+        with mock.patch.object(self.engine, 'result_timeout', 0.2), \
+                mock.patch.object(self.engine, '_process', side_effect=lambda items: release.wait(5)):
+            with self.assertRaises(TimeoutError):
+                self.classifier.predict_arrays(self.dummy_arrays())
+            # ワーカーが処理中の間に待機を諦めた要求は、後から推論されない
+            with self.assertRaises(TimeoutError):
+                self.classifier.predict_arrays(self.dummy_arrays())
+            release.set()
+        self.assertEqual(len(self.classifier.predict_arrays(self.dummy_arrays(2))), 2)
+        self.assertGreaterEqual(self.engine.stats()['timeouts'], 2)
+
+    def test_benchmark_uses_shared_path(self):
+        requests = self.engine.stats()['requests']
+        result = self.classifier.benchmark(num_iterations=5)
+        self.assertEqual(result['iterations'], 5)
+        self.assertEqual(self.engine.stats()['requests'] - requests, 15)
+
+    def test_validate_precision_uses_head(self):
+        result = self.classifier.validate_precision(num_samples=2, num_iterations=1)
+        self.assertTrue(result['shared_backbone'])
+        self.assertEqual(result['results']['fp32']['top1_agreement'], 1.0)
+        self.assertEqual(result['results']['fp32']['max_abs_prob_diff'], 0.0)
+
+    def save_checkpoint(self, state, classes):
+        import json
+        import torch
+
+        directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        torch.save({'model_type': 'mobilenet_v2', 'model_state_dict': state}, directory / 'model.pth')
+        (directory / 'model_info.json').write_text(json.dumps({'classes': classes}))
+        return str(directory / 'model.pth')
+
+    def head_state(self, num_classes=3):
+        import torch
+
+        torch.manual_seed(0)
+        return {'classifier.1.weight': torch.randn(num_classes, 1280), 'classifier.1.bias': torch.zeros(num_classes)}
+
+    def test_head_with_shared_backbone_weights_is_attached(self):
+        state = {k: v for k, v in self.engine.base.model.state_dict().items() if not k.startswith('classifier.')}
+        state.update(self.head_state())
+        for checkpoint in (state, self.head_state()):
+            # バックボーンが同じチェックポイントとヘッドのみのチェックポイント
+            path = self.save_checkpoint(checkpoint, ['a', 'b', 'c'])
+            classifier = self.engine.get_head_classifier(path, 'v1')
+            self.addCleanup(self.engine.release_head, path, 'v1')
+            self.assertEqual(classifier.classes, ['a', 'b', 'c'])
+            self.assertIn(classifier.predict_arrays(self.dummy_arrays())[0]['predicted_class'], ['a', 'b', 'c'])
+
+    def test_fine_tuned_backbone_is_rejected(self):
+        state = {k: v.clone() for k, v in self.engine.base.model.state_dict().items()}
+        state.update(self.head_state())
+        name = next(k for k, v in state.items() if v.is_floating_point() and not k.startswith('classifier.'))
+        state[name] += 0.01
+        path = self.save_checkpoint(state, ['a', 'b', 'c'])
+        with self.assertRaisesMessage(ValueError, 'differs from the shared backbone'):
+            self.engine.get_head_classifier(path, 'v1')
+        self.assertNotIn((path, 'v1'), self.engine._heads)
+
+    def test_class_count_mismatch_is_rejected(self):
+        path = self.save_checkpoint(self.head_state(3), ['a', 'b'])
+        with self.assertRaisesMessage(ValueError, '3 outputs but 2 classes'):
+            self.engine.get_head_classifier(path, 'v1')
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    """優先度付き待ち行列による同時実行数制御"""
+
+    def make_controller(self, max_concurrency=1, per_app_concurrency=4, max_queue=8, app_limits=None):
+        from .admission import AdmissionController
+
+        return AdmissionController(max_concurrency, per_app_concurrency, max_queue, app_limits)
+
+    def acquire_in_thread(self, controller, app_id, priority_name, timeout=None, wait=True):
+        """別スレッドで acquire し、待ち行列に入るまで待つ（結果は outcome['ticket'] / ['error']）"""
+        import threading
+        import time
+
+        outcome = {}
+        queued = controller.stats()['queued']
+
+        def run():
+            try:
+                outcome['ticket'] = controller.acquire(app_id, priority_name, timeout=timeout)
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        deadline = time.monotonic() + 5
+        while wait and controller.stats()['queued'] == queued and not outcome and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return thread, outcome
+
+    def test_per_app_concurrency(self):
+        controller = self.make_controller(max_concurrency=3, per_app_concurrency=1, app_limits={'c': 2})
+        first = controller.acquire('a')
+        thread, outcome = self.acquire_in_thread(controller, 'a', 'interactive')
+        self.assertEqual(controller.stats()['queued'], 1)
+
+        # 上限に達したアプリの待機中リクエストは他のアプリを妨げない
+        other = controller.acquire('b')
+        self.assertEqual(controller.stats()['active'], 2)
+
+        controller.release(first)
+        thread.join(5)
+        self.assertIn('ticket', outcome)
+        for ticket in (other, outcome['ticket']):
+            controller.release(ticket)
+
+        # アプリ個別の上限
+        tickets = [controller.acquire('c'), controller.acquire('c')]
+        thread, outcome = self.acquire_in_thread(controller, 'c', 'interactive')
+        self.assertEqual(controller.stats()['queued'], 1)
+        controller.release(tickets.pop())
+        thread.join(5)
+        self.assertIn('ticket', outcome)
+
+    def test_higher_priority_evicts_lower_priority_waiter(self):
+        from .admission import AdmissionRejected
+
+        controller = self.make_controller(max_queue=1)
+        running = controller.acquire('a')
+        background, background_outcome = self.acquire_in_thread(controller, 'a', 'background')
+        # 待ち行列の件数は変わらないため、追い出された側の終了を待つ
+        interactive, interactive_outcome = self.acquire_in_thread(controller, 'a', 'interactive', wait=False)
+
+        background.join(5)
+        self.assertIsInstance(background_outcome['error'], AdmissionRejected)
+        self.assertIn('Preempted', background_outcome['error'].reason)
+
+        # 同じ優先度では追い出さず、満杯のため即座に拒否
+        with self.assertRaises(AdmissionRejected) as rejected:
+            controller.acquire('a', 'interactive')
+        self.assertEqual(rejected.exception.reason, 'Inference queue is full')
+
+        controller.release(running)
+        interactive.join(5)
+        self.assertIn('ticket', interactive_outcome)
+        stats = controller.stats()['priorities']
+        self.assertEqual(stats['background']['shed_evicted'], 1)
+        self.assertEqual(stats['interactive']['shed_queue_full'], 1)
+        self.assertEqual(stats['interactive']['queued'], 1)
+
+    def test_sheds_requests_that_cannot_meet_deadline(self):
+        from .admission import AdmissionRejected
+
+        controller = self.make_controller()
+        # 処理時間の平均を 1.5 秒にする
+        ticket = controller.acquire('a')
+        ticket.started_at -= 1.5
+        controller.release(ticket)
+        self.assertAlmostEqual(controller.stats()['service_time']['interactive'], 1.5, places=1)
+
+        running = controller.acquire('a')
+        with self.assertRaises(AdmissionRejected) as rejected:
+            controller.acquire('a', timeout=1.0)
+        # 実行中の残り（平均の半分）+ 自身の処理時間 = 2.25 秒
+        self.assertEqual(rejected.exception.retry_after, 3)
+        self.assertEqual(controller.stats()['queued'], 0)
+        self.assertEqual(controller.stats()['priorities']['interactive']['shed_deadline'], 1)
+        controller.release(running)
+
+    def test_times_out_while_queued(self):
+        from .admission import AdmissionRejected
+
+        controller = self.make_controller()
+        running = controller.acquire('a')
+        thread, outcome = self.acquire_in_thread(controller, 'a', 'batch', timeout=0.1)
+        thread.join(5)
+        self.assertIsInstance(outcome['error'], AdmissionRejected)
+        self.assertEqual(controller.stats()['queued'], 0)
+        self.assertEqual(controller.stats()['priorities']['batch']['shed_timeout'], 1)
+        controller.release(running)
+
+    def test_decorator_returns_503_with_retry_after(self):
+        from rest_framework.response import Response
+        from rest_framework.test import APIRequestFactory
+        from .admission import admission_controlled
+
+        controller = self.make_controller(max_queue=0)
+        calls = []
+
+        @admission_controlled('interactive')
+        def view(viewset, request, pk=None):
+            calls.append(controller.stats()['active'])
+            return Response({'ok': True})
+
+        request = APIRequestFactory().post('/predict/', HTTP_X_REQUEST_TIMEOUT='5')
+        with mock.patch('inference.admission.get_admission_controller', return_value=controller):
+            response = view(None, request, pk=1)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(calls, [1])
+            self.assertEqual(controller.stats()['active'], 0)
+
+            running = controller.acquire(1)
+            response = view(None, request, pk=1)
+            controller.release(running)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(response.data['retry_after'], 1)
+        self.assertEqual(calls, [1])
+
+    def test_slow_body_does_not_hold_a_slot(self):
+        import json
+        import threading
+        from django.test import RequestFactory
+        from rest_framework.parsers import JSONParser
+        from rest_framework.request import Request
+        from rest_framework.response import Response
+        from .admission import admission_controlled
+
+        controller = self.make_controller()
+        body = json.dumps({'text': 'x' * 1000}).encode()
+        receiving, resume = threading.Event(), threading.Event()
+
+        class SlowInput(io.BytesIO):
+            """ボディの後半が届くまで待つ入力"""
+
+            def read(self, size=-1):
+                if self.tell() >= len(body) // 2:
+                    receiving.set()
+                    resume.wait(5)
+                return super().read(min(size, len(body) // 2) if size and size > 0 else len(body) // 2)
+
+        @admission_controlled('interactive')
+        def view(viewset, request, pk=None):
+            return Response({'length': len(request.data['text'])})
+
+        django_request = RequestFactory().generic('POST', '/predict/', body, 'application/json',
+                                                  **{'wsgi.input': SlowInput(body)})
+        request = Request(django_request, parsers=[JSONParser()])
+        outcome = {}
+        with mock.patch('inference.admission.get_admission_controller', return_value=controller):
+            thread = threading.Thread(target=lambda: outcome.update(response=view(None, request, pk=1)))
+            thread.start()
+            self.assertTrue(receiving.wait(5))
+            # 受信中は実行枠を使わない（他のリクエストは待たずに実行できる）
+            self.assertEqual(controller.stats()['active'], 0)
+            controller.release(controller.acquire(1, timeout=0.01))
+            resume.set()
+            thread.join(5)
+
+        self.assertEqual(outcome['response'].data, {'length': 1000})
+        self.assertEqual(controller.stats()['active'], 0)
+
+
+class SingleFlightTests(SimpleTestCase):
+    """同一リクエストの推論結果の共有"""
+
+    def start(self, flight, key, fn):
+        import threading
+
+        outcome = {}
+
+        def run():
+            try:
+                outcome['result'] = flight.do(key, fn, group='test')
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread, outcome
+
+    def wait_for(self, predicate):
+        import time
+
+        deadline = time.monotonic() + 5
+        while not predicate():
+            self.assertLess(time.monotonic(), deadline, 'timed out')
+            time.sleep(0.005)
+
+    def start_leader(self, flight, key, fn):
+        thread, outcome = self.start(flight, key, fn)
+        self.wait_for(lambda: key in flight._calls)
+        return thread, outcome
+
+    def test_followers_share_leader_result(self):
+        import threading
+        from .coalescing import SingleFlight
+
+        flight = SingleFlight(wait_timeout=5)
+        release = threading.Event()
+        result = object()
+        leader, leader_outcome = self.start_leader(flight, 'key', lambda: release.wait(5) and result)
+        followers = [self.start(flight, 'key', lambda: self.fail('follower computed')) for _ in range(2)]
+        self.wait_for(lambda: flight._calls['key'].followers == 2)
+
+        release.set()
+        for thread, _ in [(leader, None)] + followers:
+            thread.join(5)
+        self.assertEqual(leader_outcome['result'], (result, False))
+        for _, outcome in followers:
+            self.assertEqual(outcome['result'], (result, True))
+        stats = flight.stats(group='test')
+        self.assertEqual((stats['computations'], stats['coalesced'], stats['max_followers']), (1, 2, 2))
+        self.assertEqual(flight._calls, {})
+
+    def test_follower_computes_after_wait_timeout(self):
+        import threading
+        from .coalescing import SingleFlight
+
+        flight = SingleFlight(wait_timeout=0.05)
+        release = threading.Event()
+        leader, _ = self.start_leader(flight, 'key', lambda: release.wait(5) and 'leader')
+        self.assertEqual(flight.do('key', lambda: 'follower', group='test'), ('follower', False))
+        release.set()
+        leader.join(5)
+        stats = flight.stats(group='test')
+        self.assertEqual((stats['computations'], stats['fallbacks'], stats['coalesced']), (2, 1, 0))
+
+    def test_leader_error_propagates_to_followers(self):
+        import threading
+        from .coalescing import SingleFlight
+
+        flight = SingleFlight(wait_timeout=5)
+        release = threading.Event()
+        error = ValueError('broken image')
+
+        def fail():
+            release.wait(5)
+            raise error
+
+        leader, leader_outcome = self.start_leader(flight, 'key', fail)
+        follower, follower_outcome = self.start(flight, 'key', lambda: 'unused')
+        self.wait_for(lambda: flight._calls['key'].followers == 1)
+        release.set()
+        leader.join(5)
+        follower.join(5)
+        self.assertIs(leader_outcome['error'], error)
+        self.assertIs(follower_outcome['error'], error)
+        self.assertEqual(flight.stats(group='test')['errors'], 1)
+
+    def test_distinct_keys_run_independently(self):
+        from .coalescing import SingleFlight
+
+        flight = SingleFlight()
+        self.assertEqual(flight.do('a', lambda: 1), (1, False))
+        self.assertEqual(flight.do('b', lambda: 2), (2, False))
+        self.assertEqual(flight.stats()['computations'], 2)
+
+
+class PredictCoalescingKeyTests(TestCase):
+    """predict の共有キーはアップロードの内容で決まる"""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.enterContext(mock.patch('inference.views.get_app_classifier', return_value=StubClassifier()))
+        self.ml_app = MLApp.objects.create(name='demo', description='demo', device_type='cpu')
+        self.client = APIClient()
+
+    def predict_keys(self, *bodies):
+        from .coalescing import SingleFlight
+
+        flight = SingleFlight()
+        with mock.patch('inference.views.get_request_coalescer', return_value=flight), \
+                mock.patch.object(flight, 'do', wraps=flight.do) as do:
+            for body in bodies:
+                # ファイル名・サイズが同じでも内容が異なれば別のキー
+                upload = SimpleUploadedFile('upload.jpg', body, content_type='image/jpeg')
+                response = self.client.post(f'/api/ml-apps/{self.ml_app.pk}/predict/', {'image': upload},
+                                            format='multipart')
+                self.assertEqual(response.status_code, 200, response.content)
+        return [call.args[0] for call in do.call_args_list]
+
+    def test_distinct_bodies_never_share_a_key(self):
+        horizontal = make_jpeg(direction='horizontal')
+        # 同じサイズでデコード結果も同じだが、末尾のバイトのみ異なるボディ
+        padded, padded_other = horizontal + b'\0' * 16, horizontal + b'\1' * 16
+        keys = self.predict_keys(padded, padded, padded_other, horizontal, make_jpeg(direction='vertical'))
+        self.assertEqual(keys[0], keys[1])
+        self.assertEqual(len(set(keys[1:])), 4)
+
+    def test_hash_file_matches_content(self):
+        import hashlib
+        from django.core.files.uploadedfile import TemporaryUploadedFile
+        from .upload_handlers import MemoryViewUploadedFile, hash_file
+
+        body = make_jpeg()
+        expected = hashlib.sha256(body).hexdigest()
+        self.assertEqual(hash_file(SimpleUploadedFile('a.jpg', body)), expected)
+        self.assertEqual(hash_file(MemoryViewUploadedFile(memoryview(bytearray(body)), 'a.jpg', 'image/jpeg', len(body), None)),
+                         expected)
+        with TemporaryUploadedFile('a.jpg', 'image/jpeg', len(body), None) as f:
+            f.write(body)
+            self.assertEqual(hash_file(f), expected)
+
+
+class AppendOnlyArrayStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+
+    def make_store(self):
+        import numpy as np
+        from .tensor_cache import AppendOnlyArrayStore
+        return AppendOnlyArrayStore(self.directory, (2, 3), np.float32)
+
+    @staticmethod
+    def record(value):
+        import numpy as np
+        return np.full((2, 3), value, dtype=np.float32)
+
+    def test_round_trip(self):
+        import numpy as np
+
+        store = self.make_store()
+        rows = store.put_many(['a', 'b', 'a'], np.stack([self.record(1), self.record(2), self.record(1)]))
+        self.assertEqual(rows, [0, 1, 0])
+        self.assertEqual(store.put('c', self.record(3)), 2)
+        # 登録済みのキーは追記しない
+        self.assertEqual(store.put('b', self.record(9)), 1)
+        np.testing.assert_array_equal(store.get('b'), self.record(2))
+        self.assertIsNone(store.get('missing'))
+
+        batch, found = store.get_many(['c', 'missing', 'a'])
+        self.assertEqual(found, [True, False, True])
+        np.testing.assert_array_equal(batch, np.stack([self.record(3), self.record(0), self.record(1)]))
+
+        # 別インスタンス（別プロセス相当）からも同じ内容が読める
+        reopened = self.make_store()
+        self.assertEqual(len(reopened), 3)
+        batches = list(reopened.iter_batches(batch_size=2))
+        self.assertEqual([keys for keys, _ in batches], [['a', 'b'], ['c']])
+        np.testing.assert_array_equal(np.concatenate([batch for _, batch in batches]),
+                                      np.stack([self.record(1), self.record(2), self.record(3)]))
+
+    def test_concurrent_appends(self):
+        import threading
+
+        # インスタンスごとに別のファイル記述子でロックするため、スレッド間でも flock で直列化される
+        def append(worker):
+            store = self.make_store()
+            for i in range(25):
+                # 全ワーカー共通のキーと、ワーカー固有のキーを交互に追記
+                store.put(f'shared-{i}', self.record(1000 + i))
+                store.put(f'worker{worker}-{i}', self.record(worker * 100 + i))
+
+        threads = [threading.Thread(target=append, args=(worker,)) for worker in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        store = self.make_store()
+        self.assertEqual(len(store), 25 + 4 * 25)
+        self.assertEqual(len((Path(self.directory) / 'index.tsv').read_text().splitlines()), len(store))
+        self.assertEqual(os.path.getsize(store.data_path), len(store) * store.record_size)
+        rows = [store.get_row(key) for key, _ in self.iter_keys(store)]
+        self.assertEqual(sorted(rows), list(range(len(store))))
+        for i in range(25):
+            self.assertEqual(float(store.get(f'shared-{i}')[0, 0]), 1000 + i)
+            for worker in range(4):
+                self.assertEqual(float(store.get(f'worker{worker}-{i}')[0, 0]), worker * 100 + i)
+
+    @staticmethod
+    def iter_keys(store):
+        for keys, batch in store.iter_batches():
+            yield from zip(keys, batch)
+
+    def test_torn_writes_are_recovered(self):
+        import numpy as np
+
+        store = self.make_store()
+        store.put_many(['a', 'b'], np.stack([self.record(1), self.record(2)]))
+        # 追記中にプロセスが停止した状態（レコードの途中まで・インデックス行の途中まで）を再現
+        with open(store.data_path, 'ab') as f:
+            f.write(self.record(7).tobytes()[:10])
+        with open(store.index_path, 'a') as f:
+            f.write('torn\t1')
+
+        # 書き込み途中の行は読み込まない
+        reader = self.make_store()
+        self.assertEqual(len(reader), 2)
+        self.assertIsNone(reader.get('torn'))
+
+        # 次の追記で不完全な部分を切り詰めてから書き込む
+        with self.assertLogs('inference.tensor_cache', 'WARNING') as logs:
+            self.assertEqual(self.make_store().put('c', self.record(3)), 2)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(store.index_path.read_text(), 'a\t0\nb\t1\nc\t2\n')
+        self.assertEqual(os.path.getsize(store.data_path), 3 * store.record_size)
+        for value, key in enumerate(['a', 'b', 'c'], start=1):
+            np.testing.assert_array_equal(reader.get(key), self.record(value))
+            np.testing.assert_array_equal(self.make_store().get(key), self.record(value))
+
+    def test_malformed_index_line_is_skipped(self):
+        store = self.make_store()
+        store.put('a', self.record(1))
+        with open(store.index_path, 'a') as f:
+            f.write('not-a-row\n')
+        with self.assertLogs('inference.tensor_cache', 'WARNING'):
+            store.put('b', self.record(2))
+        with self.assertLogs('inference.tensor_cache', 'WARNING'):
+            reopened = self.make_store()
+        self.assertEqual(len(reopened), 2)
+        self.assertEqual(reopened.get_row('b'), 1)
+
+
+class SummarizeLogitsTests(SimpleTestCase):
+    classes = ['cat', 'dog', 'bird', 'fish']
+
+    def summarize(self, logits, **kwargs):
+        import torch
+        from .cuda_inference import summarize_logits
+        return summarize_logits(torch.tensor(logits, dtype=torch.float32), self.classes, **kwargs)
+
+    def test_all_classes_in_class_order(self):
+        result, = self.summarize([[0.0, 2.0, 1.0, -1.0]])
+        self.assertEqual(result['predicted_class'], 'dog')
+        self.assertEqual(list(result['class_probabilities']), self.classes)
+        self.assertAlmostEqual(sum(result['class_probabilities'].values()), 1.0, places=5)
+        self.assertAlmostEqual(result['confidence'], result['class_probabilities']['dog'])
+
+    def test_top_k(self):
+        first, second = self.summarize([[0.0, 2.0, 1.0, -1.0], [3.0, 0.0, 1.0, 2.0]], top_k=2)
+        # 確率の高い順
+        self.assertEqual(list(first['class_probabilities']), ['dog', 'bird'])
+        self.assertEqual(list(second['class_probabilities']), ['cat', 'fish'])
+        # 範囲外の top_k はクラス数・1件に丸める
+        self.assertEqual(len(self.summarize([[0.0, 1.0, 2.0, 3.0]], top_k=10)[0]['class_probabilities']), 4)
+        self.assertEqual(len(self.summarize([[0.0, 1.0, 2.0, 3.0]], top_k=0)[0]['class_probabilities']), 1)
+
+    def test_min_confidence(self):
+        confident, uniform = self.summarize([[10.0, 0.0, 0.0, 0.0], [1.0, 1.0, 1.0, 1.0]], min_confidence=0.9)
+        self.assertEqual(list(confident['class_probabilities']), ['cat'])
+        # 閾値を超えるクラスがなくても予測クラスと信頼度は返す
+        self.assertEqual(uniform['class_probabilities'], {})
+        self.assertIn(uniform['predicted_class'], self.classes)
+        self.assertAlmostEqual(uniform['confidence'], 0.25, places=5)
+
+        result, = self.summarize([[2.0, 2.0, 0.0, -5.0]], top_k=3, min_confidence=0.1)
+        # top_k の中から閾値未満（bird: 約 0.06）を除く
+        self.assertEqual(set(result['class_probabilities']), {'cat', 'dog'})
+
+    def test_returns_python_scalars(self):
+        import torch
+        from .cuda_inference import summarize_logits
+
+        # 低精度の出力でも Python の float / str を返す（JSON シリアライズ可能）
+        for dtype in (torch.float16, torch.bfloat16):
+            for kwargs in ({}, {'top_k': 2}, {'min_confidence': 0.1}):
+                result, = summarize_logits(torch.tensor([[0.0, 2.0, 1.0, -1.0]], dtype=dtype), self.classes, **kwargs)
+                self.assertIs(type(result['confidence']), float)
+                self.assertIs(type(result['predicted_class']), str)
+                self.assertTrue(all(type(key) is str and type(value) is float
+                                    for key, value in result['class_probabilities'].items()))
+
+
+class TextInferenceTests(SimpleTestCase):
+    def test_length_buckets(self):
+        from .text_inference import length_buckets
+
+        lengths = [5, 1, 40, 3, 3, 100, 0, 7]
+        buckets = length_buckets(lengths, batch_size=3)
+        # 全入力が1回ずつ、トークン数順に並ぶ（同じ長さは入力順）
+        order = [int(i) for bucket in buckets for i in bucket]
+        self.assertEqual(order, [6, 1, 3, 4, 0, 7, 2, 5])
+        self.assertTrue(all(len(bucket) <= 3 for bucket in buckets))
+
+        # 件数 × バッチ内の最大長がトークン数の上限を超えない（上限を超える1件はそのまま）
+        buckets = length_buckets(lengths, batch_size=8, max_batch_tokens=20)
+        self.assertEqual(sorted(int(i) for bucket in buckets for i in bucket), list(range(len(lengths))))
+        for bucket in buckets:
+            if len(bucket) > 1:
+                self.assertLessEqual(len(bucket) * max(lengths[i] for i in bucket), 20)
+        self.assertEqual([[int(i) for i in bucket] for bucket in buckets][-2:], [[2], [5]])
+        self.assertEqual(length_buckets([], batch_size=4), [])
+
+    def test_requires_trained_model(self):
+        from .text_inference import TextClassifier
+
+        with self.assertRaises(ValueError):
+            TextClassifier(model_path=None)
+
+    def test_int8_matches_fp32(self):
+        import json
+        import torch
+        from .text_inference import TextClassificationModel, TextClassifier, _synthetic_texts
+
+        classes = ['negative', 'neutral', 'positive']
+        directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+        torch.manual_seed(0)
+        model = TextClassificationModel(vocab_size=4096, num_classes=len(classes), embedding_dim=32, hidden_dim=64)
+        with torch.no_grad():
+            # 学習済みモデル相当にクラス間の差がはっきりしたロジットにする
+            model.classifier.weight.mul_(20)
+        torch.save({'model_type': 'text_classification', 'model_state_dict': model.state_dict(), 'max_length': 64},
+                   directory / 'model.pth')
+        (directory / 'model_info.json').write_text(json.dumps({'classes': classes}))
+
+        fp32 = TextClassifier(model_path=str(directory / 'model.pth'), quantize=False)
+        int8 = TextClassifier(model_path=str(directory / 'model.pth'), quantize=True)
+        self.assertEqual(fp32.classes, classes)
+        self.assertEqual((fp32.precision, int8.precision), ('fp32', 'int8'))
+
+        texts = _synthetic_texts(64, max_words=32, seed=1)
+        expected = fp32.predict_texts(texts, batch_size=16)
+        actual = int8.predict_texts(texts, batch_size=16)
+        self.assertGreater(len({result['predicted_class'] for result in expected}), 1)
+        agreement = sum(a['predicted_class'] == e['predicted_class'] for a, e in zip(actual, expected)) / len(texts)
+        self.assertGreaterEqual(agreement, 0.95)
+        for a, e in zip(actual, expected):
+            for name in classes:
+                self.assertAlmostEqual(a['class_probabilities'][name], e['class_probabilities'][name], delta=0.05)
+
+
+class TextPredictViewTests(TestCase):
+    def test_text_app_without_model_is_rejected(self):
+        ml_app = MLApp.objects.create(name='sentiment', description='demo', device_type='cpu',
+                                      app_type='sentiment_analysis')
+        response = APIClient().post(f'/api/ml-apps/{ml_app.pk}/predict/', {'text': 'とても良い'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('model_file_path', response.json()['error'])
+        self.assertFalse(PredictionLog.objects.exists())
+
+
+class ShadowCandidateReleaseTests(TestCase):
+    """シャドー推論の候補モデルの解放"""
+
+    def setUp(self):
+        from . import cuda_inference, shadow
+
+        self.evaluator = shadow.ShadowEvaluator()
+        self.addCleanup(self.evaluator._executor.shutdown)
+        self.enterContext(mock.patch.object(shadow, '_evaluator', self.evaluator))
+        self.enterContext(mock.patch.dict(cuda_inference._classifier_instances, clear=True))
+        self.ml_app = MLApp.objects.create(
+            name='demo', description='demo', device_type='cpu',
+            model_optimization={'shadow': {'model_file_path': '/models/candidate-a.pth', 'sample_rate': 1.0}},
+        )
+
+    def run_shadow(self, ml_app):
+        import numpy as np
+        from .shadow import get_candidate_options, get_shadow_config
+
+        shadow_config = get_shadow_config(ml_app)
+        candidate = self.cache_candidate(get_candidate_options(ml_app, shadow_config))
+        primary = StubClassifier().result()
+        self.evaluator._run(ml_app, shadow_config, np.zeros((8, 8, 3), np.uint8), primary, 0.01, None)
+        self.assertEqual(self.evaluator.stats()['errors'], 0)
+        return candidate
+
+    def cache_candidate(self, options):
+        import types
+        from . import cuda_inference
+
+        # 候補モデルの読み込みの代わりにスタブをキャッシュに置く
+        candidate = StubClassifier()
+        candidate.device = types.SimpleNamespace(type='cpu')
+        key = cuda_inference._classifier_key(model_version=None, **options)
+        return cuda_inference._classifier_instances.setdefault(key, candidate)
+
+    def cached_paths(self):
+        from . import cuda_inference
+        return sorted(key[3] for key in cuda_inference._classifier_instances)
+
+    def test_changed_candidate_is_released(self):
+        first = self.run_shadow(self.ml_app)
+        self.assertEqual(first.predicted, 1)
+        self.assertEqual(self.cached_paths(), ['/models/candidate-a.pth'])
+
+        # 設定の変更時は旧候補モデルをキャッシュから外す（新しい候補は次の推論で読み込む）
+        self.ml_app.model_optimization = {'shadow': {'model_file_path': '/models/candidate-b.pth'}}
+        self.ml_app.save()
+        self.assertEqual(self.cached_paths(), [])
+        second = self.run_shadow(self.ml_app)
+        self.assertIsNot(second, first)
+        self.assertEqual(self.cached_paths(), ['/models/candidate-b.pth'])
+
+        # 解放した候補モデルは参照がなくなるまで解放待ち
+        self.assertEqual(self.evaluator.stats()['draining'], 1)
+        del first
+        self.assertEqual(self.evaluator.stats()['draining'], 0)
+
+    def test_latency_measured_over_predict_arrays(self):
+        from .models import ShadowPrediction
+
+        self.run_shadow(self.ml_app)
+        self.assertEqual(ShadowPrediction.objects.get().shadow_latency, StubClassifier().result()['processing_time'])
+
+        # 本番側もデコード・知覚ハッシュ・前処理を含めず predict_arrays の処理時間を渡す
+        self.enterContext(override_settings(MEDIA_ROOT=self.enterContext(tempfile.TemporaryDirectory())))
+        upload = SimpleUploadedFile('a.jpg', make_jpeg(), content_type='image/jpeg')
+        with mock.patch('inference.views.get_app_classifier', return_value=StubClassifier()), \
+                mock.patch('inference.views.maybe_submit_shadow') as submit, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().post(f'/api/ml-apps/{self.ml_app.pk}/predict/', {'image': upload},
+                                        format='multipart')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(submit.call_args.args[3], StubClassifier().result()['processing_time'])
+
+    def test_removed_candidate_is_released(self):
+        self.run_shadow(self.ml_app)
+        self.ml_app.model_optimization = {}
+        self.ml_app.save()
+        self.assertEqual(self.cached_paths(), [])
+        self.assertEqual(self.evaluator.stats()['candidates'], 0)
+
+    def test_candidate_shared_by_apps_is_kept_until_unused(self):
+        other = MLApp.objects.create(name='other', description='demo', device_type='cpu',
+                                     model_optimization=self.ml_app.model_optimization)
+        self.run_shadow(self.ml_app)
+        self.run_shadow(other)
+        other.delete()
+        self.assertEqual(self.cached_paths(), ['/models/candidate-a.pth'])
+        self.ml_app.is_active = False
+        self.ml_app.save()
+        self.assertEqual(self.cached_paths(), [])
+
+    def test_removed_in_another_process_is_released_on_request(self):
+        from .shadow import maybe_submit_shadow
+
+        self.run_shadow(self.ml_app)
+        # シグナルを経由しない設定の削除（他プロセスでの更新に相当）
+        MLApp.objects.filter(pk=self.ml_app.pk).update(model_optimization={})
+        self.ml_app.refresh_from_db()
+        self.assertFalse(maybe_submit_shadow(self.ml_app, None, StubClassifier().result(), 0.01))
+        self.assertEqual(self.cached_paths(), [])
+
+
+class StreamingDecodeBudgetTests(TestCase):
+    """受信中のデコードで確保したメモリ予算の返却"""
+
+    def setUp(self):
+        from . import image_decoding
+
+        self.budget = image_decoding.DecodeMemoryBudget(512 * 1024 * 1024)
+        self.enterContext(mock.patch.object(image_decoding, '_memory_budget', self.budget))
+
+    def test_reservation_released_when_decoder_is_discarded(self):
+        import gc
+        from .image_decoding import IncrementalImageDecoder
+
+        body = make_jpeg((640, 480))
+        decoder = IncrementalImageDecoder()
+        decoder.feed(body[:len(body) // 2])
+        self.assertGreater(self.budget.in_use, 0)
+        # close() / abort() を呼ばずに破棄
+        del decoder
+        gc.collect()
+        self.assertEqual(self.budget.in_use, 0)
+
+    def test_reservation_released_once(self):
+        from .image_decoding import IncrementalImageDecoder
+
+        body = make_jpeg((640, 480))
+        decoder = IncrementalImageDecoder()
+        decoder.feed(body)
+        self.assertIsNotNone(decoder.close())
+        decoder.abort('late abort')
+        self.assertEqual(self.budget.in_use, 0)
+
+    def test_interrupted_multipart_releases_reservation(self):
+        import gc
+        from django.test import RequestFactory
+        from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+        from .views import MLAppViewSet
+
+        class DisconnectingInput(io.BytesIO):
+            """途中で接続が切れるリクエストボディ"""
+
+            def read(self, size=-1):
+                if self.tell() >= len(self.getvalue()) // 2:
+                    raise OSError('connection reset')
+                return super().read(size if 0 <= size < 4096 else 4096)
+
+        ml_app = MLApp.objects.create(name='demo', description='demo', device_type='cpu')
+        body = encode_multipart(BOUNDARY, {'image': SimpleUploadedFile('a.jpg', make_jpeg((640, 480)))})
+        request = RequestFactory().generic('POST', '/', body, MULTIPART_CONTENT,
+                                           **{'wsgi.input': DisconnectingInput(body)})
+        # ヘッダーの受信後、ファイルの途中で multipart の解析が失敗する
+        with self.assertRaises(OSError) as raised:
+            MLAppViewSet.as_view({'post': 'predict'})(request, pk=ml_app.pk)
+        self.assertGreater(self.budget.peak, 0)
+        # 例外のトレースバックがハンドラを参照しなくなった時点で返却される
+        del request, raised
+        gc.collect()
+        self.assertEqual(self.budget.in_use, 0)
+
+    def test_streaming_decode_only_for_image_classification(self):
+        from rest_framework.test import APIRequestFactory
+        from .views import MLAppViewSet
+
+        for app_type, expected in (('image_classification', True), ('object_detection', False)):
+            ml_app = MLApp.objects.create(name=app_type, description='demo', device_type='cpu', app_type=app_type)
+            request = APIRequestFactory().post('/', {'image': SimpleUploadedFile('a.jpg', make_jpeg((640, 480)))},
+                                               format='multipart')
+            drf_request = MLAppViewSet(action_map={'post': 'predict'}).initialize_request(request, pk=ml_app.pk)
+            # 物体検知は入力サイズが異なるため受信中にデコードしない（受信後の1回のみ）
+            self.assertEqual(getattr(drf_request.FILES['image'], 'streamed_decode', None) is not None, expected)
+        self.assertEqual(self.budget.in_use, 0)
+
+    def test_streaming_handler_scoped_to_inference_views(self):
+        from django.http import HttpRequest
+        from rest_framework.test import APIRequestFactory
+        from .upload_handlers import StreamingDecodeUploadHandler
+        from .views import MLAppViewSet
+
+        self.assertFalse(any(isinstance(h, StreamingDecodeUploadHandler) for h in HttpRequest().upload_handlers))
+        request = APIRequestFactory().post('/', {'image': SimpleUploadedFile('a.jpg', make_jpeg())}, format='multipart')
+        drf_request = MLAppViewSet(action_map={'post': 'predict'}).initialize_request(request)
+        self.assertEqual([type(h) for h in drf_request.upload_handlers], [StreamingDecodeUploadHandler])
+
+
+class RescoreCommandTests(TestCase):
+    def test_rejects_non_image_classification_apps(self):
+        from django.core.management import CommandError, call_command
+
+        for app_type in ('object_detection', 'text_classification', 'sentiment_analysis'):
+            ml_app = MLApp.objects.create(name=app_type, description='demo', device_type='cpu', app_type=app_type)
+            with mock.patch('inference.model_registry.ModelRegistry.get_classifier') as get_classifier:
+                with self.assertRaisesMessage(CommandError, app_type):
+                    call_command('rescore', app_id=ml_app.pk, stdout=io.StringIO())
+            get_classifier.assert_not_called()
+
+
+def unpack_msgpack(data: bytes):
+    """テスト用の MessagePack デコーダ（仕様どおりに1値ずつ読む参照実装）"""
+    import struct
+
+    def read(pos):
+        code = data[pos]
+        pos += 1
+        if code <= 0x7f:
+            return code, pos
+        if code >= 0xe0:
+            return code - 0x100, pos
+        if 0x80 <= code <= 0x8f or code in (0xde, 0xdf):
+            size, pos = read_size(code, pos, 0x80, 0xde)
+            result = {}
+            for _ in range(size):
+                key, pos = read(pos)
+                result[key], pos = read(pos)
+            return result, pos
+        if 0x90 <= code <= 0x9f or code in (0xdc, 0xdd):
+            size, pos = read_size(code, pos, 0x90, 0xdc)
+            result = []
+            for _ in range(size):
+                value, pos = read(pos)
+                result.append(value)
+            return result, pos
+        if 0xa0 <= code <= 0xbf:
+            size = code & 0x1f
+            return data[pos:pos + size].decode('utf-8'), pos + size
+        fixed = {0xc0: None, 0xc2: False, 0xc3: True}
+        if code in fixed:
+            return fixed[code], pos
+        formats = {0xca: '>f', 0xcb: '>d', 0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+                   0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q'}
+        if code in formats:
+            size = struct.calcsize(formats[code])
+            return struct.unpack(formats[code], data[pos:pos + size])[0], pos + size
+        lengths = {0xc4: ('>B', bytes), 0xc5: ('>H', bytes), 0xc6: ('>I', bytes),
+                   0xd9: ('>B', str), 0xda: ('>H', str), 0xdb: ('>I', str)}
+        fmt, kind = lengths[code]
+        header = struct.calcsize(fmt)
+        size = struct.unpack(fmt, data[pos:pos + header])[0]
+        pos += header
+        value = data[pos:pos + size]
+        return (value.decode('utf-8') if kind is str else value), pos + size
+
+    def read_size(code, pos, fix, code16):
+        if code < fix + 0x10:
+            return code & 0x0f, pos
+        fmt = '>H' if code == code16 else '>I'
+        size = struct.calcsize(fmt)
+        return struct.unpack(fmt, data[pos:pos + size])[0], pos + size
+
+    value, pos = read(0)
+    assert pos == len(data), 'trailing bytes'
+    return value
+
+
+class RendererTests(SimpleTestCase):
+    def assert_same_as_json_renderer(self, data, accepted_media_type='application/json'):
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import FastJSONRenderer
+
+        self.assertEqual(FastJSONRenderer().render(data, accepted_media_type),
+                         JSONRenderer().render(data, accepted_media_type))
+
+    def test_fast_json_matches_json_renderer(self):
+        import datetime
+        import decimal
+        import uuid
+        import numpy as np
+        from django.utils.translation import gettext_lazy
+
+        self.assert_same_as_json_renderer({
+            'decimal': decimal.Decimal('1.25'),
+            'lazy': gettext_lazy('cat'),
+            'separators': 'a\u2028b\u2029c',
+            'unicode': '猫',
+            'non_str_keys': {1: 'a', 2.5: 'b', True: 'c', None: 'd'},
+            'datetime': datetime.datetime(2024, 1, 2, 3, 4, 5, 678000, tzinfo=datetime.timezone.utc),
+            'date': datetime.date(2024, 1, 2),
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'numpy': [np.float32(0.1), np.int64(3), np.arange(3)],
+            'nested': [{'p': 0.123456789}, [1, None, False]],
+        })
+
+    def test_fast_json_falls_back_for_values_orjson_cannot_encode(self):
+        self.assert_same_as_json_renderer({'big': 2 ** 70, 'probability': 0.5})
+        self.assert_same_as_json_renderer({'a': [1, 2]}, 'application/json; indent=2')
+
+    def test_fast_json_exponent_floats_keep_their_value(self):
+        import json
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import FastJSONRenderer
+
+        # 指数表記の綴りのみ異なる（1e-07 と 1e-7）
+        data = {'small': 1e-7, 'large': 1e20}
+        self.assertEqual(json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+
+    def test_float_precision_from_accept_parameter(self):
+        import json
+        from .renderers import FastJSONRenderer, get_float_precision
+
+        data = {'class_probabilities': {'cat': 0.123456789, 'dog': 0.876543211}, 'rank': [0.11111, 2]}
+        rendered = FastJSONRenderer().render(data, 'application/json; precision=4')
+        self.assertEqual(json.loads(rendered),
+                         {'class_probabilities': {'cat': 0.1235, 'dog': 0.8765}, 'rank': [0.1111, 2]})
+        self.assertEqual(get_float_precision('application/json; precision=99'), 17)
+        self.assertEqual(get_float_precision('application/json; precision=-1'), 0)
+        self.assertIsNone(get_float_precision('application/json; precision=abc'))
+        self.assertIsNone(get_float_precision('application/json'))
+        with override_settings(INFERENCE_RENDERING={'FLOAT_PRECISION': 2}):
+            self.assertEqual(json.loads(FastJSONRenderer().render(data))['rank'], [0.11, 2])
+            # Accept のパラメータが設定より優先
+            self.assertEqual(get_float_precision('application/json; precision=3'), 3)
+
+    def test_builtin_msgpack_encoder(self):
+        import decimal
+        import struct
+        from . import renderers
+
+        data = {
+            'none': None, 'flags': [True, False],
+            'ints': [0, 127, 128, 255, 256, 65536, 2 ** 32, 2 ** 63, -1, -32, -33, -129, -32769, -2 ** 31 - 1, -2 ** 63],
+            'floats': [0.1, -2.5],
+            'strings': ['a' * 31, 'a' * 32, 'a' * 256, 'a' * 65536, '猫'],
+            'bytes': [b'\x00' * 3, b'\x01' * 256],
+            'nested': {'list': list(range(16)), 'dict': {str(i): i for i in range(16)}},
+            'decimal': decimal.Decimal('1.5'),
+        }
+        with mock.patch.object(renderers, 'msgpack', None):
+            packed = renderers.MessagePackRenderer().render(data, 'application/msgpack')
+            single = renderers.MessagePackRenderer().render({'p': 0.1}, 'application/msgpack; float=32')
+
+        expected = dict(data, decimal=1.5)
+        self.assertEqual(unpack_msgpack(packed), expected)
+        self.assertEqual(unpack_msgpack(single), {'p': struct.unpack('>f', struct.pack('>f', 0.1))[0]})
+        self.assertEqual(single[-5], 0xca)
+
+        with mock.patch.object(renderers, 'msgpack', None):
+            with self.assertRaises(OverflowError):
+                renderers.MessagePackRenderer().render({'big': 2 ** 64})
+
+
+class TensorStubClassifier(StubClassifier):
+    input_size = (8, 8)
+
+
+class UploadParserTests(TestCase):
+    """multipart を使わないアップロード（RawImageParser / NpyTensorParser / RawTensorParser）"""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root.name))
+        self.classifier = TensorStubClassifier()
+        self.enterContext(mock.patch('inference.views.get_app_classifier', return_value=self.classifier))
+        self.ml_app = MLApp.objects.create(name='demo', description='demo', device_type='cpu')
+        self.client = APIClient()
+
+    def post_tensor(self, body, content_type):
+        return self.client.post(f'/api/ml-apps/{self.ml_app.pk}/predict_tensor/', data=body, content_type=content_type)
+
+    def npy(self, array):
+        import numpy as np
+
+        buffer = io.BytesIO()
+        np.save(buffer, array, allow_pickle=False)
+        return buffer.getvalue()
+
+    def test_raw_image_body_round_trip(self):
+        from .models import ImageUpload
+
+        data = make_jpeg((64, 48))
+        response = self.client.post(f'/api/ml-apps/{self.ml_app.pk}/predict/?filename=cat.jpg', data=data,
+                                    content_type='image/jpeg')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['predicted_class'], 'cat')
+        self.assertEqual(PredictionLog.objects.get().input_data,
+                         {'filename': 'cat.jpg', 'size': len(data), 'format': 'JPEG'})
+        upload = ImageUpload.objects.get()
+        self.assertEqual((upload.image_width, upload.image_height), (64, 48))
+        with upload.image.open('rb') as f:
+            self.assertEqual(f.read(), data)
+
+    def test_tensor_single_and_batch(self):
+        import numpy as np
+
+        response = self.post_tensor(self.npy(np.zeros((8, 8, 3), dtype=np.uint8)), 'application/x-npy')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['predicted_class'], 'cat')
+
+        # ヘッダーなしのバイト列は N 枚分を連結
+        response = self.post_tensor(bytes(2 * 8 * 8 * 3), 'application/octet-stream')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['batch_size'], 2)
+        self.assertEqual(self.classifier.predicted, 3)
+
+    def test_tensor_rejects_wrong_shape_and_dtype(self):
+        import numpy as np
+
+        cases = [
+            (self.npy(np.zeros((4, 4, 3), dtype=np.uint8)), 'application/x-npy', [1, 4, 4, 3], 'uint8'),
+            (self.npy(np.zeros((8, 8, 3), dtype=np.float32)), 'application/x-npy', [1, 8, 8, 3], 'float32'),
+            (bytes(8 * 8 * 3 + 1), 'application/octet-stream', [8 * 8 * 3 + 1], 'uint8'),
+        ]
+        for body, content_type, shape, dtype in cases:
+            response = self.post_tensor(body, content_type)
+            self.assertEqual(response.status_code, 400, response.content)
+            self.assertEqual(response.json()['received'], {'dtype': dtype, 'shape': shape})
+
+        response = self.post_tensor(b'not npy', 'application/x-npy')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid .npy data', response.json()['detail'])
+        self.assertEqual(self.classifier.predicted, 0)
+
+    @override_settings(INFERENCE_IMAGE_DECODE={'MAX_TENSOR_BYTES': 8 * 8 * 3, 'MAX_UPLOAD_BYTES': 100})
+    def test_rejects_bodies_over_the_limit(self):
+        response = self.post_tensor(bytes(2 * 8 * 8 * 3), 'application/octet-stream')
+        self.assertEqual(response.status_code, 413, response.content)
+        response = self.client.post(f'/api/ml-apps/{self.ml_app.pk}/predict/', data=make_jpeg(),
+                                    content_type='image/jpeg')
+        self.assertEqual(response.status_code, 413, response.content)
+        self.assertEqual(self.classifier.predicted, 0)
+        self.assertFalse(PredictionLog.objects.exists())
+
+
+class DecodeImageTests(SimpleTestCase):
+    """上限付きの縮小デコード（decode_image）"""
+
+    def setUp(self):
+        from . import image_decoding
+
+        self.budget = image_decoding.DecodeMemoryBudget(10 * 1024 * 1024)
+        self.enterContext(mock.patch.object(image_decoding, '_memory_budget', self.budget))
+
+    def decode(self, data, name='a.jpg', **limits):
+        from .image_decoding import decode_image
+
+        settings = dict({'TARGET_SIZE': (224, 224), 'MEMORY_WAIT_TIMEOUT': 0}, **limits)
+        with override_settings(INFERENCE_IMAGE_DECODE=settings):
+            return decode_image(SimpleUploadedFile(name, data))
+
+    def make_png(self, size, mode='RGB'):
+        buffer = io.BytesIO()
+        Image.new(mode, size).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def test_jpeg_draft_decodes_at_reduced_scale(self):
+        image, info = self.decode(make_jpeg((640, 480)))
+        # 目標サイズ以上の最小の DCT スケール（1/2）でデコード
+        self.assertEqual(image.size, (320, 240))
+        self.assertEqual(image.mode, 'RGB')
+        self.assertEqual((info['width'], info['height'], info['format']), (640, 480, 'JPEG'))
+        self.assertEqual((info['decoded_width'], info['decoded_height']), (320, 240))
+        self.assertEqual(self.budget.peak, 320 * 240 * 4)
+        self.assertEqual(self.budget.in_use, 0)
+
+    def test_other_formats_reduced_after_decode(self):
+        image, info = self.decode(self.make_png((1000, 500), mode='P'), 'a.png')
+        # 目標サイズの2倍以上のため整数倍（1/2）で縮小し RGB に変換
+        self.assertEqual(image.size, (500, 250))
+        self.assertEqual(image.mode, 'RGB')
+        self.assertEqual((info['width'], info['height'], info['mode']), (1000, 500, 'P'))
+        self.assertEqual(self.budget.in_use, 0)
+
+    def test_rejects_images_over_the_limits(self):
+        from .image_decoding import ImageTooLargeError
+
+        data = make_jpeg((640, 480))
+        cases = [
+            ({'MAX_UPLOAD_BYTES': len(data) - 1}, 'Image file is too large'),
+            ({'MAX_PIXELS': 640 * 480 - 1}, 'too many pixels'),
+            # DCT スケーリング後（320x240）の見積もりで判定
+            ({'MAX_DECODE_BYTES': 320 * 240 * 4 - 1}, 'too much memory'),
+        ]
+        for limits, message in cases:
+            with self.assertRaisesMessage(ImageTooLargeError, message):
+                self.decode(data, **limits)
+        self.assertEqual(self.decode(data, MAX_DECODE_BYTES=320 * 240 * 4)[0].size, (320, 240))
+        self.assertEqual(ImageTooLargeError.status_code, 413)
+
+        with self.assertRaisesMessage(ImageTooLargeError, 'too much memory'):
+            self.decode(self.make_png((100, 100)), 'a.png', MAX_DECODE_BYTES=100 * 100 * 4 - 1)
+
+        self.budget.limit_bytes = 320 * 240 * 4 - 1
+        with self.assertRaisesMessage(ImageTooLargeError, 'budget exhausted'):
+            self.decode(data)
+        self.assertEqual(self.budget.in_use, 0)
+
+    def test_rejects_invalid_images(self):
+        from .image_decoding import ImageDecodeError, ImageTooLargeError
+
+        with self.assertRaisesMessage(ImageDecodeError, 'Invalid image file') as cm:
+            self.decode(b'not an image')
+        self.assertNotIsInstance(cm.exception, ImageTooLargeError)
+        self.assertEqual(cm.exception.status_code, 400)
+
+
+class IterationsParsingTests(TestCase):
+    def setUp(self):
+        self.classifier = mock.Mock()
+        self.classifier.validate_precision.return_value = {}
+        self.classifier.benchmark.return_value = {}
+        self.enterContext(mock.patch('inference.views.get_app_classifier', return_value=self.classifier))
+        self.ml_app = MLApp.objects.create(name='demo', description='demo', device_type='cpu')
+        self.client = APIClient()
+
+    def test_invalid_iterations_return_400(self):
+        for action in ('validate_precision', 'benchmark'):
+            response = self.client.post(f'/api/ml-apps/{self.ml_app.pk}/{action}/', {'iterations': 'abc'})
+            self.assertEqual(response.status_code, 400, response.content)
+            self.assertEqual(response.json()['error'], 'iterations must be an integer')
+        self.classifier.validate_precision.assert_not_called()
+        self.classifier.benchmark.assert_not_called()
+
+    def test_iterations_clamped_to_range(self):
+        url = f'/api/ml-apps/{self.ml_app.pk}/validate_precision/'
+        for value, expected in (({}, 20), ({'iterations': '1'}, 5), ({'iterations': 1000}, 100)):
+            self.assertEqual(self.client.post(url, value).status_code, 200)
+            self.assertEqual(self.classifier.validate_precision.call_args.kwargs['num_iterations'], expected)
+
+
+class ChooseCascadeThresholdTests(SimpleTestCase):
+    """tune_cascade の閾値の選択"""
+
+    def choose(self, max_accuracy_drop, thresholds=(0.6, 0.8, 0.9, 1.0)):
+        import numpy as np
+        from .cascade import choose_threshold
+
+        # 高速モデルは信頼度 0.7 と 0.85 の2件を誤り、通常モデルはすべて正解
+        fast_confidence = np.array([0.95] * 6 + [0.7, 0.75, 0.85, 0.9])
+        fast_predicted = np.array([0] * 6 + [1, 0, 1, 0])
+        return choose_threshold(fast_confidence, fast_predicted, np.zeros(10, dtype=int), np.zeros(10, dtype=int),
+                                fast_time=0.002, full_time=0.01, max_accuracy_drop=max_accuracy_drop,
+                                thresholds=list(thresholds))
+
+    def test_candidates(self):
+        result = self.choose(0.0)
+        self.assertEqual(result['full_accuracy'], 1.0)
+        self.assertEqual(result['full_latency'], 0.01)
+        expected = [(0.6, 0.8, 0.0), (0.8, 0.9, 0.2), (0.9, 1.0, 0.3), (1.0, 1.0, 1.0)]
+        for candidate, (threshold, accuracy, escalation_rate) in zip(result['candidates'], expected):
+            self.assertEqual(candidate['threshold'], threshold)
+            self.assertAlmostEqual(candidate['accuracy'], accuracy)
+            self.assertAlmostEqual(candidate['escalation_rate'], escalation_rate)
+            # 平均レイテンシ = 高速モデル + 送出率 × 通常モデル
+            self.assertAlmostEqual(candidate['average_latency'], 0.002 + escalation_rate * 0.01)
+
+    def test_chooses_fastest_threshold_within_accuracy_drop(self):
+        for max_accuracy_drop, threshold in ((0.0, 0.9), (0.15, 0.8), (0.25, 0.6)):
+            best = self.choose(max_accuracy_drop)['best']
+            self.assertEqual(best['threshold'], threshold, max_accuracy_drop)
+        self.assertAlmostEqual(self.choose(0.0)['best']['average_latency'], 0.005)
+        self.assertIsNone(self.choose(0.0, thresholds=(0.6, 0.8))['best'])
+
+
+class UploadTempDirTests(SimpleTestCase):
+    def setUp(self):
+        from .upload_handlers import _ensure_temp_dir
+
+        _ensure_temp_dir.cache_clear()
+        self.addCleanup(_ensure_temp_dir.cache_clear)
+
+    def test_system_temp_dir_without_media_root(self):
+        from .upload_handlers import MappedTemporaryUploadedFile, get_upload_temp_dir
+
+        with override_settings(MEDIA_ROOT='', FILE_UPLOAD_TEMP_DIR=None), mock.patch('os.makedirs') as makedirs:
+            temp_dir = get_upload_temp_dir()
+        self.assertIsNone(temp_dir)
+        makedirs.assert_not_called()
+        with MappedTemporaryUploadedFile('a.jpg', 'image/jpeg', 0, None, temp_dir=temp_dir) as f:
+            self.assertEqual(os.path.dirname(f.temporary_file_path()), tempfile.gettempdir())
+
+    def test_storage_temp_dir_created_once(self):
+        from .upload_handlers import get_upload_temp_dir
+
+        media_root = self.enterContext(tempfile.TemporaryDirectory())
+        with override_settings(MEDIA_ROOT=media_root, FILE_UPLOAD_TEMP_DIR=None):
+            with mock.patch('os.makedirs', wraps=os.makedirs) as makedirs:
+                for _ in range(3):
+                    self.assertEqual(get_upload_temp_dir(), os.path.join(media_root, '.upload_tmp'))
+            makedirs.assert_called_once()
+            self.assertTrue(os.path.isdir(os.path.join(media_root, '.upload_tmp')))
+        with override_settings(FILE_UPLOAD_TEMP_DIR=media_root):
+            self.assertEqual(get_upload_temp_dir(), media_root)
+
+
+class CpuConfigTests(SimpleTestCase):
+    """ワーカーごとのスレッド数・ワーカースロット・CPUアフィニティの算出"""
+
+    def setUp(self):
+        from . import cpu_config
+
+        self.lock_dir = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(mock.patch.object(cpu_config, '_slot_lock_file', None))
+
+    def compute(self, num_workers, worker_index, cores, **settings):
+        from .cpu_config import compute_cpu_config
+
+        with override_settings(INFERENCE_CPU_CONFIG=dict(settings, LOCK_DIR=self.lock_dir)):
+            return compute_cpu_config(num_workers, worker_index, cores, pin_cores=True)
+
+    def test_threads_and_affinity(self):
+        cores = list(range(8))
+        self.assertEqual([self.compute(4, i, cores)['affinity'] for i in range(4)],
+                         [[0, 1], [2, 3], [4, 5], [6, 7]])
+        self.assertEqual(self.compute(3, 2, cores)['affinity'], [4, 5])
+        self.assertEqual(self.compute(2, 1, [2, 3, 6, 7])['affinity'], [6, 7])
+        # コア数より多いワーカーは1スレッドでコアを順に割り当て
+        config = self.compute(16, 9, cores)
+        self.assertEqual((config['num_threads'], config['affinity']), (1, [1]))
+        # 末尾を超えた分は先頭のコアから
+        self.assertEqual(self.compute(2, 1, list(range(6)), THREADS_PER_WORKER=4)['affinity'], [0, 1, 4, 5])
+
+    def test_threads_capped_at_available_cores(self):
+        config = self.compute(2, 1, [0, 1, 2, 3], THREADS_PER_WORKER=16, INTEROP_THREADS=2)
+        self.assertEqual(config['num_threads'], 4)
+        self.assertEqual(config['num_interop_threads'], 2)
+        self.assertEqual(config['affinity'], [0, 1, 2, 3])
+
+    def test_claims_free_worker_slots(self):
+        from . import cpu_config
+
+        first = self.compute(3, None, list(range(6)))
+        held = cpu_config._slot_lock_file
+        second = self.compute(3, None, list(range(6)))
+        self.assertEqual((first['worker_index'], second['worker_index']), (0, 1))
+        self.assertEqual((first['affinity'], second['affinity']), ([0, 1], [2, 3]))
+        held.close()
+        cpu_config._slot_lock_file.close()
+
+        with mock.patch.dict(os.environ, {'INFERENCE_WORKER_INDEX': '5'}):
+            self.assertEqual(self.compute(4, None, list(range(8)))['worker_index'], 1)
+
+    def test_detect_worker_count(self):
+        from .cpu_config import detect_worker_count
+
+        environ = {name: '' for name in ('INFERENCE_WORKERS', 'WEB_CONCURRENCY', 'GUNICORN_WORKERS')}
+        with mock.patch.dict(os.environ, environ):
+            with override_settings(INFERENCE_CPU_CONFIG={'WORKERS': 3}):
+                self.assertEqual(detect_worker_count(), 3)
+            with override_settings(INFERENCE_CPU_CONFIG={}):
+                self.assertEqual(detect_worker_count(), 1)
+                with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4'}):
+                    self.assertEqual(detect_worker_count(), 4)
+
+
+class WarmupReadinessTests(SimpleTestCase):
+    """起動時のウォームアップの判定とレディネス状態の遷移"""
+
+    def setUp(self):
+        from . import warmup
+
+        self.enterContext(mock.patch.dict(warmup._state))
+        environ = self.enterContext(mock.patch.dict(os.environ))
+        for name in ('INFERENCE_WARMUP', 'RUN_MAIN'):
+            environ.pop(name, None)
+
+    def test_should_warmup(self):
+        from .warmup import should_warmup
+
+        cases = [
+            (['gunicorn', 'backend.wsgi'], {}, True),
+            (['/usr/bin/uvicorn', 'backend.asgi:application'], {}, True),
+            (['manage.py', 'migrate'], {}, False),
+            (['manage.py', 'runserver'], {}, False),
+            (['manage.py', 'runserver'], {'RUN_MAIN': 'true'}, True),
+            (['manage.py', 'runserver', '--noreload'], {}, True),
+            (['script.py'], {}, False),
+            (['manage.py', 'migrate'], {'INFERENCE_WARMUP': '1'}, True),
+            (['gunicorn'], {'INFERENCE_WARMUP': 'false'}, False),
+        ]
+        for argv, environ, expected in cases:
+            with mock.patch.object(sys, 'argv', argv), mock.patch.dict(os.environ, environ):
+                self.assertEqual(should_warmup(), expected, (argv, environ))
+        with override_settings(INFERENCE_WARMUP={'ENABLED': False}), mock.patch.object(sys, 'argv', ['gunicorn']):
+            self.assertFalse(should_warmup())
+
+    def run_warmup(self, results):
+        from . import warmup
+
+        side_effect = results if isinstance(results, Exception) else None
+        with mock.patch.object(warmup, 'warmup_models', return_value=results, side_effect=side_effect):
+            warmup._run_warmup()
+        return warmup.get_readiness()
+
+    def test_readiness_transitions(self):
+        from . import warmup
+
+        self.assertTrue(warmup.get_readiness()['ready'])   # 無効時
+        warmup._set_state(status='pending')
+        self.assertFalse(warmup.is_ready())
+
+        readiness = self.run_warmup({1: {'total_time': 0.1}, 2: {'total_time': 0.2}})
+        self.assertEqual((readiness['status'], readiness['ready'], readiness['failed_apps']), ('ready', True, []))
+
+        readiness = self.run_warmup(RuntimeError('database unavailable'))
+        self.assertEqual((readiness['status'], readiness['ready']), ('failed', False))
+        self.assertEqual(readiness['error'], 'database unavailable')
+
+    def test_failed_apps_keep_pod_unready(self):
+        results = {1: {'total_time': 0.1}, 2: {'error': 'missing model file'}, 3: {'error': 'out of memory'}}
+        readiness = self.run_warmup(results)
+        self.assertEqual((readiness['status'], readiness['ready'], readiness['failed_apps']), ('failed', False, [2, 3]))
+        self.assertEqual(readiness['apps'], results)
+
+        with override_settings(INFERENCE_WARMUP={'REQUIRE_ALL_APPS': False}):
+            readiness = self.run_warmup(results)
+        self.assertEqual((readiness['status'], readiness['ready'], readiness['failed_apps']), ('ready', True, [2, 3]))
+
+
+class WarmupModelsTests(TestCase):
+    def test_records_load_and_warmup_failures(self):
+        from .warmup import warmup_models
+
+        loaded = MLApp.objects.create(name='loaded', description='demo', device_type='cpu')
+        broken = MLApp.objects.create(name='broken', description='demo', device_type='cpu')
+        missing = MLApp.objects.create(name='missing', description='demo', device_type='cpu')
+        classifiers = {loaded.pk: mock.Mock(), broken.pk: mock.Mock()}
+        classifiers[loaded.pk].warmup.return_value = {'iterations': 2}
+        classifiers[broken.pk].warmup.side_effect = RuntimeError('out of memory')
+
+        def get_classifier(ml_app):
+            if ml_app.pk not in classifiers:
+                raise FileNotFoundError('missing model file')
+            return classifiers[ml_app.pk]
+
+        with mock.patch('inference.model_registry.ModelRegistry.get_classifier', side_effect=get_classifier), \
+                mock.patch('inference.model_registry.get_model_key', side_effect=lambda ml_app: ml_app.pk):
+            results = warmup_models()
+        self.assertEqual(results[loaded.pk]['iterations'], 2)
+        self.assertEqual(results[broken.pk], {'error': 'out of memory'})
+        self.assertEqual(results[missing.pk], {'error': 'missing model file'})
+
+
+class DevicePrecisionTests(SimpleTestCase):
+    """デバイス種別・推論精度のフォールバック"""
+
+    def capabilities(self, default_device='cpu', cuda=None, cpu=('fp32',)):
+        return {
+            'default_device': default_device,
+            'cuda': {'available': cuda is not None, 'supported_precisions': list(cuda or ['fp32'])},
+            'mps': {'available': default_device == 'mps', 'supported_precisions': ['fp32']},
+            'cpu': {'available': True, 'supported_precisions': list(cpu)},
+        }
+
+    def patch_capabilities(self, **kwargs):
+        return mock.patch('inference.devices.get_device_capabilities', return_value=self.capabilities(**kwargs))
+
+    def test_cpu_without_bf16_falls_back_to_fp32(self):
+        from .devices import resolve_precision
+
+        with self.patch_capabilities():
+            self.assertEqual(resolve_precision('cpu', 'auto'), 'fp32')
+            self.assertEqual(resolve_precision('cpu', 'fp32'), 'fp32')
+            for precision in ('bf16', 'fp16'):
+                with self.assertLogs('inference.devices', 'WARNING'):
+                    self.assertEqual(resolve_precision('cpu', precision), 'fp32')
+
+    def test_cpu_with_bf16(self):
+        from .devices import resolve_precision
+
+        with self.patch_capabilities(cpu=('fp32', 'bf16')):
+            self.assertEqual(resolve_precision('cpu', 'auto'), 'bf16')
+            self.assertEqual(resolve_precision('cpu', 'bf16'), 'bf16')
+            with self.assertLogs('inference.devices', 'WARNING'):
+                self.assertEqual(resolve_precision('cpu', 'fp16'), 'fp32')
+
+    def test_cuda_prefers_fp16(self):
+        from .devices import get_supported_precisions, resolve_precision
+
+        with self.patch_capabilities(default_device='cuda', cuda=('fp32', 'fp16', 'bf16')):
+            self.assertEqual(resolve_precision('cuda', 'auto'), 'fp16')
+            self.assertEqual(resolve_precision('auto', 'auto'), 'fp16')
+            self.assertEqual(resolve_precision('cuda', 'bf16'), 'bf16')
+        # CUDA が利用できない場合は fp32 のみ
+        with self.patch_capabilities():
+            self.assertEqual(get_supported_precisions('cuda'), ['fp32'])
+            with self.assertLogs('inference.devices', 'WARNING'):
+                self.assertEqual(resolve_precision('cuda', 'fp16'), 'fp32')
+            with self.assertRaisesMessage(ValueError, 'Unknown precision: int8'):
+                resolve_precision('cpu', 'int8')
+
+    def test_resolve_auto_device_type(self):
+        from .devices import get_supported_precisions, resolve_device_type
+
+        for default_device in ('cuda', 'mps', 'cpu'):
+            cuda = ('fp32', 'fp16') if default_device == 'cuda' else None
+            with self.patch_capabilities(default_device=default_device, cuda=cuda):
+                self.assertEqual(resolve_device_type('auto'), default_device)
+                self.assertEqual(resolve_device_type('cpu'), 'cpu')
+        with self.patch_capabilities(default_device='cuda', cuda=('fp32', 'fp16')):
+            self.assertEqual(get_supported_precisions('auto'), ['fp32', 'fp16'])
+
+    def test_probe_reports_cpu_bf16_support(self):
+        from . import devices
+
+        for supported, expected in ((False, ['fp32']), (True, ['fp32', 'bf16'])):
+            with mock.patch.object(devices, '_cpu_supports_bf16', return_value=supported), \
+                    mock.patch('torch.cuda.is_available', return_value=False):
+                capabilities = devices._probe_devices()
+            self.assertEqual(capabilities['cpu']['supported_precisions'], expected)
+            self.assertEqual(capabilities['cuda']['supported_precisions'], ['fp32'])
+            self.assertIn(capabilities['default_device'], ('mps', 'cpu'))
@@ -0,0 +1,408 @@
+"""
+テキスト分類・感情分析推論（CPU, int8 量子化）
+
+- トークナイズ: NFKC 正規化・小文字化し、英数字は単語、空白で区切らない文字列（日本語等）は
+  文字と文字 bigram をトークンとして、ハッシュで語彙 ID に変換する。
+  同じ文の再トークナイズを避けるため、結果を LRU でメモ化する。
+- 長さバケット: 入力をトークン数順に並べてバッチに分け、バッチ内の最大長までのみパディングする
+  （バッチあたりのトークン数も MAX_BATCH_TOKENS までに抑える）。結果は入力順に戻す。
+- モデル: 埋め込み → トークンごとの全結合層 → マスク付き平均プーリング → 分類層。
+  全結合層の重みは quantize_dynamic で int8 に量子化し、CPU で実行する。
+  画像分類と異なり事前学習済みのデモモデルはないため、学習済みのモデルファイルが必須。
+
+image_classification と同じくモデルレジストリから設定・バージョンごとのインスタンスを取得し、
+バッチサイズはアプリの最適バッチサイズ（get_optimal_batch_size）を使用する。
+"""
+import re
+import time
+import json
+import random
+import logging
+import threading
+import unicodedata
+import zlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+from django.conf import settings
+
+from .cpu_config import ensure_cpu_config
+from .cuda_inference import summarize_logits
+
+logger = logging.getLogger(__name__)
+
+PAD_ID = 0
+# 英数字の単語、またはそれ以外の空白を含まない文字の並び
+TOKEN_PATTERN = re.compile(r"(?P<word>[a-z0-9]+(?:'[a-z]+)?)|(?P<chars>[^\sa-z0-9]+)")
+
+
+class HashingTokenizer:
+    """語彙ファイル不要のハッシュトークナイザ（エンコード結果は LRU でメモ化）"""
+
+    def __init__(self, vocab_size: int = 32768, max_length: int = 256, cache_size: int = 10000):
+        self.vocab_size = vocab_size
+        self.max_length = max_length
+        self.encode = lru_cache(maxsize=cache_size)(self._encode)
+
+    def tokenize(self, text: str) -> List[str]:
+        text = unicodedata.normalize('NFKC', text).lower()
+        tokens = []
+        for match in TOKEN_PATTERN.finditer(text):
+            token = match.group()
+            if match.lastgroup == 'word':
+                tokens.append(token)
+            else:
+                tokens.extend(token)
+                tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+        return tokens
+
+    def _encode(self, text: str) -> Tuple[int, ...]:
+        """トークン ID の列（PAD_ID は使用しない, max_length で切り詰め）"""
+        return tuple(
+            zlib.crc32(token.encode('utf-8')) % (self.vocab_size - 1) + 1
+            for token in self.tokenize(text)[:self.max_length]
+        )
+
+    def cache_stats(self) -> Dict:
+        info = self.encode.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            'hits': info.hits,
+            'misses': info.misses,
+            'entries': info.currsize,
+            'capacity': info.maxsize,
+            'hit_rate': info.hits / lookups if lookups else 0.0,
+        }
+
+    def config(self) -> Dict:
+        return {'type': 'hashing', 'vocab_size': self.vocab_size, 'max_length': self.max_length}
+
+
+def length_buckets(lengths: Sequence[int], batch_size: int,
+                   max_batch_tokens: Optional[int] = None) -> List[np.ndarray]:
+    """トークン数順に並べた入力番号をバッチに分割
+
+    各バッチは batch_size 件以下、かつ（件数 × バッチ内の最大長）が max_batch_tokens 以下。
+    """
+    order = np.argsort(np.asarray(lengths), kind='stable')
+    buckets = []
+    start = 0
+    while start < len(order):
+        end = start + 1
+        while end < len(order) and end - start < batch_size:
+            if max_batch_tokens and (end - start + 1) * max(lengths[order[end]], 1) > max_batch_tokens:
+                break
+            end += 1
+        buckets.append(order[start:end])
+        start = end
+    return buckets
+
+
+def pad_batch(sequences: Sequence[Tuple[int, ...]]) -> torch.Tensor:
+    """バッチ内の最大長までパディングした (N, L) の int64 テンソル"""
+    length = max(max((len(s) for s in sequences), default=0), 1)
+    batch = np.full((len(sequences), length), PAD_ID, dtype=np.int64)
+    for i, sequence in enumerate(sequences):
+        batch[i, :len(sequence)] = sequence
+    return torch.from_numpy(batch)
+
+
+class TextClassificationModel(nn.Module):
+    """埋め込み・トークンごとの全結合層・平均プーリングによる軽量テキスト分類モデル"""
+
+    def __init__(self, vocab_size: int, num_classes: int, embedding_dim: int = 128, hidden_dim: int = 256):
+        super().__init__()
+        self.embedding = nn.Embedding(vocab_size, embedding_dim, padding_idx=PAD_ID)
+        self.encoder = nn.Sequential(nn.Linear(embedding_dim, hidden_dim), nn.ReLU())
+        self.classifier = nn.Linear(hidden_dim, num_classes)
+
+    def forward(self, input_ids: torch.Tensor) -> torch.Tensor:
+        mask = (input_ids != PAD_ID).unsqueeze(-1).float()
+        hidden = self.encoder(self.embedding(input_ids))
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        return self.classifier(pooled)
+
+
+class TextClassifier:
+    """CPU 用テキスト分類器（テキスト分類・感情分析）
+
+    device_type は画像分類器と同じ値を受け取るが、int8 の動的量子化は CPU のみ対応のため
+    常に CPU で実行する。
+    """
+
+    def __init__(self, model_path: Optional[str] = None, device_type: str = 'auto',
+                 quantize: Optional[bool] = None):
+        if device_type not in ('auto', 'cpu'):
+            logger.warning(f"Text classification runs on CPU (requested {device_type})")
+        self.device_type = device_type
+        self.cpu_config = ensure_cpu_config()
+        self.device = torch.device('cpu')
+        self.quantize = _get_setting('QUANTIZE', True) if quantize is None else quantize
+        self.max_batch_tokens = _get_setting('MAX_BATCH_TOKENS', 8192)
+        self.model = None
+        self.tokenizer = None
+        self.classes = []
+        self.loaded = False
+
+        if not model_path:
+            # 未学習のモデルの予測は無意味なため、デモ用のモデルは作成しない
+            raise ValueError("Text classification requires a trained model file (model_file_path is not set)")
+        self.load_model(model_path)
+
+    @property
+    def precision(self) -> str:
+        return 'int8' if self.quantize else 'fp32'
+
+    def _build(self, classes: List[str], vocab_size: int, max_length: int,
+               embedding_dim: int, hidden_dim: int, state_dict: Optional[Dict] = None):
+        self.classes = list(classes)
+        self.tokenizer = HashingTokenizer(
+            vocab_size=vocab_size, max_length=max_length,
+            cache_size=_get_setting('TOKENIZER_CACHE_SIZE', 10000),
+        )
+        model = TextClassificationModel(vocab_size, len(self.classes), embedding_dim, hidden_dim)
+        if state_dict is not None:
+            model.load_state_dict(state_dict)
+        model.eval()
+        if self.quantize:
+            # 全結合層の重みを int8 に量子化（活性化は実行時に動的に量子化）
+            try:
+                model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+            except (AttributeError, RuntimeError) as e:
+                logger.warning(f"Dynamic quantization unavailable, using fp32 text model: {e}")
+                self.quantize = False
+        self.model = model
+        self.loaded = True
+
+    def load_model(self, model_path: str):
+        """学習済みモデルを読み込み（クラスは model_info.json の classes）
+
+        読み込めない場合は例外を送出する（CUDAImageClassifier.load_model と同様）。
+        """
+        model_path = Path(model_path)
+        if not model_path.exists():
+            raise FileNotFoundError(f"Model file not found: {model_path}")
+
+        try:
+            checkpoint = torch.load(model_path, map_location='cpu')
+            model_type = checkpoint.get('model_type') if isinstance(checkpoint, dict) else None
+            if model_type != 'text_classification':
+                raise ValueError(f"Unsupported text model type: {model_type}")
+
+            classes = checkpoint.get('classes')
+            model_info_path = model_path.parent / 'model_info.json'
+            if model_info_path.exists():
+                with open(model_info_path, 'r') as f:
+                    classes = json.load(f).get('classes', classes)
+            state_dict = checkpoint['model_state_dict']
+            num_classes = state_dict['classifier.weight'].shape[0]
+            if not classes or len(classes) != num_classes:
+                classes = [f'class_{i}' for i in range(num_classes)]
+
+            self._build(
+                classes,
+                vocab_size=state_dict['embedding.weight'].shape[0],
+                max_length=checkpoint.get('max_length', _get_setting('MAX_LENGTH', 256)),
+                embedding_dim=state_dict['embedding.weight'].shape[1],
+                hidden_dim=state_dict['classifier.weight'].shape[1],
+                state_dict=state_dict,
+            )
+        except Exception as e:
+            logger.error(f"Failed to load text model from {model_path}: {e}")
+            raise
+
+        logger.info(f"Text model loaded from {model_path} on {self.device} ({self.precision})")
+
+    def encode(self, texts: Sequence[str]) -> List[Tuple[int, ...]]:
+        return [self.tokenizer.encode(text) for text in texts]
+
+    def predict_encoded(self, sequences: Sequence[Tuple[int, ...]], batch_size: int = 32,
+                        top_k: Optional[int] = None, min_confidence: Optional[float] = None,
+                        bucketing: bool = True) -> List[Dict]:
+        """トークン ID 列のバッチ推論（bucketing=True で長さ順にバッチ化し、結果は入力順）"""
+        if not self.loaded:
+            raise RuntimeError("Model not loaded")
+
+        lengths = [len(s) for s in sequences]
+        if bucketing:
+            buckets = length_buckets(lengths, batch_size, self.max_batch_tokens)
+        else:
+            buckets = [np.arange(i, min(i + batch_size, len(sequences))) for i in range(0, len(sequences), batch_size)]
+
+        results = [None] * len(sequences)
+        for indices in buckets:
+            start_time = time.time()
+            input_ids = pad_batch([sequences[i] for i in indices])
+            with torch.no_grad():
+                outputs = self.model(input_ids)
+            batch_results = summarize_logits(outputs, self.classes, top_k, min_confidence)
+            processing_time = (time.time() - start_time) / len(indices)
+            for i, result in zip(indices.tolist(), batch_results):
+                result.update({
+                    'num_tokens': lengths[i],
+                    'processing_time': processing_time,
+                    'device': str(self.device),
+                })
+                results[i] = result
+        return results
+
+    def predict_texts(self, texts: Sequence[str], batch_size: int = 32,
+                      top_k: Optional[int] = None, min_confidence: Optional[float] = None) -> List[Dict]:
+        """テキストのバッチ推論（トークナイズはメモ化, 長さ順にバッチ化）"""
+        return self.predict_encoded(self.encode(texts), batch_size, top_k, min_confidence)
+
+    def predict(self, text: str, top_k: Optional[int] = None,
+                min_confidence: Optional[float] = None) -> Dict:
+        return self.predict_texts([text], batch_size=1, top_k=top_k, min_confidence=min_confidence)[0]
+
+    def predict_batch(self, texts: List[str], batch_size: int = 8,
+                      top_k: Optional[int] = None, min_confidence: Optional[float] = None) -> List[Dict]:
+        return self.predict_texts(texts, batch_size, top_k, min_confidence)
+
+    def get_device_info(self) -> Dict:
+        return {
+            'device_type': str(self.device),
+            'device_name': str(self.device),
+            'precision': self.precision,
+            'supported_precisions': ['fp32', 'int8'],
+            'quantized_engine': torch.backends.quantized.engine if self.quantize else None,
+            'tokenizer': dict(self.tokenizer.config(), cache=self.tokenizer.cache_stats()),
+            'cpu_execution': self.cpu_config,
+        }
+
+    def warmup(self, batch_sizes: List[int] = (1,), iterations: int = 2) -> Dict:
+        """指定バッチサイズで事前に推論を実行"""
+        if not self.loaded:
+            raise RuntimeError("Model not loaded")
+
+        texts = _synthetic_texts(max(batch_sizes), max_words=32, seed=0)
+        timings = {}
+        for batch_size in batch_sizes:
+            start_time = time.time()
+            for _ in range(iterations):
+                self.predict_texts(texts[:batch_size], batch_size=batch_size)
+            timings[batch_size] = (time.time() - start_time) / iterations
+
+        return {
+            'device': str(self.device),
+            'precision': self.precision,
+            'batch_sizes': list(batch_sizes),
+            'average_time_per_batch': timings
+        }
+
+    def benchmark(self, num_iterations: int = 100, num_texts: int = 256, batch_size: int = 32) -> Dict:
+        """スループットのベンチマーク
+
+        長さのばらつく合成テキストを num_iterations 回推論し、長さバケットの有無で
+        スループットとパディングの割合を比較する（トークナイズはキャッシュ済みの状態で計測）。
+        """
+        if not self.loaded:
+            raise RuntimeError("Model not loaded")
+
+        texts = _synthetic_texts(num_texts, max_words=self.tokenizer.max_length, seed=0)
+        start_time = time.time()
+        sequences = self.encode(texts)
+        tokenize_time = time.time() - start_time
+        start_time = time.time()
+        self.encode(texts)
+        cached_tokenize_time = time.time() - start_time
+
+        lengths = [len(s) for s in sequences]
+        modes = {}
+        for bucketing in (True, False):
+            if bucketing:
+                buckets = length_buckets(lengths, batch_size, self.max_batch_tokens)
+            else:
+                buckets = [np.arange(i, min(i + batch_size, num_texts)) for i in range(0, num_texts, batch_size)]
+            padded_tokens = sum(len(b) * max(max(lengths[i] for i in b), 1) for b in buckets)
+
+            self.predict_encoded(sequences, batch_size, bucketing=bucketing)
+            start_time = time.time()
+            for _ in range(num_iterations):
+                self.predict_encoded(sequences, batch_size, bucketing=bucketing)
+            total_time = time.time() - start_time
+
+            modes['bucketed' if bucketing else 'unbucketed'] = {
+                'total_time': total_time,
+                'throughput_texts_per_sec': num_texts * num_iterations / total_time if total_time > 0 else 0.0,
+                'batches': len(buckets),
+                'padding_ratio': 1 - sum(lengths) / padded_tokens if padded_tokens else 0.0,
+            }
+
+        bucketed = modes['bucketed']
+        return {
+            'total_time': bucketed['total_time'],
+            'average_time_per_inference': bucketed['total_time'] / (num_texts * num_iterations),
+            'throughput_fps': bucketed['throughput_texts_per_sec'],
+            'device': str(self.device),
+            'precision': self.precision,
+            'iterations': num_iterations,
+            'num_texts': num_texts,
+            'batch_size': batch_size,
+            'average_tokens': float(np.mean(lengths)),
+            'tokenize_time': tokenize_time,
+            'cached_tokenize_time': cached_tokenize_time,
+            'bucketing_speedup': (
+                modes['unbucketed']['total_time'] / bucketed['total_time'] if bucketed['total_time'] > 0 else 0.0
+            ),
+            'modes': modes,
+        }
+
+
+def _synthetic_texts(count: int, max_words: int, seed: int = 0) -> List[str]:
+    """長さのばらつくダミーテキスト（短文が多く、長文が少ない分布）"""
+    rng = random.Random(seed)
+    words = ['good', 'bad', 'great', 'terrible', 'service', 'product', 'delivery', 'price',
+             'quality', 'support', 'とても', '良い', '悪い', '満足', '残念', 'です']
+    texts = []
+    for i in range(count):
+        length = min(max_words, max(1, int(rng.expovariate(1 / 24))))
+        texts.append(' '.join(rng.choice(words) for _ in range(length)) + f' #{i}')
+    return texts
+
+
+# グローバルインスタンス（設定ごとのシングルトン）
+_text_classifier_instances = {}
+_text_classifier_lock = threading.Lock()
+
+
+def get_text_classifier(device_type: str = 'auto', precision: str = 'fp32',
+                        channels_last: bool = True, model_path: Optional[str] = None,
+                        model_version: Optional[str] = None) -> TextClassifier:
+    """設定ごとのテキスト分類器を取得
+
+    引数は画像分類器と共通（model_version はキャッシュのキーにのみ使用）。
+    precision・channels_last は使用せず、精度は INFERENCE_TEXT['QUANTIZE'] で決まる。
+    """
+    key = (device_type, precision, model_path, model_version)
+    classifier = _text_classifier_instances.get(key)
+    if classifier is None:
+        with _text_classifier_lock:
+            classifier = _text_classifier_instances.get(key)
+            if classifier is None:
+                classifier = TextClassifier(model_path=model_path, device_type=device_type)
+                _text_classifier_instances[key] = classifier
+    return classifier
+
+
+def release_text_classifier(device_type: str = 'auto', precision: str = 'fp32',
+                            channels_last: bool = True, model_path: Optional[str] = None,
+                            model_version: Optional[str] = None):
+    """テキスト分類器をキャッシュから外す（参照中のリクエストが終われば解放される）"""
+    with _text_classifier_lock:
+        return _text_classifier_instances.pop((device_type, precision, model_path, model_version), None)
+
+
+def reset_text_classifier():
+    """テキスト分類器インスタンスをリセット"""
+    with _text_classifier_lock:
+        _text_classifier_instances.clear()
+
+
+def _get_setting(name: str, default=None):
+    """settings.INFERENCE_TEXT から設定値を取得"""
+    return getattr(settings, 'INFERENCE_TEXT', {}).get(name, default)
@@ -0,0 +1,228 @@
+"""
+アップロードファイルのコピーを減らすアップロードハンドラ
+
+小さなファイルは1つの bytearray に受信して memoryview で参照し、大きなファイルは
+1つの一時ファイルにだけ書き出してデコード時にメモリマップする。一時ファイルは
+保存先ストレージと同じファイルシステムに作成し、ImageUpload の保存時は
+コピーではなくリネームで移動される（FileSystemStorage の temporary_file_path 対応）。
+
+StreamingDecodeUploadHandler は加えて、受信中にハッシュの計算と画像のデコードを行う。
+"""
+import io
+import os
+import mmap
+import hashlib
+import tempfile
+import functools
+import contextlib
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile, TemporaryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+
+
+class MemoryViewIO(io.RawIOBase):
+    """memoryview をコピーせずに読み出すファイルオブジェクト"""
+
+    def __init__(self, buffer: memoryview):
+        self._buffer = buffer
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        data = self._buffer[self._position:self._position + len(b)]
+        b[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = len(self._buffer) + offset
+        self._position = max(0, self._position)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def getbuffer(self) -> memoryview:
+        return self._buffer
+
+
+class MemoryViewUploadedFile(UploadedFile):
+    """受信バッファを memoryview で共有するアップロードファイル"""
+
+    def __init__(self, buffer: memoryview, name, content_type, size, charset, content_type_extra=None):
+        super().__init__(MemoryViewIO(buffer), name, content_type, size, charset, content_type_extra)
+        self.buffer = buffer
+
+    def open(self, mode=None):
+        self.file.seek(0)
+        return self
+
+    def chunks(self, chunk_size=None):
+        # ストレージはチャンクの型でバイナリ/テキストを判定するため bytes で渡す
+        # （1チャンク分のみの一時コピーで、全体を複製しない）
+        chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+        for start in range(0, len(self.buffer), chunk_size):
+            yield self.buffer[start:start + chunk_size].tobytes()
+
+    def multiple_chunks(self, chunk_size=None):
+        return False
+
+
+class MappedTemporaryUploadedFile(TemporaryUploadedFile):
+    """保存先と同じファイルシステム上の一時ファイルに受信するアップロードファイル"""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None, temp_dir=None):
+        _, ext = os.path.splitext(name)
+        file = tempfile.NamedTemporaryFile(suffix='.upload' + ext, dir=temp_dir)
+        UploadedFile.__init__(self, file, name, content_type, size, charset, content_type_extra)
+
+
+class ZeroCopyUploadHandler(FileUploadHandler):
+    """小さなファイルは単一バッファ、大きなファイルは単一の一時ファイルで受信"""
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # リクエスト全体が閾値以下ならメモリ上で受信
+        self.in_memory = content_length <= settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        if self.in_memory:
+            self.buffer = bytearray()
+        else:
+            self.file = MappedTemporaryUploadedFile(
+                self.file_name, self.content_type, 0, self.charset, self.content_type_extra,
+                temp_dir=get_upload_temp_dir()
+            )
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.in_memory:
+            self.buffer += raw_data
+        else:
+            self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.in_memory:
+            return MemoryViewUploadedFile(
+                memoryview(self.buffer)[:file_size],
+                self.file_name, self.content_type, file_size, self.charset, self.content_type_extra
+            )
+        self.file.seek(0)
+        self.file.size = file_size
+        return self.file
+
+    def upload_interrupted(self):
+        if not self.in_memory and hasattr(self, 'file'):
+            temp_location = self.file.temporary_file_path()
+            try:
+                self.file.close()
+                os.remove(temp_location)
+            except FileNotFoundError:
+                pass
+
+
+class StreamingDecodeUploadHandler(ZeroCopyUploadHandler):
+    """受信と同時に内容のハッシュと画像のデコードを行うアップロードハンドラ
+
+    受信したチャンクを順に SHA-256 と IncrementalImageDecoder に渡すため、リクエストの
+    受信が終わった時点でハッシュ（hash_file）とデコード結果（decode_image）が揃っている。
+    遅い回線からの大きな画像では、デコード時間がネットワーク転送時間に隠れる。
+    """
+
+    def new_file(self, *args, **kwargs):
+        self.digest = hashlib.sha256()
+        self.decoder = None
+        # 受信中のデコードは推論サイズ（TARGET_SIZE）の画像分類向けのため、ビューが
+        # request.streaming_decode = False とした場合（物体検知等）は行わない
+        if _get_decode_setting('STREAMING_DECODE', True) and getattr(self.request, 'streaming_decode', True):
+            from .image_decoding import IncrementalImageDecoder
+            self.decoder = IncrementalImageDecoder()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        if self.decoder is not None:
+            self.decoder.feed(raw_data)
+        super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded_file = super().file_complete(file_size)
+        uploaded_file.content_hash = self.digest.hexdigest()
+        if self.decoder is not None:
+            uploaded_file.streamed_decode = self.decoder.close()
+        return uploaded_file
+
+    def upload_interrupted(self):
+        if getattr(self, 'decoder', None) is not None:
+            self.decoder.abort('upload interrupted')
+        super().upload_interrupted()
+
+
+def get_upload_temp_dir():
+    """一時ファイルの作成先（保存時にリネームで移動できるようストレージと同じ場所）
+
+    MEDIA_ROOT が未設定の場合（ストレージの場所がカレントディレクトリになる）は
+    None（システムの一時ディレクトリ）を返す。
+    """
+    if settings.FILE_UPLOAD_TEMP_DIR:
+        return settings.FILE_UPLOAD_TEMP_DIR
+    location = getattr(default_storage, 'location', None)
+    if not settings.MEDIA_ROOT or not location:
+        return None
+    return _ensure_temp_dir(location)
+
+
+@functools.lru_cache(maxsize=None)
+def _ensure_temp_dir(location: str) -> str:
+    """ストレージの場所ごとに1回だけ一時ディレクトリを作成"""
+    temp_dir = os.path.join(location, '.upload_tmp')
+    os.makedirs(temp_dir, exist_ok=True)
+    return temp_dir
+
+
+def hash_file(file) -> str:
+    """ファイル内容の SHA-256（受信バッファはコピーせずにハッシュ, 受信中に計算済みであれば再利用）"""
+    content_hash = getattr(file, 'content_hash', None)
+    if content_hash:
+        return content_hash
+    digest = hashlib.sha256()
+    if isinstance(file, MemoryViewUploadedFile):
+        digest.update(file.buffer)
+        return digest.hexdigest()
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    for chunk in file.chunks() if hasattr(file, 'chunks') else iter(lambda: file.read(1024 * 1024), b''):
+        digest.update(chunk)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    return digest.hexdigest()
+
+
+@contextlib.contextmanager
+def open_for_decoding(uploaded_file):
+    """デコード用にアップロードファイルを開く（一時ファイルはメモリマップ）"""
+    if hasattr(uploaded_file, 'temporary_file_path') and uploaded_file.size:
+        with open(uploaded_file.temporary_file_path(), 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                yield mapped
+        return
+    if hasattr(uploaded_file, 'seek'):
+        uploaded_file.seek(0)
+    yield uploaded_file
+
+
+def _get_decode_setting(name: str, default=None):
+    """settings.INFERENCE_IMAGE_DECODE から設定値を取得"""
+    return getattr(settings, 'INFERENCE_IMAGE_DECODE', {}).get(name, default)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import MLAppViewSet, PredictionLogViewSet, api_root
+from .views import MLAppViewSet, PredictionLogViewSet, api_root, healthz, readyz
 
 router = DefaultRouter()
 router.register(r'ml-apps', MLAppViewSet)
@@ -8,5 +8,7 @@ router.register(r'logs', PredictionLogViewSet)
 
 urlpatterns = [
     path('', api_root, name='api-root'),
+    path('healthz', healthz, name='healthz'),
+    path('readyz', readyz, name='readyz'),
     path('api/', include(router.urls)),
 ]
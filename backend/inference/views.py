@@ -2,7 +2,6 @@ import time
 import random
 import logging
 from io import BytesIO
-from PIL import Image
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
@@ -10,14 +9,125 @@ from rest_framework.parsers import MultiPartParser, JSONParser
 from django.utils import timezone
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+from django.db import transaction
 
 from .models import MLApp, PredictionLog, ImageUpload
 from .serializers import MLAppSerializer, PredictionInputSerializer, PredictionOutputSerializer, PredictionLogSerializer
-from .cuda_inference import get_classifier
+from .image_decoding import ImageDecodeError, decode_image
+from .warmup import get_readiness
+from .shadow import maybe_submit_shadow
+from .model_registry import TEXT_APP_TYPES, get_model_key, get_model_registry
+from .coalescing import get_request_coalescer, is_enabled as coalescing_enabled
+from .upload_handlers import StreamingDecodeUploadHandler, hash_file
+from .admission import admission_controlled, get_admission_controller
+from .perceptual_hash import apply_output_options, dhash, get_near_duplicate_index, near_duplicate_stats, to_signed
+from .parsers import NpyTensorParser, RawImageParser, RawTensorParser
 
 logger = logging.getLogger(__name__)
 
+def get_app_classifier(ml_app):
+    """アプリで使用中のモデルの分類器を取得（torch/torchvision は初回の推論時にのみ読み込む）
+
+    モデルが更新されている場合はバックグラウンドで読み込み、切り替わるまで現在のモデルを使用する。
+    """
+    return get_model_registry().get_classifier(ml_app)
+
+def parse_output_options(request):
+    """推論結果の出力オプション（top_k / min_confidence）を取得"""
+    def _get(name):
+        value = request.data.get(name)
+        if value in (None, ''):
+            value = request.query_params.get(name)
+        return None if value in (None, '') else value
+    
+    top_k = _get('top_k')
+    if top_k is not None:
+        try:
+            top_k = int(top_k)
+        except (TypeError, ValueError):
+            raise ValueError('top_k must be an integer')
+        if top_k < 1:
+            raise ValueError('top_k must be at least 1')
+    
+    min_confidence = _get('min_confidence')
+    if min_confidence is not None:
+        try:
+            min_confidence = float(min_confidence)
+        except (TypeError, ValueError):
+            raise ValueError('min_confidence must be a number')
+        if not 0.0 <= min_confidence <= 1.0:
+            raise ValueError('min_confidence must be between 0 and 1')
+    
+    return top_k, min_confidence
+
+def parse_iterations(request, default: int, minimum: int, maximum: int) -> int:
+    """計測の反復回数（iterations）を取得し minimum-maximum の範囲に収める"""
+    iterations = request.data.get('iterations')
+    if iterations in (None, ''):
+        return default
+    try:
+        iterations = int(iterations)
+    except (TypeError, ValueError):
+        raise ValueError('iterations must be an integer')
+    return min(max(iterations, minimum), maximum)
+
+# テキスト分類・感情分析の入力の上限
+MAX_TEXTS_PER_BATCH = 256
+MAX_TEXT_LENGTH = 10000
+
+def parse_texts(request, field):
+    """リクエストから入力テキストを取得（field または JSON の data[field]）
+
+    field が 'texts' の場合はリストを返す（multipart では同名フィールドの繰り返し）。
+    """
+    if field == 'texts' and hasattr(request.data, 'getlist'):
+        value = request.data.getlist('texts') or None
+    else:
+        value = request.data.get(field)
+    if value is None and isinstance(request.data.get('data'), dict):
+        value = request.data['data'].get(field)
+    
+    texts = value if field == 'texts' else [value]
+    if not isinstance(texts, list) or not texts or not all(isinstance(t, str) and t.strip() for t in texts):
+        raise ValueError('Text is required' if field == 'text' else 'texts must be a non-empty list of strings')
+    if len(texts) > MAX_TEXTS_PER_BATCH:
+        raise ValueError(f'Maximum {MAX_TEXTS_PER_BATCH} texts allowed per batch')
+    if any(len(t) > MAX_TEXT_LENGTH for t in texts):
+        raise ValueError(f'Text must be at most {MAX_TEXT_LENGTH} characters')
+    return texts
+
+EMBEDDING_OUTPUTS = ('npy', 'raw', 'json')
+
+def embeddings_response(embeddings, output, ids=None):
+    """埋め込み (N, D) float16 を指定形式で返す
+
+    npy は numpy.load で読める .npy、raw はヘッダーなしの行優先の float16 バイト列
+    （形状は X-Embedding-Shape ヘッダー）。
+    """
+    import numpy as np
+
+    if output == 'json':
+        return Response({
+            'ids': ids,
+            'shape': list(embeddings.shape),
+            'dtype': 'float16',
+            'embeddings': embeddings.astype(np.float32).tolist()
+        }, status=status.HTTP_200_OK)
+
+    if output == 'npy':
+        buffer = BytesIO()
+        np.save(buffer, embeddings, allow_pickle=False)
+        response = HttpResponse(buffer.getvalue(), content_type='application/x-npy')
+        response['Content-Disposition'] = 'attachment; filename="embeddings.npy"'
+    else:
+        response = HttpResponse(np.ascontiguousarray(embeddings).tobytes(), content_type='application/octet-stream')
+    response['X-Embedding-Shape'] = ','.join(str(n) for n in embeddings.shape)
+    response['X-Embedding-Dtype'] = 'float16'
+    if ids is not None:
+        response['X-Embedding-Ids'] = ','.join(str(i) for i in ids)
+    return response
+
 @api_view(['GET'])
 def api_root(request):
     """API情報ルート"""
@@ -26,31 +136,73 @@ def api_root(request):
         'version': '1.0.0',
         'endpoints': {
             'ml_apps': '/api/ml-apps/',
+            'healthz': '/healthz',
+            'readyz': '/readyz',
             'logs': '/api/logs/',
             'admin': '/admin/',
         },
         'available_actions': {
             'predict': 'POST /api/ml-apps/{id}/predict/',
             'batch_predict': 'POST /api/ml-apps/{id}/predict_batch/',
+            'predict_tensor': 'POST /api/ml-apps/{id}/predict_tensor/',
             'device_info': 'GET /api/ml-apps/{id}/device_info/',
             'benchmark': 'POST /api/ml-apps/{id}/benchmark/',
+            'validate_precision': 'POST /api/ml-apps/{id}/validate_precision/',
+            'shadow_stats': 'GET /api/ml-apps/{id}/shadow_stats/',
+            'coalescing_stats': 'GET /api/ml-apps/{id}/coalescing_stats/',
+            'embeddings': 'POST /api/ml-apps/{id}/embeddings/',
         },
         'status': 'running'
     })
 
+@api_view(['GET'])
+def healthz(request):
+    """プロセスの生存確認"""
+    return Response({'status': 'ok'})
+
+@api_view(['GET'])
+def readyz(request):
+    """モデルのウォームアップ完了確認（未完了時は503）"""
+    readiness = get_readiness()
+    readiness['admission'] = get_admission_controller().stats()
+    return Response(
+        readiness,
+        status=status.HTTP_200_OK if readiness['ready'] else status.HTTP_503_SERVICE_UNAVAILABLE
+    )
+
 class MLAppViewSet(viewsets.ReadOnlyModelViewSet):
     """ML アプリの一覧・詳細取得"""
     queryset = MLApp.objects.filter(is_active=True)
     serializer_class = MLAppSerializer
     parser_classes = [MultiPartParser, JSONParser]
+    
+    def initialize_request(self, request, *args, **kwargs):
+        # 推論用のアップロードのみ、小さなファイルは単一バッファ、大きなファイルは保存先と同じ場所の
+        # 一時ファイル1つで受信し、受信中に内容のハッシュの計算と画像のデコードを行う
+        # （管理画面等のアップロードは Django の既定のハンドラ）
+        request.upload_handlers = [StreamingDecodeUploadHandler(request)]
+        if request.method == 'POST' and kwargs.get('pk'):
+            # 受信中のデコードは TARGET_SIZE で行うため、入力サイズの異なる物体検知等では行わない
+            # （受信後に改めてデコードされ、デコードとメモリ予算の確保が二重になる）
+            app_type = MLApp.objects.filter(pk=kwargs['pk']).values_list('app_type', flat=True).first()
+            request.streaming_decode = app_type == 'image_classification'
+        return super().initialize_request(request, *args, **kwargs)
 
-    @action(detail=True, methods=['post'])
+    @action(detail=True, methods=['post'], parser_classes=[MultiPartParser, JSONParser, RawImageParser])
+    @admission_controlled('interactive')
     def predict(self, request, pk=None):
-        """特定のMLアプリで推論を実行"""
+        """特定のMLアプリで推論を実行
+
+        画像は multipart の image、またはリクエストボディに画像のバイト列をそのまま
+        指定する（Content-Type: image/jpeg 等, ファイル名は ?filename=）。
+        """
         ml_app = self.get_object()
         
-        # 画像分類以外はまだ未対応
-        if ml_app.app_type != 'image_classification':
+        if ml_app.app_type in TEXT_APP_TYPES:
+            return self.run_text_classification(request, ml_app, 'text')
+        
+        # 画像分類・物体検知・テキスト分類以外はまだ未対応
+        if ml_app.app_type not in ('image_classification', 'object_detection'):
             return Response({
                 'error': f'App type {ml_app.app_type} is not yet supported'
             }, status=status.HTTP_400_BAD_REQUEST)
@@ -63,30 +215,81 @@ class MLAppViewSet(viewsets.ReadOnlyModelViewSet):
         
         image_file = request.FILES['image']
         
+        if ml_app.app_type == 'object_detection':
+            return self.run_detection(request, ml_app, [image_file], single=True)
+        
         try:
-            # 画像を開く
-            image = Image.open(image_file)
+            top_k, min_confidence = parse_output_options(request)
+        except ValueError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        near_duplicate_index = get_near_duplicate_index(ml_app)
+        
+        def run_prediction():
+            # 上限を確認しつつ縮小デコード
+            image, image_info = decode_image(image_file)
+            start_time = time.time()
+            perceptual_hash = dhash(image)
             
-            # CUDA分類器を取得
-            classifier = get_classifier(device_type=ml_app.device_type)
+            if near_duplicate_index is not None:
+                # 再エンコード・リサイズされた同じ画像は過去の推論結果を再利用（順伝播を省略）
+                match = near_duplicate_index.query(perceptual_hash)
+                if match is not None:
+                    (previous, prediction_id), distance = match
+                    result = dict(previous, near_duplicate={'prediction_id': prediction_id, 'distance': distance})
+                    return result, image_info, None, time.time() - start_time, perceptual_hash
             
-            # 推論実行
-            start_time = time.time()
-            result = classifier.predict(image)
-            processing_time = time.time() - start_time
+            # CUDA分類器を取得
+            classifier = get_app_classifier(ml_app)
             
+            # 推論実行（前処理済み配列はシャドー推論でも再利用）
+            array = classifier.prepare_image(image)
+            if near_duplicate_index is not None:
+                # インデックスには全クラスの確率を保存し、出力オプションは後で適用
+                result = classifier.predict_arrays(array[None])[0]
+            else:
+                result = classifier.predict_arrays(array[None], top_k=top_k, min_confidence=min_confidence)[0]
+            return result, image_info, array, time.time() - start_time, perceptual_hash
+        
+        try:
+            if coalescing_enabled():
+                # 同一画像・同一モデルの同時リクエストは1回のデコード・推論の結果を共有
+                key = (ml_app.pk, get_model_key(ml_app), hash_file(image_file), top_k, min_confidence)
+                (result, image_info, array, processing_time, perceptual_hash), coalesced = get_request_coalescer().do(
+                    key, run_prediction, group=ml_app.pk
+                )
+            else:
+                (result, image_info, array, processing_time, perceptual_hash), coalesced = run_prediction(), False
+        except ImageDecodeError as e:
+            return Response({
+                'error': str(e)
+            }, status=e.status_code)
+        except Exception as e:
+            logger.error(f"Prediction error: {e}")
+            return Response({
+                'error': f'Prediction failed: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        full_result = result
+        if near_duplicate_index is not None:
+            result = apply_output_options(result, top_k, min_confidence)
+        
+        try:
             # ログ保存
             prediction_log = PredictionLog.objects.create(
                 ml_app=ml_app,
                 input_data={
                     'filename': image_file.name,
                     'size': image_file.size,
-                    'format': image.format or 'Unknown'
+                    'format': image_info['format'] or 'Unknown'
                 },
                 output_data=result,
                 confidence_score=result.get('confidence', 0.0),
                 predicted_class=result.get('predicted_class', 'unknown'),
-                processing_time=processing_time
+                processing_time=processing_time,
+                perceptual_hash=to_signed(perceptual_hash)
             )
             
             # 画像保存
@@ -95,10 +298,19 @@ class MLAppViewSet(viewsets.ReadOnlyModelViewSet):
                 image=image_file,
                 original_filename=image_file.name,
                 file_size=image_file.size,
-                image_width=image.width,
-                image_height=image.height
+                image_width=image_info['width'],
+                image_height=image_info['height']
             )
             
+            # 候補モデルのシャドー推論（サンプリング・バックグラウンド実行、共有・再利用した結果は対象外）
+            if not coalesced and array is not None:
+                # レイテンシは候補モデルと同じ区間（predict_arrays の処理時間）で比較
+                transaction.on_commit(lambda: maybe_submit_shadow(
+                    ml_app, array, result, result['processing_time'], prediction_log.id
+                ))
+                if near_duplicate_index is not None:
+                    near_duplicate_index.add(perceptual_hash, (full_result, prediction_log.id))
+            
             # レスポンス構築
             response_data = {
                 'prediction_id': prediction_log.id,
@@ -108,11 +320,13 @@ class MLAppViewSet(viewsets.ReadOnlyModelViewSet):
                 'class_probabilities': result['class_probabilities'],
                 'processing_time': processing_time,
                 'device': result['device'],
+                'coalesced': coalesced,
+                'near_duplicate': result.get('near_duplicate'),
                 'image_info': {
-                    'width': image.width,
-                    'height': image.height,
-                    'format': image.format,
-                    'mode': image.mode
+                    'width': image_info['width'],
+                    'height': image_info['height'],
+                    'format': image_info['format'],
+                    'mode': image_info['mode']
                 }
             }
             
@@ -125,11 +339,15 @@ class MLAppViewSet(viewsets.ReadOnlyModelViewSet):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     @action(detail=True, methods=['post'])  
+    @admission_controlled('batch')
     def predict_batch(self, request, pk=None):
-        """バッチ推論（複数画像を一度に処理）"""
+        """バッチ推論（複数画像・複数テキストを一度に処理）"""
         ml_app = self.get_object()
         
-        if ml_app.app_type != 'image_classification':
+        if ml_app.app_type in TEXT_APP_TYPES:
+            return self.run_text_classification(request, ml_app, 'texts')
+        
+        if ml_app.app_type not in ('image_classification', 'object_detection'):
             return Response({
                 'error': f'App type {ml_app.app_type} is not yet supported'
             }, status=status.HTTP_400_BAD_REQUEST)
@@ -146,36 +364,77 @@ class MLAppViewSet(viewsets.ReadOnlyModelViewSet):
                 'error': 'Maximum 10 images allowed per batch'
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        if ml_app.app_type == 'object_detection':
+            return self.run_detection(request, ml_app, images)
+        
         try:
-            # 画像を開く
-            pil_images = []
-            image_infos = []
-            
-            for img_file in images:
-                image = Image.open(img_file)
-                pil_images.append(image)
-                image_infos.append({
-                    'filename': img_file.name,
-                    'size': img_file.size,
-                    'width': image.width,
-                    'height': image.height,
-                    'format': image.format
-                })
-            
-            # CUDA分類器を取得
-            classifier = get_classifier(device_type=ml_app.device_type)
-            
-            # バッチ推論実行
+            top_k, min_confidence = parse_output_options(request)
+        except ValueError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        # 上限を確認しつつ縮小デコード
+        pil_images = []
+        image_infos = []
+        perceptual_hashes = []
+        
+        for img_file in images:
+            try:
+                image, decoded_info = decode_image(img_file)
+            except ImageDecodeError as e:
+                return Response({
+                    'error': f'{img_file.name}: {e}'
+                }, status=e.status_code)
+            pil_images.append(image)
+            perceptual_hashes.append(dhash(image))
+            image_infos.append({
+                'filename': img_file.name,
+                'size': img_file.size,
+                'width': decoded_info['width'],
+                'height': decoded_info['height'],
+                'format': decoded_info['format']
+            })
+        
+        try:
+            near_duplicate_index = get_near_duplicate_index(ml_app)
+            batch_results = [None] * len(pil_images)
             start_time = time.time()
-            batch_results = classifier.predict_batch(
-                pil_images, 
-                batch_size=ml_app.get_optimal_batch_size()
-            )
+            if near_duplicate_index is not None:
+                # 近似重複の画像は過去の推論結果を再利用し、残りの画像のみ推論
+                for i, perceptual_hash in enumerate(perceptual_hashes):
+                    lookup_start = time.time()
+                    match = near_duplicate_index.query(perceptual_hash)
+                    if match is not None:
+                        (previous, prediction_id), distance = match
+                        batch_results[i] = dict(
+                            previous, processing_time=time.time() - lookup_start,
+                            near_duplicate={'prediction_id': prediction_id, 'distance': distance}
+                        )
+            misses = [i for i, result in enumerate(batch_results) if result is None]
+            
+            if misses:
+                # CUDA分類器を取得
+                classifier = get_app_classifier(ml_app)
+                
+                # バッチ推論実行（インデックスを使う場合は全クラスの確率を保存し、出力オプションは後で適用）
+                predicted = classifier.predict_batch(
+                    [pil_images[i] for i in misses],
+                    batch_size=ml_app.get_optimal_batch_size(),
+                    top_k=None if near_duplicate_index is not None else top_k,
+                    min_confidence=None if near_duplicate_index is not None else min_confidence
+                )
+                for i, result in zip(misses, predicted):
+                    batch_results[i] = result
             total_processing_time = time.time() - start_time
             
             # 結果とログ保存
             results = []
             for i, (result, img_file, img_info) in enumerate(zip(batch_results, images, image_infos)):
+                full_result = result
+                if near_duplicate_index is not None and 'error' not in result:
+                    result = apply_output_options(result, top_k, min_confidence)
+                
                 # ログ保存
                 prediction_log = PredictionLog.objects.create(
                     ml_app=ml_app,
@@ -183,8 +442,11 @@ class MLAppViewSet(viewsets.ReadOnlyModelViewSet):
                     output_data=result,
                     confidence_score=result.get('confidence', 0.0),
                     predicted_class=result.get('predicted_class', 'unknown'),
-                    processing_time=result.get('processing_time', 0.0)
+                    processing_time=result.get('processing_time', 0.0),
+                    perceptual_hash=to_signed(perceptual_hashes[i])
                 )
+                if near_duplicate_index is not None and 'error' not in result and 'near_duplicate' not in result:
+                    near_duplicate_index.add(perceptual_hashes[i], (full_result, prediction_log.id))
                 
                 # 画像保存
                 ImageUpload.objects.create(
@@ -203,6 +465,7 @@ class MLAppViewSet(viewsets.ReadOnlyModelViewSet):
                     'confidence': result['confidence'],
                     'class_probabilities': result['class_probabilities'],
                     'processing_time': result['processing_time'],
+                    'near_duplicate': result.get('near_duplicate'),
                     'image_info': img_info
                 })
             
@@ -223,19 +486,141 @@ class MLAppViewSet(viewsets.ReadOnlyModelViewSet):
                 'error': f'Batch prediction failed: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=True, methods=['post'], parser_classes=[NpyTensorParser, RawTensorParser])
+    @admission_controlled('interactive')
+    def predict_tensor(self, request, pk=None):
+        """前処理済み配列の推論（デコード・リサイズを省略）
+
+        ボディはモデルの入力サイズにリサイズ済み・正規化前の uint8 配列で、.npy
+        （application/x-npy, 形状 (H, W, 3) または (N, H, W, 3)）またはヘッダーなしの
+        行優先のバイト列（application/octet-stream, N 枚分を連結）。
+        (H, W, 3) の .npy と1枚分のバイト列は predict と同じ形式、それ以外は
+        predict_batch と同じ形式で返す。
+        """
+        import numpy as np
+        
+        ml_app = self.get_object()
+        
+        if ml_app.app_type != 'image_classification':
+            return Response({
+                'error': f'Tensor input not supported for {ml_app.app_type}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        array = request.data.get('array')
+        if array is None:
+            return Response({
+                'error': 'Request body must be application/x-npy or application/octet-stream'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            top_k, min_confidence = parse_output_options(request)
+        except ValueError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            classifier = get_app_classifier(ml_app)
+        except Exception as e:
+            logger.error(f"Prediction error: {e}")
+            return Response({
+                'error': f'Prediction failed: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        # 形状をモデルの入力サイズ (N, H, W, 3) に揃える
+        height, width = classifier.input_size
+        expected = (height, width, 3)
+        single = array.ndim == 3 or (array.ndim == 1 and array.size == height * width * 3)
+        if array.ndim == 1 and array.size % (height * width * 3) == 0:
+            array = array.reshape((-1,) + expected)
+        elif array.ndim == 3:
+            array = array[None]
+        if array.dtype != np.uint8 or array.ndim != 4 or array.shape[1:] != expected or not len(array):
+            return Response({
+                'error': f'Tensor must be uint8 with shape {list(expected)} or [N, {height}, {width}, 3]',
+                'received': {'dtype': str(array.dtype), 'shape': list(array.shape)}
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if len(array) > 32:
+            return Response({
+                'error': 'Maximum 32 tensors allowed per request'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            start_time = time.time()
+            batch_results = []
+            batch_size = ml_app.get_optimal_batch_size()
+            for i in range(0, len(array), batch_size):
+                batch_results.extend(classifier.predict_arrays(
+                    array[i:i + batch_size], top_k=top_k, min_confidence=min_confidence
+                ))
+            total_processing_time = time.time() - start_time
+            
+            results = []
+            for i, result in enumerate(batch_results):
+                prediction_log = PredictionLog.objects.create(
+                    ml_app=ml_app,
+                    input_data={
+                        'source': 'tensor',
+                        'content_type': request.content_type,
+                        'shape': list(expected),
+                    },
+                    output_data=result,
+                    confidence_score=result.get('confidence', 0.0),
+                    predicted_class=result.get('predicted_class', 'unknown'),
+                    processing_time=result['processing_time']
+                )
+                # 候補モデルのシャドー推論（前処理済み配列をそのまま使用）
+                transaction.on_commit(lambda row=array[i], result=result, log_id=prediction_log.id: maybe_submit_shadow(
+                    ml_app, row, result, result['processing_time'], log_id
+                ))
+                results.append({
+                    'prediction_id': prediction_log.id,
+                    'predicted_class': result['predicted_class'],
+                    'confidence': result['confidence'],
+                    'class_probabilities': result['class_probabilities'],
+                    'processing_time': result['processing_time']
+                })
+            
+            device = batch_results[0]['device'] if batch_results else 'unknown'
+            if single:
+                return Response(dict(results[0], ml_app=ml_app.name, device=device), status=status.HTTP_200_OK)
+            
+            return Response({
+                'batch_size': len(array),
+                'total_processing_time': total_processing_time,
+                'average_processing_time': total_processing_time / len(array),
+                'device': device,
+                'ml_app': ml_app.name,
+                'results': results
+            }, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            logger.error(f"Prediction error: {e}")
+            return Response({
+                'error': f'Prediction failed: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
     @action(detail=True, methods=['get'])
     def device_info(self, request, pk=None):
         """デバイス情報を取得"""
         ml_app = self.get_object()
         
         try:
-            classifier = get_classifier(device_type=ml_app.device_type)
+            from .devices import get_device_capabilities
+            
+            # ?refresh=1 指定時のみデバイス情報を再取得
+            refresh = request.query_params.get('refresh') in ('1', 'true')
+            capabilities = get_device_capabilities(refresh=refresh)
+            
+            classifier = get_app_classifier(ml_app)
             device_info = classifier.get_device_info()
             
             return Response({
                 'ml_app': ml_app.name,
                 'configured_device': ml_app.device_type,
-                'device_info': device_info
+                'device_info': device_info,
+                'device_capabilities': capabilities,
+                'model': get_model_registry().status(ml_app)
             }, status=status.HTTP_200_OK)
             
         except Exception as e:
@@ -245,22 +630,216 @@ class MLAppViewSet(viewsets.ReadOnlyModelViewSet):
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     @action(detail=True, methods=['post'])
+    @admission_controlled('background')
+    def validate_precision(self, request, pk=None):
+        """推論精度ごとの精度差・レイテンシ差を検証"""
+        ml_app = self.get_object()
+        
+        if ml_app.app_type not in ('image_classification', 'object_detection'):
+            return Response({
+                'error': f'Precision validation not supported for {ml_app.app_type}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            iterations = parse_iterations(request, 20, 5, 100)
+        except ValueError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            # 検証用画像（省略時は乱数画像を使用）
+            images = [decode_image(f)[0] for f in request.FILES.getlist('images')[:32]]
+        except ImageDecodeError as e:
+            return Response({
+                'error': str(e)
+            }, status=e.status_code)
+        
+        try:
+            classifier = get_app_classifier(ml_app)
+            validation_result = classifier.validate_precision(
+                images=images or None,
+                num_iterations=iterations
+            )
+            
+            return Response({
+                'ml_app': ml_app.name,
+                'validation': validation_result
+            }, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            logger.error(f"Precision validation error: {e}")
+            return Response({
+                'error': f'Precision validation failed: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=True, methods=['post'])
+    @admission_controlled('batch')
+    def embeddings(self, request, pk=None):
+        """画像の埋め込み（分類層直前の特徴量, float16）を取得
+
+        images に画像ファイル、または upload_ids に保存済みアップロードのIDを指定する。
+        保存済みアップロードの埋め込みは埋め込みストアに保存し、次回以降は再計算しない。
+        出力形式は output=npy（既定）/ raw / json。
+        """
+        ml_app = self.get_object()
+        
+        if ml_app.app_type != 'image_classification':
+            return Response({
+                'error': f'Embeddings not supported for {ml_app.app_type}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        output = request.query_params.get('output') or request.data.get('output') or 'npy'
+        if output not in EMBEDDING_OUTPUTS:
+            return Response({
+                'error': f'output must be one of {", ".join(EMBEDDING_OUTPUTS)}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        images = request.FILES.getlist('images') or request.FILES.getlist('image')
+        upload_ids = request.data.get('upload_ids')
+        if not images and not upload_ids:
+            return Response({
+                'error': 'images or upload_ids is required'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if len(images) > 32:
+            return Response({
+                'error': 'Maximum 32 images allowed per request'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            classifier = get_app_classifier(ml_app)
+        except Exception as e:
+            logger.error(f"Embedding error: {e}")
+            return Response({
+                'error': f'Embedding failed: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        if images:
+            try:
+                pil_images = [decode_image(f, target_size=classifier.input_size)[0] for f in images]
+            except ImageDecodeError as e:
+                return Response({
+                    'error': str(e)
+                }, status=e.status_code)
+            embeddings = classifier.extract_embeddings_batch(
+                pil_images, batch_size=ml_app.get_optimal_batch_size()
+            )
+            return embeddings_response(embeddings, output)
+        
+        # 保存済みアップロード（カンマ区切りの文字列またはリスト）
+        if isinstance(upload_ids, str):
+            upload_ids = upload_ids.split(',')
+        try:
+            upload_ids = [int(i) for i in upload_ids]
+        except (TypeError, ValueError):
+            return Response({
+                'error': 'upload_ids must be a list of integers'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if len(upload_ids) > 1000:
+            return Response({
+                'error': 'Maximum 1000 upload_ids allowed per request'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        from .embedding_store import embed_uploads, get_embedding_store
+        uploads = ImageUpload.objects.filter(prediction_log__ml_app=ml_app, id__in=upload_ids).in_bulk()
+        missing = [i for i in upload_ids if i not in uploads]
+        if missing:
+            return Response({
+                'error': 'Uploads not found',
+                'missing': missing
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        embeddings, found = embed_uploads(
+            classifier, [uploads[i] for i in upload_ids],
+            store=get_embedding_store(classifier),
+            batch_size=ml_app.get_optimal_batch_size()
+        )
+        if not all(found):
+            return Response({
+                'error': 'Failed to load some uploads',
+                'failed': [i for i, ok in zip(upload_ids, found) if not ok]
+            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        return embeddings_response(embeddings, output, ids=upload_ids)
+
+    @action(detail=True, methods=['get'])
+    def shadow_stats(self, request, pk=None):
+        """候補モデルのシャドー推論の一致率・レイテンシ"""
+        ml_app = self.get_object()
+        
+        from django.db.models import Avg, Count, Q
+        from .models import ShadowPrediction
+        from .shadow import get_candidate_version, get_shadow_config, get_shadow_evaluator
+        
+        candidates = ShadowPrediction.objects.filter(ml_app=ml_app).values('candidate_version').annotate(
+            samples=Count('id'),
+            agreements=Count('id', filter=Q(agreed=True)),
+            avg_primary_latency=Avg('primary_latency'),
+            avg_shadow_latency=Avg('shadow_latency'),
+            avg_primary_confidence=Avg('primary_confidence'),
+            avg_shadow_confidence=Avg('shadow_confidence'),
+        ).order_by('candidate_version')
+        
+        results = []
+        for candidate in candidates:
+            candidate['agreement_rate'] = candidate['agreements'] / candidate['samples']
+            candidate['latency_delta'] = candidate['avg_shadow_latency'] - candidate['avg_primary_latency']
+            results.append(candidate)
+        
+        shadow_config = get_shadow_config(ml_app)
+        return Response({
+            'ml_app': ml_app.name,
+            'active_candidate': get_candidate_version(shadow_config) if shadow_config else None,
+            'sample_rate': shadow_config.get('sample_rate') if shadow_config else None,
+            'candidates': results,
+            'executor': get_shadow_evaluator().stats()
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['get'])
+    def coalescing_stats(self, request, pk=None):
+        """同一リクエストの推論結果共有・近似重複画像の結果再利用の統計（節約できた計算回数）"""
+        ml_app = self.get_object()
+        return Response({
+            'ml_app': ml_app.name,
+            'enabled': coalescing_enabled(),
+            'coalescing': get_request_coalescer().stats(group=ml_app.pk),
+            'near_duplicate': near_duplicate_stats(ml_app)
+        }, status=status.HTTP_200_OK)
+
+    @action(detail=True, methods=['post'])
+    @admission_controlled('background')
     def benchmark(self, request, pk=None):
         """推論速度ベンチマーク"""
         ml_app = self.get_object()
         
-        if ml_app.app_type != 'image_classification':
+        if ml_app.app_type not in ('image_classification', 'object_detection') + TEXT_APP_TYPES:
             return Response({
                 'error': f'Benchmark not supported for {ml_app.app_type}'
             }, status=status.HTTP_400_BAD_REQUEST)
         
-        iterations = request.data.get('iterations', 50)
-        iterations = int(iterations)  # 文字列を整数に変換
-        iterations = min(max(iterations, 10), 200)  # 10-200の範囲
+        try:
+            iterations = parse_iterations(request, 50, 10, 200)
+        except ValueError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            classifier = get_classifier(device_type=ml_app.device_type)
-            benchmark_result = classifier.benchmark(num_iterations=iterations)
+            classifier = get_app_classifier(ml_app)
+            
+            if request.data.get('source') == 'tensor_cache':
+                # 前処理済みテンソルキャッシュから直接推論（デコードなし）
+                from .tensor_cache import get_tensor_cache
+                cache = get_tensor_cache(classifier.preprocess_config())
+                if cache is None or not len(cache):
+                    return Response({
+                        'error': 'Tensor cache is disabled or empty'
+                    }, status=status.HTTP_400_BAD_REQUEST)
+                batch_size = ml_app.get_optimal_batch_size()
+                batches = (batch for _, batch in cache.iter_batches(batch_size))
+                benchmark_result = classifier.benchmark_arrays(batches)
+            else:
+                benchmark_result = classifier.benchmark(num_iterations=iterations)
             
             return Response({
                 'ml_app': ml_app.name,
@@ -290,6 +869,174 @@ class MLAppViewSet(viewsets.ReadOnlyModelViewSet):
         output_serializer = PredictionOutputSerializer(output_data)
         return Response(output_serializer.data)
     
+    def run_detection(self, request, ml_app, image_files, single=False):
+        """物体検知（検出結果はボックス・スコア・ラベルの並列配列）
+
+        top_k は画像あたりの最大検出数、min_confidence はスコアの閾値として扱う。
+        single=True の場合は1枚分の結果をそのまま返す（predict 用）。
+        """
+        try:
+            top_k, min_confidence = parse_output_options(request)
+        except ValueError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            detector = get_app_classifier(ml_app)
+        except Exception as e:
+            logger.error(f"Detection error: {e}")
+            return Response({
+                'error': f'Detection failed: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        # 検出器の入力サイズ付近まで縮小デコード（ボックスは元画像の座標に戻す）
+        pil_images = []
+        image_infos = []
+        for image_file in image_files:
+            try:
+                image, decoded_info = decode_image(image_file, target_size=detector.input_size)
+            except ImageDecodeError as e:
+                return Response({
+                    'error': f'{image_file.name}: {e}'
+                }, status=e.status_code)
+            pil_images.append(image)
+            image_infos.append({
+                'filename': image_file.name,
+                'size': image_file.size,
+                'width': decoded_info['width'],
+                'height': decoded_info['height'],
+                'format': decoded_info['format']
+            })
+        
+        try:
+            start_time = time.time()
+            detections = detector.predict_batch(
+                pil_images,
+                batch_size=ml_app.get_optimal_batch_size(),
+                top_k=top_k,
+                min_confidence=min_confidence,
+                original_sizes=[(info['width'], info['height']) for info in image_infos]
+            )
+            total_processing_time = time.time() - start_time
+            
+            results = []
+            for result, image_file, image_info in zip(detections, image_files, image_infos):
+                prediction_log = PredictionLog.objects.create(
+                    ml_app=ml_app,
+                    input_data=image_info,
+                    output_data=result,
+                    confidence_score=result['scores'][0] if result['scores'] else 0.0,
+                    predicted_class=result['labels'][0] if result['labels'] else None,
+                    processing_time=result['processing_time']
+                )
+                ImageUpload.objects.create(
+                    prediction_log=prediction_log,
+                    image=image_file,
+                    original_filename=image_file.name,
+                    file_size=image_file.size,
+                    image_width=image_info['width'],
+                    image_height=image_info['height']
+                )
+                results.append({
+                    'prediction_id': prediction_log.id,
+                    'filename': image_info['filename'],
+                    'num_detections': result['num_detections'],
+                    'boxes': result['boxes'],
+                    'scores': result['scores'],
+                    'labels': result['labels'],
+                    'processing_time': result['processing_time'],
+                    'image_info': image_info
+                })
+            
+            device = detections[0]['device'] if detections else 'unknown'
+            if single:
+                return Response(dict(results[0], ml_app=ml_app.name, device=device), status=status.HTTP_200_OK)
+            
+            return Response({
+                'batch_size': len(image_files),
+                'total_processing_time': total_processing_time,
+                'average_processing_time': total_processing_time / len(image_files),
+                'device': device,
+                'ml_app': ml_app.name,
+                'results': results
+            }, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            logger.error(f"Detection error: {e}")
+            return Response({
+                'error': f'Detection failed: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
+    def run_text_classification(self, request, ml_app, field):
+        """テキスト分類・感情分析（field='text' は1件、'texts' はバッチ）
+
+        トークナイズはメモ化され、バッチは長さ順にまとめて推論する（結果は入力順）。
+        """
+        if not ml_app.model_file_path:
+            # テキスト分類にはデモ用のモデルがないため学習済みモデルが必須
+            return Response({
+                'error': 'Text apps require a trained model file (model_file_path)'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            texts = parse_texts(request, field)
+            top_k, min_confidence = parse_output_options(request)
+        except ValueError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            classifier = get_app_classifier(ml_app)
+            
+            start_time = time.time()
+            batch_results = classifier.predict_texts(
+                texts,
+                batch_size=ml_app.get_optimal_batch_size(),
+                top_k=top_k,
+                min_confidence=min_confidence
+            )
+            total_processing_time = time.time() - start_time
+            
+            results = []
+            for text, result in zip(texts, batch_results):
+                prediction_log = PredictionLog.objects.create(
+                    ml_app=ml_app,
+                    input_data={'text': text, 'length': len(text), 'num_tokens': result['num_tokens']},
+                    output_data=result,
+                    confidence_score=result['confidence'],
+                    predicted_class=result['predicted_class'],
+                    processing_time=result['processing_time']
+                )
+                results.append({
+                    'prediction_id': prediction_log.id,
+                    'predicted_class': result['predicted_class'],
+                    'confidence': result['confidence'],
+                    'class_probabilities': result['class_probabilities'],
+                    'num_tokens': result['num_tokens'],
+                    'processing_time': result['processing_time']
+                })
+            
+            device = batch_results[0]['device'] if batch_results else 'unknown'
+            if field == 'text':
+                return Response(dict(results[0], ml_app=ml_app.name, device=device), status=status.HTTP_200_OK)
+            
+            return Response({
+                'batch_size': len(texts),
+                'total_processing_time': total_processing_time,
+                'average_processing_time': total_processing_time / len(texts),
+                'device': device,
+                'ml_app': ml_app.name,
+                'results': results
+            }, status=status.HTTP_200_OK)
+            
+        except Exception as e:
+            logger.error(f"Text prediction error: {e}")
+            return Response({
+                'error': f'Prediction failed: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    
     def dummy_prediction(self, ml_app, input_data):
         """ダミー推論処理"""
         # 実際の実装では、ここで機械学習モデルを呼び出します
@@ -0,0 +1,169 @@
+"""
+起動時のモデル事前読み込み・ウォームアップとレディネス管理
+
+AppConfig.ready() からバックグラウンドスレッドで有効な MLApp のモデルを
+読み込み、設定されたバッチサイズで推論を事前実行する。完了するまで
+/readyz は 503 を返し、ロードバランサーが未ウォームアップのワーカーへ
+リクエストを振り分けないようにする。読み込み・ウォームアップに失敗したアプリが
+ある場合も、REQUIRE_ALL_APPS（既定）では 503 のまま失敗したアプリを返す。
+"""
+import os
+import sys
+import time
+import logging
+import threading
+from typing import Dict
+
+from django.apps import apps
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# ウォームアップ状態（disabled / pending / warming / ready / failed）
+_state = {
+    'status': 'disabled',
+    'started_at': None,
+    'finished_at': None,
+    'apps': {},
+    'failed_apps': [],
+    'error': None,
+}
+_state_lock = threading.Lock()
+_warmup_thread = None
+
+# ウォームアップ対象のアプリケーションサーバー
+SERVER_PROGRAMS = ('gunicorn', 'uwsgi', 'uvicorn', 'daphne', 'hypercorn', 'waitress-serve')
+
+
+def should_warmup() -> bool:
+    """このプロセスで事前読み込みを行うか判定"""
+    if not _get_setting('ENABLED', True):
+        return False
+
+    # 環境変数 INFERENCE_WARMUP で明示的に指定可能
+    forced = os.environ.get('INFERENCE_WARMUP')
+    if forced is not None:
+        return forced.lower() in ('1', 'true', 'yes')
+
+    program = os.path.basename(sys.argv[0]) if sys.argv else ''
+    if program in ('manage.py', 'django-admin'):
+        # migrate 等の管理コマンドではモデルを読み込まない
+        command = sys.argv[1] if len(sys.argv) > 1 else ''
+        if command != 'runserver':
+            return False
+        # 自動リロード有効時は実際にリクエストを処理する子プロセスのみ
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+
+    # スクリプトからの django.setup() では読み込まず、アプリケーションサーバーのみ
+    return program in SERVER_PROGRAMS
+
+
+def start_warmup():
+    """バックグラウンドでウォームアップを開始"""
+    global _warmup_thread
+    with _state_lock:
+        if _warmup_thread is not None:
+            return
+        _state.update({'status': 'pending', 'started_at': time.time()})
+        _warmup_thread = threading.Thread(target=_run_warmup, name='inference-warmup', daemon=True)
+        _warmup_thread.start()
+
+
+def warmup_models() -> Dict:
+    """有効な MLApp のモデルを読み込んでウォームアップ（同期実行）"""
+    from .models import MLApp
+    from .model_registry import TEXT_APP_TYPES, get_model_key, get_model_registry
+    from .autotune import get_tuned_batch_size, tune_batch_size
+    from .autotune import _get_setting as _get_autotune_setting
+    from .devices import get_device_capabilities
+
+    # デバイス情報は起動時に一度だけ取得してキャッシュ
+    get_device_capabilities()
+
+    batch_sizes = _get_setting('BATCH_SIZES', [1])
+    iterations = _get_setting('ITERATIONS', 2)
+
+    results = {}
+    warmed = {}
+    for ml_app in MLApp.objects.filter(is_active=True, app_type__in=('image_classification', 'object_detection') + TEXT_APP_TYPES):
+        start_time = time.time()
+        try:
+            classifier = get_model_registry().get_classifier(ml_app)
+        except Exception as e:
+            # 読み込めないアプリ（モデルファイル未設定のテキストアプリ等）は記録して続行
+            logger.error(f"Failed to load model for {ml_app.name}: {e}")
+            results[ml_app.id] = {'error': str(e)}
+            continue
+        key = get_model_key(ml_app)
+        if key in warmed:
+            # 同一設定・同一バージョンの分類器は共有されるため再実行しない
+            results[ml_app.id] = warmed[key]
+            continue
+
+        if (_get_autotune_setting('ON_WARMUP', False) and ml_app.app_type == 'image_classification'
+                and get_tuned_batch_size(ml_app) is None):
+            # このデバイスで未調整の場合はバッチサイズを自動調整
+            tune_batch_size(ml_app)
+        app_batch_sizes = sorted(set(batch_sizes) | {ml_app.get_optimal_batch_size()})
+        try:
+            result = classifier.warmup(batch_sizes=app_batch_sizes, iterations=iterations)
+        except Exception as e:
+            logger.error(f"Failed to warm up {ml_app.name}: {e}")
+            results[ml_app.id] = {'error': str(e)}
+            continue
+        result['total_time'] = time.time() - start_time
+        results[ml_app.id] = warmed[key] = result
+        logger.info(f"Warmed up {ml_app.name} in {result['total_time']:.2f}s")
+
+    return results
+
+
+def get_readiness() -> Dict:
+    """レディネス状態を取得"""
+    with _state_lock:
+        state = dict(_state)
+    # ウォームアップ無効時は常にリクエストを受け付ける
+    state['ready'] = state['status'] in ('disabled', 'ready')
+    return state
+
+
+def is_ready() -> bool:
+    """リクエストを受け付け可能か"""
+    return get_readiness()['ready']
+
+
+def _run_warmup():
+    """ウォームアップスレッド本体"""
+    from django.db import connection
+
+    # アプリレジストリの初期化完了を待ってからDBにアクセス
+    while not apps.ready:
+        time.sleep(0.1)
+
+    _set_state(status='warming')
+    try:
+        results = warmup_models()
+        failed_apps = sorted(app_id for app_id, result in results.items() if 'error' in result)
+        if failed_apps and _get_setting('REQUIRE_ALL_APPS', True):
+            # 失敗したアプリへのリクエストは 500 になるため、リクエストを受け付けない
+            logger.error(f"Inference warm-up failed for apps: {failed_apps}")
+            _set_state(status='failed', apps=results, failed_apps=failed_apps,
+                       error=f'Failed to load or warm up apps: {failed_apps}', finished_at=time.time())
+            return
+        _set_state(status='ready', apps=results, failed_apps=failed_apps, finished_at=time.time())
+        logger.info("Inference warm-up completed")
+    except Exception as e:
+        logger.error(f"Inference warm-up failed: {e}")
+        _set_state(status='failed', error=str(e), finished_at=time.time())
+    finally:
+        connection.close()
+
+
+def _set_state(**kwargs):
+    with _state_lock:
+        _state.update(kwargs)
+
+
+def _get_setting(name: str, default=None):
+    """settings.INFERENCE_WARMUP から設定値を取得"""
+    return getattr(settings, 'INFERENCE_WARMUP', {}).get(name, default)